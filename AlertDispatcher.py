@@ -0,0 +1,393 @@
+#!/usr/bin/python3
+
+"""Background e-mail alert queue shared by ``MainCode`` and ``StorageMonitor``.
+
+Callers hand an alert to ``submit_alert`` and return immediately; a daemon
+thread does the slow work.  Alerts that arrive within ``Email_Digest_Sec`` of
+each other are sent as one digest, identical alerts are collapsed (and
+suppressed entirely for ``Email_Dedup_Sec`` after they were last sent), and
+the SMTP connection and the host IP lookup are reused between messages.
+Pending alerts are flushed when the interpreter exits.
+"""
+
+import atexit
+import base64
+import queue
+import threading
+import time
+from datetime import datetime
+
+try:
+    import netifaces  # type: ignore
+except Exception:  # pragma: no cover - optional dependency on the Pi
+    netifaces = None
+
+
+def _now_str():
+    return datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+
+
+def decode_password(encoded):
+    """Decode the ``rounds|||base64`` ``WD_Pass`` format used in ``userInfo.in``."""
+    rounds = 1
+    secret = ""
+    parts = encoded.split("|||") if encoded else []
+    if parts:
+        if parts[0].isdigit():
+            rounds = int(parts[0])
+        secret = parts[1] if len(parts) > 1 else ""
+    for _ in range(max(1, rounds)):
+        try:
+            secret = base64.b64decode(secret)
+        except Exception:
+            break
+    if isinstance(secret, (bytes, bytearray)):
+        try:
+            secret = secret.decode("utf-8")
+        except Exception:
+            secret = secret.decode("latin-1", "ignore")
+    else:
+        secret = str(secret)
+    return secret
+
+
+def resolve_ip():
+    if netifaces is None:
+        return "unknown"
+    try:
+        return netifaces.ifaddresses("eth0")[netifaces.AF_INET][0]["addr"]
+    except Exception:
+        return "unknown"
+
+
+class Alert(object):
+    """One notification waiting to be delivered."""
+
+    def __init__(self, subject, message, on_error=None):
+        self.subject = subject
+        self.message = message
+        self.on_error = on_error
+        self.created = _now_str()
+        self.count = 1
+
+    @property
+    def key(self):
+        return (self.subject, self.message)
+
+
+class _Flush(object):
+    """Queue marker asking the worker to deliver what it holds right away."""
+
+    def __init__(self, stop=False):
+        self.stop = stop
+        self.done = threading.Event()
+
+
+class AlertDispatcher(threading.Thread):
+    """Daemon thread that batches alerts and sends them over a reused SMTP session."""
+
+    def __init__(
+        self,
+        user_config,
+        digest_sec=30.0,
+        dedup_sec=600.0,
+        keepalive_sec=240.0,
+        ip_refresh_sec=3600.0,
+        max_queue=1000,
+        name="AlertDispatcher",
+    ):
+        super(AlertDispatcher, self).__init__(name=name)
+        self.daemon = True
+        self.user_config = dict(user_config or {})
+        self.digest_sec = max(0.0, float(digest_sec))
+        self.dedup_sec = max(0.0, float(dedup_sec))
+        self.keepalive_sec = max(0.0, float(keepalive_sec))
+        self.ip_refresh_sec = float(ip_refresh_sec)
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._server = None
+        self._server_used = 0.0
+        self._ip = None
+        self._ip_time = 0.0
+        self._last_sent = {}
+        self._suppressed = {}
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.suppressed = 0
+
+    @classmethod
+    def from_config(cls, user_config):
+        """Build a dispatcher from the optional ``Email_*`` keys."""
+        return cls(
+            user_config,
+            digest_sec=user_config.get("Email_Digest_Sec", 30),
+            dedup_sec=user_config.get("Email_Dedup_Sec", 600),
+            keepalive_sec=user_config.get("Email_SMTP_Keepalive_Sec", 240),
+        )
+
+    @property
+    def enabled(self):
+        return self.user_config.get("Enable_Email", "false").lower() == "true"
+
+    def submit(self, subject, message, on_error=None):
+        """Queue an alert without blocking.  Returns ``False`` if it was not queued."""
+        if not self.enabled:
+            return False
+        try:
+            self._queue.put_nowait(Alert(subject, message, on_error))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def flush(self, timeout=30.0, stop=False):
+        """Deliver queued alerts now and wait up to ``timeout`` seconds."""
+        if not self.is_alive():
+            return False
+        marker = _Flush(stop)
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return False
+        return marker.done.wait(timeout)
+
+    def stop(self, timeout=30.0):
+        return self.flush(timeout, stop=True)
+
+    # ---- worker side
+
+    def run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.keepalive_sec or None)
+            except queue.Empty:
+                self._close_server()
+                continue
+
+            batch = []
+            marker = item if isinstance(item, _Flush) else None
+            if marker is None:
+                batch.append(item)
+                # Collect everything that arrives within the digest window
+                windowEnd = time.monotonic() + self.digest_sec
+                while True:
+                    remaining = windowEnd - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if isinstance(item, _Flush):
+                        marker = item
+                        break
+                    batch.append(item)
+
+            try:
+                if batch:
+                    self._deliver(batch)
+            except Exception:
+                # The dispatcher must never bring down the host application.
+                pass
+            if marker is not None:
+                if marker.stop:
+                    self._close_server()
+                    marker.done.set()
+                    return
+                marker.done.set()
+
+    def _collapse(self, batch):
+        merged = {}
+        for alert in batch:
+            if alert.key in merged:
+                merged[alert.key].count += 1
+            else:
+                merged[alert.key] = alert
+        now = time.monotonic()
+        alerts = []
+        for key, alert in merged.items():
+            last = self._last_sent.get(key)
+            if last is not None and now - last < self.dedup_sec:
+                self._suppressed[key] = self._suppressed.get(key, 0) + alert.count
+                self.suppressed += alert.count
+                continue
+            alert.count += self._suppressed.pop(key, 0)
+            alerts.append(alert)
+        return alerts
+
+    def _ip_address(self):
+        now = time.monotonic()
+        if self._ip is None or now - self._ip_time > self.ip_refresh_sec:
+            self._ip = resolve_ip()
+            self._ip_time = now
+        return self._ip
+
+    def _render(self, alerts):
+        cfg = self.user_config
+        box = cfg.get("Box_Name", "")
+        if len(alerts) == 1:
+            alert = alerts[0]
+            subject = alert.subject + " in box: " + box
+            sections = [alert.message]
+            if alert.count > 1:
+                sections.append("(This alert was raised {} times.)".format(alert.count))
+        else:
+            subject = "{} alerts in box: {}".format(len(alerts), box)
+            sections = []
+            for i, alert in enumerate(alerts, 1):
+                header = "[{}] {} ({})".format(i, alert.subject, alert.created)
+                if alert.count > 1:
+                    header += " x{}".format(alert.count)
+                sections.append(header + "\n" + alert.message)
+
+        body = "".join(
+            [
+                "Hello ",
+                cfg.get("Name", "User"),
+                ",\n\n",
+                "\n\n".join(sections),
+                "\n\n",
+                "Date and Time: ",
+                _now_str(),
+                "\n\n",
+                "The IP address: ",
+                self._ip_address(),
+                "\n\n",
+                "-RPi Watchdog",
+            ]
+        )
+        return subject, body
+
+    def _connect(self):
+        import smtplib  # loaded with the first alert, not at MainCode startup
+
+        cfg = self.user_config
+        smtpAddress = cfg.get("WD_SMTP", "").lower()
+        smtpPort = int(cfg.get("WD_SMTP_Port", 465))
+        if cfg.get("WD_SSL", "true").lower() == "true":
+            server = smtplib.SMTP_SSL(smtpAddress, smtpPort)
+        else:
+            server = smtplib.SMTP(smtpAddress, smtpPort)
+        server.ehlo()
+        emailUser = cfg.get("WD_Email", "")
+        if emailUser:
+            server.login(emailUser, decode_password(cfg.get("WD_Pass", "")))
+        return server
+
+    def _get_server(self):
+        if self._server is not None:
+            fresh = time.monotonic() - self._server_used < self.keepalive_sec
+            try:
+                if fresh and self._server.noop()[0] == 250:
+                    return self._server
+            except Exception:
+                pass
+            self._close_server()
+        self._server = self._connect()
+        return self._server
+
+    def _close_server(self):
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except Exception:
+            pass
+        self._server = None
+
+    def _deliver(self, batch):
+        alerts = self._collapse(batch)
+        if not alerts:
+            return
+        cfg = self.user_config
+        emailUser = cfg.get("WD_Email", "")
+        recipientEmail = cfg.get("Email", "")
+        subject, body = self._render(alerts)
+        from email.mime.text import MIMEText
+
+        msg = MIMEText(body)
+        msg["Subject"] = subject
+        msg["From"] = emailUser
+        msg["To"] = recipientEmail
+
+        error = None
+        for attempt in range(2):
+            try:
+                # A reused connection may have been dropped by the server; retry once
+                self._get_server().sendmail(emailUser, [recipientEmail], msg.as_string())
+                self._server_used = time.monotonic()
+                error = None
+                break
+            except Exception as e:
+                error = e
+                self._close_server()
+
+        if error is None:
+            self.sent += 1
+            now = time.monotonic()
+            for alert in alerts:
+                self._last_sent[alert.key] = now
+            return
+
+        self.failed += 1
+        for alert in alerts:
+            if alert.on_error is not None:
+                try:
+                    alert.on_error(error)
+                except Exception:
+                    pass
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "suppressed": self.suppressed,
+        }
+
+
+_dispatchers = {}
+_dispatchers_lock = threading.Lock()
+
+
+def _config_key(user_config):
+    return tuple(
+        user_config.get(k, "") for k in ("Email", "WD_Email", "Box_Name", "Subject_Name")
+    )
+
+
+def get_dispatcher(user_config):
+    """Return the running dispatcher for this recipient/box, starting it if needed."""
+    key = _config_key(user_config)
+    with _dispatchers_lock:
+        dispatcher = _dispatchers.get(key)
+        if dispatcher is None or not dispatcher.is_alive():
+            dispatcher = AlertDispatcher.from_config(user_config)
+            dispatcher.start()
+            _dispatchers[key] = dispatcher
+    return dispatcher
+
+
+def submit_alert(user_config, subject, message, on_error=None):
+    """Queue an e-mail alert; never blocks the caller."""
+    if user_config.get("Enable_Email", "false").lower() != "true":
+        return False
+    try:
+        return get_dispatcher(user_config).submit(subject, message, on_error)
+    except Exception:
+        return False
+
+
+def flush_all(timeout=30.0):
+    """Deliver pending alerts of every dispatcher (called at exit)."""
+    with _dispatchers_lock:
+        dispatchers = list(_dispatchers.values())
+    for dispatcher in dispatchers:
+        try:
+            dispatcher.stop(timeout)
+        except Exception:
+            pass
+
+
+atexit.register(flush_all)
@@ -0,0 +1,295 @@
+#!/usr/bin/python3
+
+"""Streaming capture of the Teensy analog serial into ``an.*`` event files.
+
+The Teensy streams one ``A,<smTime>,<pin1>,<pin2>,...`` line per millisecond
+on the analog USB serial and reports ``99`` / ``98`` on the main serial when an
+analog saving window opens and closes.  ``AnalogCapture`` decodes the sample
+lines into a preallocated NumPy ring holding the most recent
+``Before_Buffer`` samples (plus some slack for the skew between the two USB
+ports).  When a ``99`` arrives the pre-event samples are taken from the ring
+and written to the event file, every following sample is streamed straight to
+it, and the file is closed once the samples pass the ``98`` time.  Memory use
+is fixed no matter how long the session runs.
+
+Both markers carry the Teensy state machine time (``smTime``), the same clock
+as the sample lines, so windows are cut by sample time rather than by the
+order in which the two ports happen to be read.
+
+Windows are written as binary ``.anb`` files (see ``AnalogFile``) or, with
+``Analog_Format = text``, as ``smTime,pin1,...`` text lines.
+"""
+
+import time
+
+import AnalogFile
+import AnalogPyramid
+import SerialReader
+
+try:
+    import numpy  # type: ignore
+except Exception:  # pragma: no cover - required only when Analog is enabled
+    numpy = None
+
+
+class SampleRing(object):
+    """Fixed-size ring of sample rows ``[smTime, pin1, pin2, ...]``."""
+
+    def __init__(self, capacity, width):
+        self.capacity = max(1, int(capacity))
+        self.width = int(width)
+        self._data = numpy.zeros((self.capacity, self.width), dtype=numpy.int64)
+        self._next = 0
+        self.count = 0
+
+    def push(self, rows):
+        """Append a 2-D block of rows, overwriting the oldest ones."""
+        n = len(rows)
+        if n >= self.capacity:
+            self._data[:] = rows[n - self.capacity :]
+            self._next = 0
+            self.count = self.capacity
+            return
+        end = self._next + n
+        if end <= self.capacity:
+            self._data[self._next : end] = rows
+        else:
+            split = self.capacity - self._next
+            self._data[self._next :] = rows[:split]
+            self._data[: n - split] = rows[split:]
+        self._next = end % self.capacity
+        self.count = min(self.capacity, self.count + n)
+
+    def ordered(self):
+        """Copy of the held rows, oldest first."""
+        if self.count < self.capacity:
+            return self._data[: self.count].copy()
+        return numpy.concatenate((self._data[self._next :], self._data[: self._next]))
+
+    def clear(self):
+        self._next = 0
+        self.count = 0
+
+
+ANALOG_FORMATS = ("binary", "text")
+
+
+class AnalogWindow(object):
+    """One ``an.*`` event file, created with the first samples written to it."""
+
+    def __init__(
+        self, path, startTime, fmt="binary", pins=None, sample_rate=1000.0, levels=()
+    ):
+        self.path = path + AnalogFile.FILE_EXT if fmt == "binary" else path
+        self.start = startTime
+        self.stop = None
+        self.format = fmt
+        self.pins = pins
+        self.sample_rate = sample_rate
+        self.levels = levels
+        self.pyramid = None
+        self.epoch = time.time()
+        self.samples = 0
+        self.lastTime = None
+        self._handle = None
+
+    def _open(self, width):
+        if self.levels:
+            self.pyramid = AnalogPyramid.PyramidBuilder(self.path, width - 1, self.levels)
+        if self.format == "text":
+            return open(self.path, "w")
+        pins = self.pins if self.pins and len(self.pins) == width - 1 else [0] * (width - 1)
+        return AnalogFile.AnalogFileWriter(
+            self.path,
+            pins,
+            sample_rate=self.sample_rate,
+            epoch=self.epoch,
+            start_time=self.start,
+        )
+
+    def write(self, rows):
+        if not len(rows):
+            return
+        if self._handle is None:
+            self._handle = self._open(rows.shape[1])
+        if self.format == "text":
+            numpy.savetxt(self._handle, rows, fmt="%d", delimiter=",")
+        else:
+            self._handle.write(rows)
+        if self.pyramid is not None:
+            self.pyramid.add(rows)
+        self.samples += len(rows)
+        self.lastTime = int(rows[-1, 0])
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+        if self.pyramid is not None:
+            self.pyramid.close()
+            self.pyramid = None
+
+
+class AnalogCapture(object):
+    """Keep a pre-event ring of analog samples and write windows on ``99``/``98``.
+
+    ``before`` is the number of samples kept ahead of an event
+    (``Before_Buffer``), ``slack`` the extra samples held so a ``99`` that is
+    read late still finds its pre-event samples, and ``max_samples`` caps a
+    window whose ``98`` never arrives.  ``fmt`` is one of ``ANALOG_FORMATS``
+    and ``levels`` the decimation factors built next to every window.
+    """
+
+    def __init__(
+        self,
+        before,
+        slack=2000,
+        max_samples=60000,
+        max_line=4096,
+        fmt="binary",
+        sample_rate=1000.0,
+        levels=AnalogPyramid.DEFAULT_FACTORS,
+    ):
+        if numpy is None:
+            raise ImportError("numpy is required for analog capture")
+        if fmt not in ANALOG_FORMATS:
+            raise ValueError("Unknown analog format: {}".format(fmt))
+        self.format = fmt
+        self.sample_rate = float(sample_rate)
+        self.levels = tuple(levels)
+        self.before = max(0, int(before))
+        self.slack = max(0, int(slack))
+        self.max_samples = max(1, int(max_samples))
+        self.pins = None
+        self.ring = None
+        self.window = None
+        self._framer = SerialReader.LineFramer(max_line)
+        self._lastTime = None
+        self.samples = 0
+        self.malformed = 0
+        self.windows = 0
+        self.truncated = 0
+
+    def set_pins(self, pins):
+        """Pin numbers from the ``P`` tag; resets the ring if the width changes."""
+        self.pins = [p.strip() for p in pins if p.strip()]
+        self._ensure_ring(len(self.pins) + 1)
+
+    def _ensure_ring(self, width):
+        if self.ring is None or self.ring.width != width:
+            self.ring = SampleRing(self.before + self.slack, width)
+
+    def _parse(self, lines):
+        rows = [l.rstrip().split(",")[1:] for l in lines if l.startswith("A,")]
+        if not rows:
+            return None
+        try:
+            return numpy.array(rows, dtype=numpy.int64).reshape(len(rows), -1)
+        except ValueError:
+            # Ragged or corrupt lines: keep the rows that match the first width
+            width = self.ring.width if self.ring is not None else len(rows[-1])
+            good = []
+            for row in rows:
+                try:
+                    if len(row) == width:
+                        good.append([int(v) for v in row])
+                        continue
+                except ValueError:
+                    pass
+                self.malformed += 1
+            if not good:
+                return None
+            return numpy.array(good, dtype=numpy.int64)
+
+    def feed(self, data):
+        """Decode raw analog serial bytes and stream them to any open window."""
+        rows = self._parse(self._framer.feed(data))
+        if rows is None or rows.shape[1] < 2:
+            return
+        self._ensure_ring(rows.shape[1])
+        if self._lastTime is not None and rows[0, 0] < self._lastTime:
+            # State machine restarted: its clock starts again from zero
+            self._close_window()
+            self.ring.clear()
+        self._lastTime = int(rows[-1, 0])
+        self.samples += len(rows)
+
+        window = self.window
+        if window is not None and window.lastTime is None:
+            # Armed by an early 99: write the pre-event samples once the
+            # stream reaches its time, before this block can push them out
+            if self._lastTime < window.start:
+                self.ring.push(rows)
+                return
+            split = int(numpy.searchsorted(rows[:, 0], window.start))
+            self.ring.push(rows[:split])
+            self._write_held()
+            rows = rows[split:]
+        self.ring.push(rows)
+        if self.window is not None:
+            if self.window.lastTime is not None:
+                rows = rows[rows[:, 0] > self.window.lastTime]
+            self._write_post(rows)
+
+    def _write_post(self, rows):
+        window = self.window
+        if window.stop is not None:
+            done = rows[:, 0] >= window.stop
+            if done.any():
+                window.write(rows[: int(done.argmax()) + 1])
+                self._close_window()
+                return
+        room = self.max_samples - window.samples
+        if len(rows) >= room:
+            window.write(rows[:room])
+            self.truncated += 1
+            self._close_window()
+            return
+        window.write(rows)
+
+    def start(self, path, startTime):
+        """Open ``path`` for an event at ``startTime`` (the ``99`` report)."""
+        self._close_window()
+        self.window = AnalogWindow(
+            path, int(startTime), self.format, self.pins, self.sample_rate, self.levels
+        )
+        self.windows += 1
+        if self._lastTime is not None and self._lastTime >= self.window.start:
+            self._write_held()
+
+    def _write_held(self):
+        """Write the pre-event samples and any post samples already in the ring."""
+        held = self.ring.ordered()
+        pre = held[held[:, 0] < self.window.start]
+        self.window.write(pre[len(pre) - self.before :] if self.before else pre[:0])
+        self._write_post(held[held[:, 0] >= self.window.start])
+
+    def stop(self, stopTime):
+        """Close the open window once samples reach ``stopTime`` (the ``98`` report).
+
+        Returns ``False`` if no window was open.
+        """
+        window = self.window
+        if window is None:
+            return False
+        window.stop = int(stopTime)
+        if window.lastTime is not None and window.lastTime >= window.stop:
+            # Samples already passed the end of the window
+            self._close_window()
+        return True
+
+    def _close_window(self):
+        if self.window is not None:
+            self.window.close()
+            self.window = None
+
+    def close(self):
+        self._close_window()
+
+    def stats(self):
+        return {
+            "samples": self.samples,
+            "windows": self.windows,
+            "truncated": self.truncated,
+            "malformed": self.malformed + self._framer.malformed,
+        }
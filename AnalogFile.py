@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+
+"""Binary ``.anb`` analog event files.
+
+An ``.anb`` file stores the raw ADC words of one analog saving window instead
+of decimal text.  It starts with a fixed ``HEADER_SIZE`` header and continues
+with one frame per sample:
+
+- ``smTime`` as little-endian ``uint32`` (Teensy state machine time in ms), so
+  gaps in the stream stay visible
+- one little-endian ``uint16`` (or ``int16``) word per analog pin
+
+The header holds the magic, the pin numbers from the ``P`` tag, the sample
+rate, the host epoch at which the window was opened, the window start time
+and the number of frames written.
+
+``AnalogFileWriter`` preallocates the file in segments and writes through
+``mmap``; the frame count in the header is updated with every write, so a file
+left by a crash is still readable.  ``load_analog`` memory-maps a file and
+returns one ``numpy.memmap`` view per pin.
+"""
+
+import mmap
+import os
+import struct
+import time
+
+try:
+    import numpy  # type: ignore
+except Exception:  # pragma: no cover - required only to write/read .anb files
+    numpy = None
+
+
+MAGIC = b"ATANLG\x01\x00"
+HEADER_SIZE = 256
+FILE_EXT = ".anb"
+SAMPLE_TYPES = ("<u2", "<i2")
+
+# magic, numPins, sampleType, sampleRate, epoch, startTime, count
+_HEAD = struct.Struct("<8sH4sddqQ")
+_COUNT_OFFSET = _HEAD.size - 8
+_PINS_OFFSET = 64
+MAX_PINS = (HEADER_SIZE - _PINS_OFFSET) // 2
+
+
+def frame_dtype(numPins, sampleType="<u2"):
+    """NumPy dtype of one frame: ``smTime`` followed by ``pin0 .. pinN-1``."""
+    fields = [("smTime", "<u4")]
+    fields += [("pin{}".format(i), sampleType) for i in range(numPins)]
+    return numpy.dtype(fields)
+
+
+def _pin_number(pin):
+    try:
+        return int(pin)
+    except (TypeError, ValueError):
+        return 0
+
+
+def read_header(path):
+    """Return the header of an ``.anb`` file as a dict."""
+    with open(path, "rb") as handle:
+        head = handle.read(HEADER_SIZE)
+    if len(head) < HEADER_SIZE or not head.startswith(MAGIC):
+        raise ValueError("{} is not an analog .anb file".format(path))
+    magic, numPins, sampleType, sampleRate, epoch, startTime, count = _HEAD.unpack_from(head)
+    pins = list(struct.unpack_from("<{}H".format(numPins), head, _PINS_OFFSET))
+    return {
+        "pins": pins,
+        "sampleType": sampleType.rstrip(b"\0").decode("ascii"),
+        "sampleRate": sampleRate,
+        "epoch": epoch,
+        "startTime": startTime,
+        "count": count,
+    }
+
+
+class AnalogFileWriter(object):
+    """Append sample rows ``[smTime, pin1, ...]`` to an ``.anb`` file through ``mmap``."""
+
+    def __init__(
+        self,
+        path,
+        pins,
+        sample_rate=1000.0,
+        epoch=None,
+        start_time=0,
+        sample_type="<u2",
+        segment_frames=65536,
+    ):
+        if numpy is None:
+            raise ImportError("numpy is required to write .anb files")
+        if sample_type not in SAMPLE_TYPES:
+            raise ValueError("Unknown analog sample type: {}".format(sample_type))
+        if len(pins) > MAX_PINS:
+            raise ValueError("At most {} analog pins fit in the header".format(MAX_PINS))
+        self.path = path
+        self.pins = [_pin_number(p) for p in pins]
+        self.dtype = frame_dtype(len(self.pins), sample_type)
+        self.segment_bytes = max(1, int(segment_frames)) * self.dtype.itemsize
+        self.count = 0
+
+        head = bytearray(HEADER_SIZE)
+        _HEAD.pack_into(
+            head,
+            0,
+            MAGIC,
+            len(self.pins),
+            sample_type.encode("ascii"),
+            float(sample_rate),
+            time.time() if epoch is None else float(epoch),
+            int(start_time),
+            0,
+        )
+        struct.pack_into("<{}H".format(len(self.pins)), head, _PINS_OFFSET, *self.pins)
+        self._handle = open(path, "w+b")
+        self._handle.write(head)
+        self._size = HEADER_SIZE
+        self._map = None
+        self._grow()
+
+    @property
+    def closed(self):
+        return self._handle is None
+
+    def _grow(self):
+        """Extend the file by one preallocated segment and remap it."""
+        if self._map is not None:
+            self._map.close()
+        self._size += self.segment_bytes
+        self._handle.truncate(self._size)
+        self._map = mmap.mmap(self._handle.fileno(), self._size)
+
+    def write(self, rows):
+        n = len(rows)
+        if not n:
+            return
+        frames = numpy.empty(n, dtype=self.dtype)
+        frames["smTime"] = rows[:, 0]
+        for i in range(len(self.pins)):
+            frames["pin{}".format(i)] = rows[:, i + 1]
+        start = HEADER_SIZE + self.count * self.dtype.itemsize
+        end = start + frames.nbytes
+        while end > self._size:
+            self._grow()
+        self._map[start:end] = frames.tobytes()
+        self.count += n
+        struct.pack_into("<Q", self._map, _COUNT_OFFSET, self.count)
+
+    def flush(self):
+        if self._map is not None:
+            self._map.flush()
+
+    def close(self):
+        """Unmap and trim the unused preallocation."""
+        if self._handle is None:
+            return
+        try:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+            self._handle.truncate(HEADER_SIZE + self.count * self.dtype.itemsize)
+        finally:
+            self._handle.close()
+            self._handle = None
+
+
+def load_frames(path, mode="r"):
+    """Memory-map an ``.anb`` file as ``(header, frames)`` (requires NumPy)."""
+    if numpy is None:
+        raise ImportError("numpy is required to read .anb files")
+    header = read_header(path)
+    dtype = frame_dtype(len(header["pins"]), header["sampleType"])
+    available = (os.path.getsize(path) - HEADER_SIZE) // dtype.itemsize
+    count = min(header["count"], available)
+    if count == 0:
+        return header, numpy.zeros(0, dtype=dtype)
+    frames = numpy.memmap(path, dtype=dtype, mode=mode, offset=HEADER_SIZE, shape=(count,))
+    return header, frames
+
+
+def load_analog(path, mode="r"):
+    """Memory-map an ``.anb`` file.
+
+    Returns ``(header, channels)`` where ``channels`` maps ``"smTime"`` and every
+    pin number to a ``numpy.memmap`` view (requires NumPy).
+    """
+    header, frames = load_frames(path, mode)
+    channels = {"smTime": frames["smTime"]}
+    for i, pin in enumerate(header["pins"]):
+        channels[pin] = frames["pin{}".format(i)]
+    return header, channels
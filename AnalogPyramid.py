@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+
+"""Min/max/mean decimation levels for analog event files.
+
+While an analog window is written, ``PyramidBuilder`` also reduces its samples
+into coarser levels (by default every 10, 100 and 1000 samples).  Each level is
+stored next to the event file as ``<event file>.L<factor>.npy``, a NumPy
+structured array (written by ``ReportSidecar``) with the fields
+
+    smTime, pin0_min .. pinN_min, pin0_max .. pinN_max, pin0_mean .. pinN_mean
+
+where ``smTime`` is the time of the first sample in the bin.  Every level is
+computed from the raw samples, and the last, partial bin is written when the
+window closes.
+
+``query`` picks the coarsest level that still gives at least ``width`` points
+over the requested time range, so plotting hours of data only reads a few
+thousand bins.
+"""
+
+import os
+
+import AnalogFile
+import ReportSidecar
+
+try:
+    import numpy  # type: ignore
+except Exception:  # pragma: no cover - required only when Analog is enabled
+    numpy = None
+
+
+DEFAULT_FACTORS = (10, 100, 1000)
+
+
+def parse_factors(value):
+    """``"10,100,1000"`` -> ``(10, 100, 1000)``; ``""``/``"none"`` disables levels."""
+    value = str(value).strip().lower()
+    if value in ("", "none", "false"):
+        return ()
+    return tuple(sorted(set(int(v) for v in value.split(",") if int(v) > 1)))
+
+
+def level_path(path, factor):
+    return "{}.L{}.npy".format(path, factor)
+
+
+def level_fields(numPins):
+    fields = [("smTime", "<u4")]
+    for stat, code in (("min", "<i4"), ("max", "<i4"), ("mean", "<f4")):
+        fields += [("pin{}_{}".format(i, stat), code) for i in range(numPins)]
+    return fields
+
+
+def _reduce(block):
+    """``block`` is ``(bins, factor, 1 + pins)``; returns one row list per bin."""
+    values = block[:, :, 1:]
+    times = block[:, 0, 0].tolist()
+    mins = values.min(axis=1).tolist()
+    maxs = values.max(axis=1).tolist()
+    means = values.mean(axis=1).tolist()
+    return [[t] + lo + hi + mean for t, lo, hi, mean in zip(times, mins, maxs, means)]
+
+
+class PyramidLevel(object):
+    def __init__(self, path, factor, numPins):
+        self.factor = factor
+        self.sidecar = ReportSidecar.ReportSidecar(
+            level_path(path, factor), level_fields(numPins)
+        )
+        self._carry = None
+
+    def add(self, rows, final=False):
+        if self._carry is not None and len(self._carry):
+            rows = numpy.concatenate((self._carry, rows))
+        full = (len(rows) // self.factor) * self.factor
+        if full:
+            block = rows[:full].reshape(full // self.factor, self.factor, rows.shape[1])
+            self.sidecar.append_rows(_reduce(block))
+        self._carry = rows[full:]
+        if final and len(self._carry):
+            self.sidecar.append_rows(_reduce(self._carry[numpy.newaxis]))
+            self._carry = None
+
+    def close(self):
+        if self._carry is not None and len(self._carry):
+            self.add(self._carry[:0], final=True)
+        self.sidecar.close()
+
+
+class PyramidBuilder(object):
+    """Reduce sample rows ``[smTime, pin1, ...]`` into every decimation level."""
+
+    def __init__(self, path, numPins, factors=DEFAULT_FACTORS):
+        if numpy is None:
+            raise ImportError("numpy is required for analog decimation levels")
+        self.levels = [PyramidLevel(path, f, numPins) for f in factors]
+
+    def add(self, rows):
+        for level in self.levels:
+            level.add(rows)
+
+    def close(self):
+        for level in self.levels:
+            level.close()
+
+
+def available_levels(path):
+    """Decimation factors that exist on disk for an event file."""
+    base = os.path.basename(path) + ".L"
+    folder = os.path.dirname(path) or "."
+    factors = []
+    for name in os.listdir(folder):
+        if name.startswith(base) and name.endswith(".npy"):
+            try:
+                factors.append(int(name[len(base) : -4]))
+            except ValueError:
+                pass
+    return sorted(factors)
+
+
+def _load_text(path):
+    """``(smTime, values)`` of a text event file; ``values`` has one column per pin."""
+    rows = numpy.loadtxt(path, delimiter=",", dtype=numpy.int64, ndmin=2)
+    if not rows.size:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros((0, 0), dtype=numpy.int64)
+    return rows[:, 0], rows[:, 1:]
+
+
+def _time_range(path, header, factors, sampleRate):
+    """First and last smTime of an event file, from its frames or its finest level."""
+    if header is not None:
+        times = AnalogFile.load_frames(path)[1]["smTime"]
+        tail = 0.0
+    else:
+        times = ReportSidecar.load_records(level_path(path, factors[0]))["smTime"]
+        tail = factors[0] * 1000.0 / sampleRate  # the last bin starts at its first sample
+    if not len(times):
+        return 0.0, 0.0
+    return float(times[0]), float(times[-1]) + tail
+
+
+def _select(factor, times, mins, maxs, means, t0, t1):
+    lo = 0 if t0 is None else int(numpy.searchsorted(times, t0, side="right")) - 1
+    hi = len(times) if t1 is None else int(numpy.searchsorted(times, t1, side="right"))
+    lo = max(0, lo)
+    return factor, times[lo:hi], mins[lo:hi], maxs[lo:hi], means[lo:hi]
+
+
+def query(path, t0=None, t1=None, width=1000, sampleRate=1000.0):
+    """Return the coarsest data covering ``[t0, t1]`` (smTime ms) with ``width`` points.
+
+    The result is ``(factor, smTime, mins, maxs, means)`` where the three
+    value arrays have one column per pin.  ``factor`` is ``1`` for the raw
+    samples (then min = max = mean): from an ``.anb`` file when no level is
+    detailed enough, or from a text event file that has no levels.  An open
+    ``t0``/``t1`` stands for the first/last sample of the file.
+    """
+    factors = available_levels(path)
+    header = None
+    if path.endswith(AnalogFile.FILE_EXT):
+        header = AnalogFile.read_header(path)
+        sampleRate = header["sampleRate"] or sampleRate
+    elif not factors:
+        times, values = _load_text(path)
+        return _select(1, times, values, values, values, t0, t1)
+
+    start, stop = t0, t1
+    if start is None or stop is None:
+        first, last = _time_range(path, header, factors, sampleRate)
+        start = first if start is None else start
+        stop = last if stop is None else stop
+    span = max(0.0, (stop - start) * sampleRate / 1000.0)
+    factor = 1
+    for f in factors:
+        if span / f >= width:
+            factor = f
+
+    if factor == 1 and header is None:
+        factor = factors[0]  # text samples are only read when there are no levels
+    if factor == 1:
+        _, frames = AnalogFile.load_frames(path)
+        times = frames["smTime"]
+        mins = maxs = means = numpy.column_stack(
+            [frames[n] for n in frames.dtype.names[1:]]
+        )
+    else:
+        records = ReportSidecar.load_records(level_path(path, factor))
+        times = records["smTime"]
+
+        def pick(stat):
+            names = [n for n in records.dtype.names if n.endswith("_" + stat)]
+            return numpy.column_stack([records[n] for n in names])
+
+        mins, maxs, means = pick("min"), pick("max"), pick("mean")
+    return _select(factor, times, mins, maxs, means, t0, t1)
+
@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+
+"""Benchmark ``MainCode.printSerialOutput`` against a fake Teensy.
+
+For every rate/burst combination a ``FakeTeensy`` feeds synthetic (or
+replayed) lines through a pseudo-terminal into the real acquisition loop,
+which writes its session files to a temporary ``Output_Dir``.  The benchmark
+reports, per run:
+
+- lines/s actually written by the fake Teensy
+- CPU% of the MainCode process, excluding the fake Teensy thread
+- end-to-end latency (p50/p99) from the write into the pty to the moment the
+  report line is handed to the session writer
+- dropped report lines (sent but never handed to the writer)
+
+MainCode imports its Raspberry Pi modules (RPi.GPIO, pyserial, ntplib, PIL),
+so this runs on the Pi.  The desktop background change is skipped and the
+Teensy time sync is pushed out of the run.
+
+    python3 Benchmarks/AcquisitionBenchmark.py --rates 1000,10000,50000 --bursts 1,64
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import FakeTeensy  # noqa: E402
+from SerialIdleBenchmark import open_pty, percentile  # noqa: E402
+
+
+def bench_config(configPath, outputDir, overrides):
+    import MainCode
+
+    userConfig = MainCode.getUserConfig(configPath, "=")
+    userConfig.update(
+        {
+            "Subject_Name": "Benchmark",
+            "Output_Dir": outputDir,
+            "Enable_Email": "False",
+            "Analog": "False",
+            "TimeSyncFreq": "1000HR",
+            "Serial_TimeOut": "3600",
+            "Output_Name_Freq": "False",
+        }
+    )
+    userConfig.update(overrides)
+    return userConfig
+
+
+def run_once(configPath, lines, rate, burst, seconds, overrides):
+    import MainCode
+    import SessionWriters
+
+    workDir = tempfile.mkdtemp(prefix="acqbench-")
+    received = {}
+    originalWriteData = SessionWriters.SessionWriter.write_data
+
+    def timedWriteData(writer, line, words=None, *args, **kwargs):
+        if words is not None:
+            try:
+                received[int(words[1])] = time.monotonic()
+            except (IndexError, ValueError):
+                pass
+        return originalWriteData(writer, line, words, *args, **kwargs)
+
+    cwd = os.getcwd()
+    master, port = open_pty()
+    teensy = FakeTeensy.FakeTeensy(master, lines, rate, burst, seconds)
+    try:
+        # printSerialOutput writes log.out into the current directory
+        os.chdir(workDir)
+        SessionWriters.SessionWriter.write_data = timedWriteData
+        MainCode.changeDesktopBackground = lambda userConfig: None
+        MainCode.exitInst = MainCode.safeExit()
+        userConfig = bench_config(configPath, workDir, overrides)
+
+        loop = threading.Thread(
+            target=MainCode.printSerialOutput,
+            args=(port, False, userConfig, False, time.time()),
+            name="printSerialOutput",
+        )
+        cpu0 = time.process_time()
+        wall0 = time.monotonic()
+        loop.start()
+        teensy.start()
+        teensy.join()
+        # Let the loop drain what is still queued
+        drainEnd = time.monotonic() + 2.0
+        while time.monotonic() < drainEnd and len(received) < len(teensy.sent):
+            time.sleep(0.05)
+        wall = time.monotonic() - wall0
+        cpu = time.process_time() - cpu0 - teensy.cpu
+        MainCode.exitInst.exitStatus = True
+        loop.join(10.0)
+    finally:
+        SessionWriters.SessionWriter.write_data = originalWriteData
+        os.chdir(cwd)
+        os.close(master)
+        port.close()
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    latencies = [received[s] - t for s, t in teensy.sent.items() if s in received]
+    return {
+        "rate": rate,
+        "burst": burst,
+        "lines_per_sec": teensy.lines_sent / max(1e-9, teensy.seconds or wall),
+        "cpu_pct": 100.0 * cpu / max(1e-9, wall),
+        "lat_p50_ms": 1e3 * percentile(latencies, 50),
+        "lat_p99_ms": 1e3 * percentile(latencies, 99),
+        "dropped": len(teensy.sent) - len(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config", default=os.path.join(HERE, "..", "userInfo.in"))
+    parser.add_argument("--rates", default="1000,10000", help="lines per second")
+    parser.add_argument("--bursts", default="1,64", help="lines per pty write")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--replay", help="replay this capture instead of synthetic lines")
+    parser.add_argument("--mix", default="", help="e.g. report=0.9,trial=0.1")
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="override a userInfo.in key, e.g. --set Serial_Reader_Thread=False",
+    )
+    args = parser.parse_args()
+
+    try:
+        import MainCode  # noqa: F401
+    except ImportError as e:
+        sys.exit("MainCode cannot be imported here ({}); run on the Pi.".format(e))
+
+    overrides = dict(item.split("=", 1) for item in args.set)
+    print(
+        "{:>8}{:>7}{:>12}{:>8}{:>11}{:>11}{:>9}".format(
+            "rate", "burst", "lines/s", "CPU%", "p50 (ms)", "p99 (ms)", "dropped"
+        )
+    )
+    for rate in [float(r) for r in args.rates.split(",")]:
+        for burst in [int(b) for b in args.bursts.split(",")]:
+            if args.replay:
+                lines = FakeTeensy.replay_lines(args.replay, loop=True)
+            else:
+                lines = FakeTeensy.synthetic_lines(FakeTeensy.parse_mix(args.mix) or None)
+            r = run_once(args.config, lines, rate, burst, args.seconds, overrides)
+            print(
+                "{rate:>8.0f}{burst:>7}{lines_per_sec:>12.0f}{cpu_pct:>8.1f}"
+                "{lat_p50_ms:>11.2f}{lat_p99_ms:>11.2f}{dropped:>9}".format(**r)
+            )
+
+
+if __name__ == "__main__":
+    main()
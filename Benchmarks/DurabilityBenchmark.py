@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+
+"""Throughput of ``SessionWriter`` against its durability window.
+
+For every ``Output_Sync`` setting the benchmark writes synthetic 8-field
+report lines (and a trial line every 100) through a ``SessionWriter`` in a
+temporary folder on ``--dir`` (use the SD card or USB disk the Pi writes to)
+and reports:
+
+- lines/s and CPU% of the writing process (fsync threads included)
+- number of fsyncs and the slowest one
+- the measured durability window: the oldest line that was still only in
+  the page cache when its fsync completed (``none`` has no bound)
+
+Modes are ``none``, ``always`` and ``group:<sync_sec>``.  This only needs the
+repository modules, so it also runs off the Pi.
+
+    python3 Benchmarks/DurabilityBenchmark.py --dir /home/pi/Data --modes none,group:0.2,group:1,always
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import SessionWriters  # noqa: E402
+
+
+def run_once(mode, lines, rate, flushSec, directory):
+    method, _, syncSec = mode.partition(":")
+    policy = SessionWriters.FlushPolicy(
+        max_seconds=flushSec,
+        sync=method,
+        sync_sec=float(syncSec or 0.5),
+    )
+    workDir = tempfile.mkdtemp(prefix="durabench-", dir=directory)
+    writer = SessionWriters.SessionWriter(
+        os.path.join(workDir, "Benchmark.dat"),
+        os.path.join(workDir, "Benchmark.trial.csv"),
+        policy,
+        trialHeader="eventCode,port1Prob,port2Prob,chosenPort,rewarded,trialId,blockId\n",
+    )
+    interval = 1.0 / rate if rate > 0 else 0.0
+    try:
+        cpu0 = time.process_time()
+        start = nextTime = time.monotonic()
+        for i in range(lines):
+            words = ["11", str(i), "6", "1", str(i * 10), str(1700000000 + i // 1000), "0", "0"]
+            writer.write_data(",".join(words) + "\n", words)
+            if i % 100 == 99:
+                writer.write_trial("200,80,20,1,1,{},{}\n".format(i // 100, i // 10000))
+            writer.maybe_flush()
+            if interval:
+                nextTime += interval
+                delay = nextTime - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+        writer.close()
+        wall = time.monotonic() - start
+        cpu = time.process_time() - cpu0
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    stats = writer.commit.stats() if writer.commit is not None else {}
+    return {
+        "mode": mode,
+        "lines_per_sec": lines / max(1e-9, wall),
+        "cpu_pct": 100.0 * cpu / max(1e-9, wall),
+        "syncs": stats.get("syncs", lines if method == "always" else 0),
+        "max_sync_ms": stats.get("maxSyncMs", float("nan")),
+        "window_ms": stats.get("maxLagMs", 0.0 if method == "always" else float("inf")),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dir", default=None, help="folder on the disk to test (default: /tmp)")
+    parser.add_argument("--modes", default="none,group:0.1,group:0.5,group:2,always")
+    parser.add_argument("--lines", type=int, default=100000)
+    parser.add_argument("--rate", type=float, default=0.0, help="lines per second (0: as fast as possible)")
+    parser.add_argument("--flush-sec", type=float, default=1.0, help="Output_Flush_Sec")
+    args = parser.parse_args()
+
+    print(
+        "{:>12}{:>12}{:>8}{:>8}{:>14}{:>12}".format(
+            "mode", "lines/s", "CPU%", "syncs", "max sync ms", "window ms"
+        )
+    )
+    for mode in args.modes.split(","):
+        r = run_once(mode.strip(), args.lines, args.rate, args.flush_sec, args.dir)
+        print(
+            "{mode:>12}{lines_per_sec:>12.0f}{cpu_pct:>8.1f}{syncs:>8}"
+            "{max_sync_ms:>14.2f}{window_ms:>12.1f}".format(**r)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+#!/usr/bin/python3
+
+"""Pseudo-terminal stand-in for the Teensy main serial port.
+
+``FakeTeensy`` writes Teensy output lines into the master side of a pty so
+that ``MainCode.printSerialOutput`` (or anything else expecting the Teensy
+port) can read the slave side as if the hardware were attached.  Lines come
+either from a capture or from a synthetic mix:
+
+- ``replay_lines``: the ``everything.list`` pickle dumped by
+  ``MainCode.getEverything``, or any ``.dat`` / ``.trial.csv`` / text capture
+- ``synthetic_lines``: 8-field reports, trial summaries (event code >= 200),
+  ``I``/``E``/``D``/``P`` tags and ``99``/``98`` analog window pairs in
+  configurable proportions
+
+Lines are sent at ``rate`` lines per second in bursts of ``burst`` lines.
+Synthetic report lines carry a sequence number in their ``value`` field and
+the send time of every sequence number is kept in ``sent``, so a consumer can
+measure end-to-end latency and drops.
+
+Run it on its own to get a port for manual testing:
+
+    python3 Benchmarks/FakeTeensy.py --rate 1000 --seconds 60 --link /tmp/ttyFakeTeensy
+"""
+
+import argparse
+import os
+import pickle
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from SerialIdleBenchmark import open_pty  # noqa: E402
+
+
+# Proportions of the synthetic line kinds
+DEFAULT_MIX = {
+    "report": 0.90,
+    "trial": 0.05,
+    "info": 0.02,
+    "error": 0.005,
+    "water": 0.005,
+    "pins": 0.005,
+    "analog": 0.015,
+}
+
+
+def parse_mix(text):
+    """``"report=0.9,trial=0.1"`` -> dict (unknown kinds are rejected)."""
+    mix = {}
+    for item in text.split(","):
+        if not item.strip():
+            continue
+        kind, _, weight = item.partition("=")
+        kind = kind.strip()
+        if kind not in DEFAULT_MIX:
+            raise ValueError("Unknown line kind: {}".format(kind))
+        mix[kind] = float(weight)
+    return mix
+
+
+def synthetic_lines(mix=None, seed=0):
+    """Yield ``(line, seq)`` forever; ``seq`` is set on 8-field report lines only."""
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    start = time.time()
+    seq = 0
+    trialId = 0
+    blockId = 0
+    windowOpen = False
+    while True:
+        smTime = int((time.time() - start) * 1000)
+        nowTime = int(time.time())
+        kind = rng.choices(kinds, weights)[0]
+        if kind == "report":
+            seq += 1
+            yield "{},{},{},{},{},{},{},{}\r\n".format(
+                rng.choice((11, 12, 21, 22, 51, 61)),
+                seq,
+                6,
+                1,
+                smTime,
+                nowTime,
+                seq % 50,
+                seq % 40,
+            ), seq
+        elif kind == "trial":
+            trialId += 1
+            if trialId % 100 == 0:
+                blockId += 1
+            yield "200,70,30,{},{},{},{},0,{},{},{},{}\r\n".format(
+                rng.choice((1, 2)),
+                rng.choice((0, 1)),
+                trialId,
+                blockId,
+                int(start * 1000),
+                smTime // 2,
+                smTime - 500,
+                smTime,
+            ), None
+        elif kind == "info":
+            yield "I,Synthetic information message\r\n", None
+        elif kind == "error":
+            yield "E,Report queue size > 1000.\r\n", None
+        elif kind == "water":
+            yield "D,{}\r\n".format(rng.randint(0, 2000)), None
+        elif kind == "pins":
+            yield "P,14,15\r\n", None
+        elif kind == "analog":
+            windowOpen = not windowOpen
+            yield "{},1,6,1,{},{},0,0\r\n".format(99 if windowOpen else 98, smTime, nowTime), None
+
+
+def replay_lines(path, loop=False):
+    """Yield ``(line, None)`` from a ``getEverything`` pickle or a text capture."""
+    while True:
+        try:
+            with open(path, "rb") as handle:
+                lines = pickle.load(handle)
+        except Exception:
+            # Not a pickle: replay it as a text capture
+            with open(path, "rb") as handle:
+                lines = handle.readlines()
+        for line in lines:
+            if isinstance(line, (bytes, bytearray)):
+                line = line.decode("utf-8", "ignore")
+            if line:
+                yield line, None
+        if not loop:
+            return
+
+
+class FakeTeensy(threading.Thread):
+    """Write ``lines`` into a pty master at ``rate`` lines/s in bursts of ``burst``."""
+
+    def __init__(self, master, lines, rate=1000.0, burst=1, seconds=None, max_lines=None):
+        super(FakeTeensy, self).__init__(name="FakeTeensy")
+        self.daemon = True
+        self.master = master
+        self.lines = lines
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.seconds = seconds
+        self.max_lines = max_lines
+        self.sent = {}
+        self.lines_sent = 0
+        self.bytes_sent = 0
+        self.cpu = 0.0
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        cpu0 = time.thread_time()
+        begin = next_time = time.monotonic()
+        interval = self.burst / self.rate if self.rate > 0 else 0.0
+        try:
+            while not self._stop_event.is_set():
+                if self.seconds is not None and time.monotonic() - begin >= self.seconds:
+                    break
+                if self.max_lines is not None and self.lines_sent >= self.max_lines:
+                    break
+                chunk = []
+                stamps = []
+                for _ in range(self.burst):
+                    try:
+                        line, seq = next(self.lines)
+                    except StopIteration:
+                        self._stop_event.set()
+                        break
+                    chunk.append(line)
+                    if seq is not None:
+                        stamps.append(seq)
+                if not chunk:
+                    break
+                data = "".join(chunk).encode("utf-8")
+                now = time.monotonic()
+                for seq in stamps:
+                    self.sent[seq] = now
+                view = memoryview(data)
+                while view:
+                    # Blocks when the reader falls behind, like a full USB queue
+                    n = os.write(self.master, view)
+                    view = view[n:]
+                self.lines_sent += len(chunk)
+                self.bytes_sent += len(data)
+                if interval:
+                    next_time += interval
+                    delay = next_time - time.monotonic()
+                    if delay > 0:
+                        self._stop_event.wait(delay)
+        except OSError:
+            pass
+        finally:
+            self.cpu = time.thread_time() - cpu0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--replay", help="getEverything pickle or text capture to replay")
+    parser.add_argument("--loop", action="store_true", help="repeat the replay")
+    parser.add_argument("--mix", default="", help="e.g. report=0.9,trial=0.1")
+    parser.add_argument("--rate", type=float, default=1000.0, help="lines per second")
+    parser.add_argument("--burst", type=int, default=1, help="lines per write")
+    parser.add_argument("--seconds", type=float, default=None)
+    parser.add_argument("--link", help="symlink to create for the pty slave")
+    args = parser.parse_args()
+
+    master, port = open_pty()
+    if args.link:
+        if os.path.islink(args.link):
+            os.unlink(args.link)
+        os.symlink(port.port, args.link)
+    print("Fake Teensy on {}".format(args.link or port.port))
+
+    if args.replay:
+        lines = replay_lines(args.replay, args.loop)
+    else:
+        lines = synthetic_lines(parse_mix(args.mix) or None)
+    teensy = FakeTeensy(master, lines, args.rate, args.burst, args.seconds)
+    teensy.start()
+    try:
+        while teensy.is_alive():
+            teensy.join(1.0)
+    except KeyboardInterrupt:
+        teensy.stop()
+    print("Sent {} lines ({} bytes)".format(teensy.lines_sent, teensy.bytes_sent))
+    if args.link and os.path.islink(args.link):
+        os.unlink(args.link)
+
+
+if __name__ == "__main__":
+    main()
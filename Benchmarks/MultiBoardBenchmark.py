@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+
+"""Benchmark multi-board acquisition: CPU cost per added Teensy.
+
+For every board count, one ``FakeTeensy`` per board feeds a pseudo-terminal.
+All ports are drained by a single ``SerialReader.MultiPortReader``, and each
+board runs ``MainCode.printSerialOutput`` on its own thread with its own
+temporary ``Output_Dir``, as ``MainCode.runMultiBoard`` does.  Per board
+count it reports:
+
+- lines/s written by all fake Teensys together
+- CPU% of the MainCode process (fake Teensy threads excluded) and CPU% per
+  board
+- dropped report lines (sent but never handed to a session writer)
+
+MainCode imports its Raspberry Pi modules (RPi.GPIO, pyserial, ntplib, PIL),
+so this runs on the Pi.
+
+    python3 Benchmarks/MultiBoardBenchmark.py --boards 1,2,4,8 --rate 1000
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import FakeTeensy  # noqa: E402
+from AcquisitionBenchmark import bench_config  # noqa: E402
+from SerialIdleBenchmark import open_pty  # noqa: E402
+
+
+def run_once(configPath, boards, rate, burst, seconds, overrides):
+    import MainCode
+    import SerialReader
+    import SessionWriters
+
+    workDir = tempfile.mkdtemp(prefix="multibench-")
+    received = {}  # (session writer, seq) -> receive time
+    receivedLock = threading.Lock()
+    originalWriteData = SessionWriters.SessionWriter.write_data
+
+    def countedWriteData(writer, line, words=None, *args, **kwargs):
+        if words is not None:
+            try:
+                with receivedLock:
+                    received[(id(writer), int(words[1]))] = time.monotonic()
+            except (IndexError, ValueError):
+                pass
+        return originalWriteData(writer, line, words, *args, **kwargs)
+
+    cwd = os.getcwd()
+    pairs = [open_pty() for _ in range(boards)]
+    teensys = [
+        FakeTeensy.FakeTeensy(master, FakeTeensy.synthetic_lines(seed=i), rate, burst, seconds)
+        for i, (master, _) in enumerate(pairs)
+    ]
+    multiReader = SerialReader.MultiPortReader().start()
+    loops = []
+    try:
+        # printSerialOutput writes log.out into the current directory
+        os.chdir(workDir)
+        SessionWriters.SessionWriter.write_data = countedWriteData
+        MainCode.exitInst = MainCode.safeExit()
+        for i, (_, port) in enumerate(pairs):
+            boardDir = os.path.join(workDir, "board%d" % i)
+            os.makedirs(boardDir)
+            userConfig = bench_config(configPath, boardDir, overrides)
+            userConfig["Subject_Name"] = "Benchmark%d" % i
+            handle = multiReader.add(port, name=userConfig["Subject_Name"])
+            loops.append(
+                threading.Thread(
+                    target=MainCode.printSerialOutput,
+                    args=(port, False, userConfig, False, time.time()),
+                    kwargs={"reader": handle, "desktop": False},
+                    name="Board-%d" % i,
+                )
+            )
+
+        cpu0 = time.process_time()
+        wall0 = time.monotonic()
+        for loop in loops:
+            loop.start()
+        for teensy in teensys:
+            teensy.start()
+        for teensy in teensys:
+            teensy.join()
+        # Let the boards drain what is still queued
+        sent = sum(len(t.sent) for t in teensys)
+        drainEnd = time.monotonic() + 2.0
+        while time.monotonic() < drainEnd and len(received) < sent:
+            time.sleep(0.05)
+        wall = time.monotonic() - wall0
+        cpu = time.process_time() - cpu0 - sum(t.cpu for t in teensys)
+        MainCode.exitInst.exitStatus = True
+        for loop in loops:
+            loop.join(10.0)
+    finally:
+        multiReader.stop()
+        SessionWriters.SessionWriter.write_data = originalWriteData
+        os.chdir(cwd)
+        for master, port in pairs:
+            os.close(master)
+            port.close()
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    cpuPct = 100.0 * cpu / max(1e-9, wall)
+    return {
+        "boards": boards,
+        "lines_per_sec": sum(t.lines_sent for t in teensys) / max(1e-9, seconds or wall),
+        "cpu_pct": cpuPct,
+        "cpu_per_board": cpuPct / boards,
+        "dropped": sent - len(received),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config", default=os.path.join(HERE, "..", "userInfo.in"))
+    parser.add_argument("--boards", default="1,2,4", help="board counts to run")
+    parser.add_argument("--rate", type=float, default=1000.0, help="lines per second per board")
+    parser.add_argument("--burst", type=int, default=1, help="lines per pty write")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="override a userInfo.in key for every board",
+    )
+    args = parser.parse_args()
+
+    try:
+        import MainCode  # noqa: F401
+    except ImportError as e:
+        sys.exit("MainCode cannot be imported here ({}); run on the Pi.".format(e))
+
+    overrides = dict(item.split("=", 1) for item in args.set)
+    print("{:>7}{:>12}{:>8}{:>13}{:>9}".format("boards", "lines/s", "CPU%", "CPU%/board", "dropped"))
+    for boards in [int(b) for b in args.boards.split(",")]:
+        r = run_once(args.config, boards, args.rate, args.burst, args.seconds, overrides)
+        print(
+            "{boards:>7}{lines_per_sec:>12.0f}{cpu_pct:>8.1f}"
+            "{cpu_per_board:>13.1f}{dropped:>9}".format(**r)
+        )
+
+
+if __name__ == "__main__":
+    main()
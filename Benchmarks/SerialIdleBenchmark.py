@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+
+"""Compare CPU use and event latency of the serial read modes.
+
+A pseudo-terminal stands in for the Teensy USB serial port.  For each read
+mode the benchmark first leaves the port idle, then writes one timestamped
+report line every ``--interval`` seconds, and reports the reader thread's CPU
+share together with the write-to-read latency of each line.
+
+    python3 Benchmarks/SerialIdleBenchmark.py --seconds 5
+"""
+
+import argparse
+import fcntl
+import os
+import struct
+import sys
+import termios
+import threading
+import time
+import tty
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import SerialReader  # noqa: E402
+
+
+class FdPort(object):
+    """Minimal pyserial-like wrapper around a raw tty file descriptor."""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.port = os.ttyname(fd)
+        os.set_blocking(fd, False)
+
+    def fileno(self):
+        return self.fd
+
+    @property
+    def in_waiting(self):
+        buf = fcntl.ioctl(self.fd, termios.FIONREAD, struct.pack("I", 0))
+        return struct.unpack("I", buf)[0]
+
+    def read(self, size=1):
+        if size <= 0:
+            return b""
+        try:
+            return os.read(self.fd, size)
+        except BlockingIOError:
+            return b""
+
+    def isOpen(self):
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+def open_pty():
+    """Return ``(master_fd, FdPort)`` for a raw pseudo-terminal pair."""
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    return master, FdPort(slave)
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def run_mode(mode, seconds, interval, read_timeout, min_batch):
+    master, port = open_pty()
+    reader = SerialReader.SerialReader(
+        port, mode=mode, read_timeout=read_timeout, min_batch=min_batch
+    )
+    latencies = []
+    pending = bytearray()
+    stop = threading.Event()
+
+    def writer():
+        # Idle for the first half, then one report line per interval
+        if stop.wait(seconds / 2.0):
+            return
+        while not stop.is_set():
+            line = "1,{:.9f},0,0,0,0,0,0\n".format(time.monotonic())
+            os.write(master, line.encode("ascii"))
+            stop.wait(interval)
+
+    thread = threading.Thread(target=writer, daemon=True)
+    thread.start()
+
+    idle_end = time.monotonic() + seconds / 2.0
+    end = time.monotonic() + seconds
+    cpu0 = cpu_busy0 = time.thread_time()
+    idle_cpu = None
+    while time.monotonic() < end:
+        if idle_cpu is None and time.monotonic() >= idle_end:
+            idle_cpu = time.thread_time() - cpu0
+            cpu_busy0 = time.thread_time()
+        data = reader.read(end)
+        if not data:
+            continue
+        now = time.monotonic()
+        pending += data
+        while b"\n" in pending:
+            line, _, rest = bytes(pending).partition(b"\n")
+            pending = bytearray(rest)
+            try:
+                latencies.append(now - float(line.split(b",")[1]))
+            except (IndexError, ValueError):
+                pass
+    busy_cpu = time.thread_time() - cpu_busy0
+    stop.set()
+    thread.join()
+    os.close(master)
+    port.close()
+
+    half = seconds / 2.0
+    return {
+        "mode": mode,
+        "idle_cpu_pct": 100.0 * (idle_cpu or 0.0) / half,
+        "busy_cpu_pct": 100.0 * busy_cpu / half,
+        "lines": len(latencies),
+        "lat_p50_us": 1e6 * percentile(latencies, 50),
+        "lat_p99_us": 1e6 * percentile(latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=4.0)
+    parser.add_argument("--interval", type=float, default=0.01)
+    parser.add_argument("--read-timeout", type=float, default=0.5)
+    parser.add_argument("--min-batch", type=int, default=1)
+    parser.add_argument("--modes", default="poll,select")
+    args = parser.parse_args()
+
+    print(
+        "{:<8}{:>12}{:>12}{:>8}{:>12}{:>12}".format(
+            "mode", "idle CPU%", "busy CPU%", "lines", "p50 (us)", "p99 (us)"
+        )
+    )
+    for mode in args.modes.split(","):
+        r = run_mode(
+            mode.strip(), args.seconds, args.interval, args.read_timeout, args.min_batch
+        )
+        print(
+            "{mode:<8}{idle_cpu_pct:>12.1f}{busy_cpu_pct:>12.1f}{lines:>8}"
+            "{lat_p50_us:>12.0f}{lat_p99_us:>12.0f}".format(**r)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/python3
+
+"""Background NTP clock discipline for the Teensy time sync.
+
+``syncTimeNTP`` used to run inside the acquisition loop with a 5 s NTP timeout,
+so a bad network stalled the serial drain.  ``ClockService`` does the NTP work
+on its own thread:
+
+- every ``poll_sec`` it sends a short burst of NTP queries and keeps the one
+  with the lowest round-trip delay (the least disturbed by queuing)
+- a sample is valid when the server is synchronised (stratum 1-15, no alarm
+  leap indicator), its delay is below ``max_delay`` and its offset agrees with
+  the model within ``max_jump`` (the first samples are always accepted)
+- valid samples feed an offset/drift model: a least-squares line of offset
+  against host monotonic time over the last ``history`` samples
+- every ``sync_sec`` the ``T`` command is written to the Teensy, but only
+  right after a fresh valid sample, and timed so that it is sent on a whole
+  NTP second
+
+Every sync and every rejected sample is reported through ``log`` with its
+offset, delay, stratum, root distance and the model drift.
+"""
+
+import threading
+import time
+
+try:
+    import ntplib  # type: ignore
+except Exception:  # pragma: no cover - installed on the Pi
+    ntplib = None
+
+
+class ClockModel(object):
+    """Offset (NTP minus host wall clock, s) and drift (ppm) from recent samples."""
+
+    def __init__(self, history=16):
+        self.history = max(2, int(history))
+        self.samples = []  # (host monotonic, offset)
+
+    def add(self, mono, offset):
+        self.samples.append((mono, offset))
+        del self.samples[: -self.history]
+
+    def _fit(self):
+        n = float(len(self.samples))
+        mt = sum(s[0] for s in self.samples) / n
+        mo = sum(s[1] for s in self.samples) / n
+        sxx = sum((s[0] - mt) ** 2 for s in self.samples)
+        slope = (
+            sum((s[0] - mt) * (s[1] - mo) for s in self.samples) / sxx if sxx > 0 else 0.0
+        )
+        return mt, mo, slope
+
+    def predict(self, mono):
+        if not self.samples:
+            return None
+        if len(self.samples) < 2:
+            return self.samples[-1][1]
+        mt, mo, slope = self._fit()
+        return mo + slope * (mono - mt)
+
+    @property
+    def drift_ppm(self):
+        """Host clock error rate against NTP (positive: host clock runs slow)."""
+        if len(self.samples) < 2:
+            return None
+        return self._fit()[2] * 1e6
+
+
+class ClockService(object):
+    """Query NTP in the background and sync the Teensy clock on valid samples.
+
+    ``send`` writes a command string to the Teensy, ``log`` takes a
+    ``writeLogFile`` message list and ``utc_offset`` is added to the NTP time
+    sent to the Teensy (local time, as ``syncTimeNTP`` does).  ``synced``
+    means the Teensy was synced just before, so the first sync waits
+    ``sync_sec``.
+    """
+
+    def __init__(
+        self,
+        server,
+        send,
+        log=None,
+        sync_sec=3600.0,
+        poll_sec=300.0,
+        burst=4,
+        timeout=2.0,
+        max_delay=0.5,
+        max_jump=1.0,
+        history=16,
+        utc_offset=0,
+        synced=False,
+    ):
+        self.server = server
+        self.send = send
+        self.log = log
+        self.sync_sec = max(1.0, float(sync_sec))
+        self.poll_sec = max(1.0, min(float(poll_sec), self.sync_sec))
+        self.burst = max(1, int(burst))
+        self.timeout = float(timeout)
+        self.max_delay = float(max_delay)
+        self.max_jump = float(max_jump)
+        self.utc_offset = utc_offset
+        self.model = ClockModel(history)
+        self.syncs = 0
+        self.samples = 0
+        self.rejected = 0
+        self.failures = 0
+        # Host monotonic time of the last Teensy sync (``synced``: just synced)
+        self.last_sync = time.monotonic() if synced else None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="ClockService")
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _log(self, msgList):
+        if self.log is not None:
+            try:
+                self.log(msgList)
+            except Exception:
+                pass
+
+    def _query(self):
+        """Best (lowest delay) response of one burst; ``None`` if all failed."""
+        client = ntplib.NTPClient()
+        best = None
+        error = None
+        for _ in range(self.burst):
+            try:
+                response = client.request(self.server, timeout=self.timeout)
+            except Exception as e:
+                error = e
+                continue
+            if best is None or response.delay < best.delay:
+                best = response
+            if self._stop.wait(0.2):
+                break
+        if best is None:
+            self.failures += 1
+            self._log(
+                [
+                    "Error:",
+                    "       Clock sync: no NTP response from {0}".format(self.server),
+                    "       Error : %s: %s" % (error.__class__, error),
+                ]
+            )
+        return best
+
+    def _validate(self, response, mono):
+        """Reason the sample is rejected, or ``None`` if it is valid."""
+        if not 1 <= response.stratum <= 15:
+            return "stratum {0}".format(response.stratum)
+        if response.leap == 3:
+            return "server not synchronised (leap alarm)"
+        if response.delay > self.max_delay:
+            return "delay {0:.3f} s".format(response.delay)
+        predicted = self.model.predict(mono)
+        if len(self.model.samples) >= 3 and abs(response.offset - predicted) > self.max_jump:
+            return "offset {0:+.3f} s off the model ({1:+.3f} s)".format(
+                response.offset, predicted
+            )
+        return None
+
+    def _quality(self, response):
+        drift = self.model.drift_ppm
+        return "offset={0:+.4f} s, delay={1:.4f} s, stratum={2}, rootDistance={3:.4f} s, drift={4} ppm".format(
+            response.offset,
+            response.delay,
+            response.stratum,
+            response.root_delay / 2.0 + response.root_dispersion,
+            "NA" if drift is None else "{0:+.2f}".format(drift),
+        )
+
+    def _sync_teensy(self, mono):
+        """Write ``T<seconds>`` on the next whole second of the modelled NTP time."""
+        offset = self.model.predict(time.monotonic())
+        ntpNow = time.time() + offset
+        if self._stop.wait(1.0 - (ntpNow % 1.0)):
+            return False
+        seconds = int(round(time.time() + offset)) + self.utc_offset
+        self.send("T" + str(seconds))
+        self.syncs += 1
+        self.last_sync = mono
+        return True
+
+    def poll(self):
+        """Take one sample; sync the Teensy if it is valid and a sync is due."""
+        response = self._query()
+        if response is None:
+            return
+        mono = time.monotonic()
+        reason = self._validate(response, mono)
+        if reason is not None:
+            self.rejected += 1
+            self._log(
+                [
+                    "Error:",
+                    "       Clock sync: NTP sample rejected ({0})".format(reason),
+                    "       " + self._quality(response),
+                ]
+            )
+            return
+        self.samples += 1
+        self.model.add(mono, response.offset)
+        if self.last_sync is None or mono - self.last_sync >= self.sync_sec - 1.0:
+            if self._sync_teensy(mono):
+                self._log(
+                    [
+                        "Info: syncTimeNTP",
+                        "       Teensy synced with {0}: {1}".format(
+                            self.server, self._quality(response)
+                        ),
+                    ]
+                )
+
+    def _run(self):
+        if ntplib is None:
+            self._log(["Error:", "       Clock sync disabled: ntplib is not installed"])
+            return
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                self.failures += 1
+                self._log(
+                    ["Error:", "       Clock sync failed: %s: %s" % (e.__class__, e)]
+                )
+            self._stop.wait(self.poll_sec)
+
+    def stats(self):
+        drift = self.model.drift_ppm
+        return {
+            "syncs": self.syncs,
+            "samples": self.samples,
+            "rejected": self.rejected,
+            "failures": self.failures,
+            "offset_s": self.model.predict(time.monotonic()),
+            "drift_ppm": drift,
+        }
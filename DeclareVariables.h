@@ -102,6 +102,11 @@ int rewardTime;   // Standard reward delivery time in milliseconds [ms]
 // Teensy hourly update to RPi [initial time log]
 unsigned long timeStampTeensy = now();
 
+// Serial record protocol (false: ASCII CSV lines, true: framed binary records)
+#define maxSerialFrameBody 52
+bool framedSerialProtocol = false;
+uint16_t serialRecordSeq = 0;
+
 // Clock based interrupts (parameterless function, time in milliseconds)
 IntervalTimer toDoTimer[1];
 
@@ -167,6 +172,10 @@ void ReportData(int, int, int);
 // sessionStartEpochMs(abs,64bit), blockStartRelMs, trialStartRelMs, trialEndRelMs
 void ReportTrialSummary(int, int, int, int, int, int, int, int, uint64_t, unsigned long, unsigned long, unsigned long);
 
+// Print report / trial summary records in the selected serial protocol
+void PrintReport(const reportStruct &);
+void PrintTrialSummary(const trialSummaryStruct &);
+
 // Function called at every state and substate machine loop to check for alarms to allow for termination
 void HouseKeeping(unsigned long);
 
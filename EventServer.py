@@ -0,0 +1,377 @@
+#!/usr/bin/python3
+
+"""Live fan-out of parsed Teensy events to local monitors.
+
+``EventServer`` listens on a Unix socket (``unix:/path``) or a TCP address
+(``tcp:host:port``) and publishes every line ``MainCode.printSerialOutput``
+handles as one JSON object per line, so dashboards and the camera process can
+follow a session without tailing ``.dat`` or opening the serial port.
+
+The protocol is line based.  A client sends
+
+    SUBSCRIBE report,trial          (or SUBSCRIBE * for every kind)
+    PING
+
+and gets ``OK <kinds>`` / ``PONG`` back, followed by the events of the kinds
+it subscribed to:
+
+    {"kind": "report", "t": <host epoch>, "eventType": 11, "value": 18, ...}
+
+The kinds are ``report`` and ``trial`` (fields named after the ``.dat`` and
+``.trial.csv`` columns), ``info``/``error`` (``text``), ``water``
+(``dailyWater``) and ``pins`` (``pins``).
+
+Events are encoded once and put on a bounded queue per subscriber; a thread
+does the socket writes, so a slow or stalled client never blocks acquisition.
+When a subscriber's queue is full its oldest events are dropped and counted,
+and it receives ``{"kind": "dropped", "count": n}`` once it catches up.
+"""
+
+import collections
+import json
+import os
+import selectors
+import socket
+import sys
+import threading
+import time
+
+import ReportSidecar
+
+
+KINDS = ("report", "trial", "info", "error", "water", "pins")
+REPORT_NAMES = [name for name, _ in ReportSidecar.REPORT_FIELDS]
+
+
+def parse_address(address):
+    """``"unix:/tmp/x.sock"`` / ``"tcp:127.0.0.1:5757"`` -> ``(family, sockaddr)``."""
+    address = str(address).strip()
+    if address.startswith("tcp:"):
+        host, _, port = address[4:].rpartition(":")
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    if address.startswith("unix:"):
+        address = address[5:]
+    return socket.AF_UNIX, address
+
+
+def _number(value):
+    try:
+        return int(value)
+    except ValueError:
+        return value.strip()
+
+
+class Subscriber(object):
+    def __init__(self, sock, max_queue):
+        self.sock = sock
+        self.kinds = set()
+        self.queue = collections.deque()
+        self.max_queue = max_queue
+        self.dropped = 0
+        self.sent = 0
+        self.inbuf = bytearray()
+        self.outbuf = b""
+
+
+class EventServer(object):
+    """Publish events to socket subscribers from a background thread.
+
+    ``max_queue`` is the number of events held per subscriber before its
+    oldest events are dropped; ``trial_fields`` names the trial summary
+    columns.
+    """
+
+    def __init__(self, address, max_queue=1000, trial_fields=None, max_clients=16):
+        self.address = address
+        self.max_queue = max(1, int(max_queue))
+        self.max_clients = max(1, int(max_clients))
+        self.fields = {"report": REPORT_NAMES, "trial": list(trial_fields or [])}
+        self.published = 0
+        self.dropped = 0
+        self.clients_seen = 0
+        self._subscribers = {}
+        self._wanted = frozenset()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wakePending = False
+        self._selector = selectors.DefaultSelector()
+        self._wakeRead, self._wakeWrite = socket.socketpair()
+        self._wakeRead.setblocking(False)
+        self._wakeWrite.setblocking(False)
+
+        family, sockaddr = parse_address(address)
+        self._unixPath = sockaddr if family == socket.AF_UNIX else None
+        if self._unixPath and os.path.exists(self._unixPath):
+            os.unlink(self._unixPath)  # left by a previous session
+        self._listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(sockaddr)
+        self._listener.listen(self.max_clients)
+        self._listener.setblocking(False)
+        self._selector.register(self._listener, selectors.EVENT_READ, "accept")
+        self._selector.register(self._wakeRead, selectors.EVENT_READ, "wake")
+        self._thread = threading.Thread(target=self._run, name="EventServer")
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        """Send what is queued (within ``timeout``) and close every socket."""
+        self._stop.set()
+        self._wake()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    # ---------------------------------------------------------- publishing
+
+    def wants(self, kind):
+        return kind in self._wanted
+
+    def _encode(self, kind, words, rxTime):
+        event = {"kind": kind}
+        event["t"] = round(
+            time.time() if rxTime is None else rxTime + time.time() - time.monotonic(), 6
+        )
+        if kind in self.fields:
+            names = self.fields[kind]
+            for i, value in enumerate(words):
+                name = names[i] if i < len(names) else "field{}".format(i)
+                event[name] = _number(value)
+        elif kind in ("info", "error"):
+            event["text"] = ",".join(words[1:]).strip()
+        elif kind == "water":
+            event["dailyWater"] = _number(words[1])
+        elif kind == "pins":
+            event["pins"] = [_number(w) for w in words[1:]]
+        else:
+            event["words"] = [w.strip() for w in words]
+        return (json.dumps(event, separators=(",", ":")) + "\n").encode("utf-8")
+
+    def publish(self, kind, words, rxTime=None):
+        """Queue one split serial line for every subscriber of ``kind``.
+
+        Returns immediately (without encoding) when nobody subscribed to it.
+        """
+        if kind not in self._wanted:
+            return
+        data = self._encode(kind, words, rxTime)
+        wake = False
+        with self._lock:
+            for sub in self._subscribers.values():
+                if kind not in sub.kinds:
+                    continue
+                if len(sub.queue) >= sub.max_queue:
+                    sub.queue.popleft()
+                    sub.dropped += 1
+                    self.dropped += 1
+                sub.queue.append(data)
+            self.published += 1
+            if not self._wakePending:
+                self._wakePending = wake = True
+        if wake:
+            self._wake()
+
+    def _wake(self):
+        try:
+            self._wakeWrite.send(b"\0")
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "subscribers": len(self._subscribers),
+                "clients_seen": self.clients_seen,
+                "published": self.published,
+                "dropped": self.dropped,
+            }
+
+    # ------------------------------------------------------ server thread
+
+    def _update_wanted(self):
+        kinds = set()
+        for sub in self._subscribers.values():
+            kinds |= sub.kinds
+        self._wanted = frozenset(kinds)
+
+    def _accept(self):
+        try:
+            sock, _ = self._listener.accept()
+        except OSError:
+            return
+        if len(self._subscribers) >= self.max_clients:
+            sock.close()
+            return
+        sock.setblocking(False)
+        sub = Subscriber(sock, self.max_queue)
+        with self._lock:
+            self._subscribers[sock.fileno()] = sub
+            self.clients_seen += 1
+        self._selector.register(sock, selectors.EVENT_READ, sub)
+
+    def _drop(self, sub):
+        try:
+            self._selector.unregister(sub.sock)
+        except (KeyError, ValueError):
+            pass
+        with self._lock:
+            self._subscribers.pop(sub.sock.fileno(), None)
+            self._update_wanted()
+        sub.sock.close()
+
+    def _command(self, sub, line):
+        words = line.strip().split(None, 1)
+        if not words:
+            return
+        cmd = words[0].upper()
+        if cmd == "SUBSCRIBE":
+            requested = words[1].replace(" ", "") if len(words) > 1 else "*"
+            if requested in ("*", "all"):
+                kinds = set(KINDS)
+            else:
+                kinds = set(k for k in requested.split(",") if k in KINDS)
+            with self._lock:
+                sub.kinds = kinds
+                self._update_wanted()
+            sub.queue.append("OK {}\n".format(",".join(sorted(kinds))).encode("ascii"))
+        elif cmd == "UNSUBSCRIBE":
+            with self._lock:
+                sub.kinds = set()
+                self._update_wanted()
+            sub.queue.append(b"OK\n")
+        elif cmd == "PING":
+            sub.queue.append(b"PONG\n")
+        else:
+            sub.queue.append(b"ERR unknown command\n")
+
+    def _read(self, sub):
+        try:
+            data = sub.sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._drop(sub)
+            return
+        sub.inbuf += data
+        while True:
+            end = sub.inbuf.find(b"\n")
+            if end < 0:
+                break
+            line = bytes(sub.inbuf[:end]).decode("ascii", "ignore")
+            del sub.inbuf[: end + 1]
+            self._command(sub, line)
+        if len(sub.inbuf) > 4096:
+            self._drop(sub)
+
+    def _write(self, sub):
+        """Send as much of ``sub``'s queue as the socket takes; False when blocked."""
+        while True:
+            if not sub.outbuf:
+                with self._lock:
+                    if sub.queue:
+                        chunks = list(sub.queue)
+                        sub.queue.clear()
+                        dropped, sub.dropped = sub.dropped, 0
+                    else:
+                        return True
+                if dropped:
+                    notice = '{{"kind":"dropped","count":{}}}\n'.format(dropped)
+                    chunks.append(notice.encode("ascii"))
+                sub.outbuf = b"".join(chunks)
+                sub.sent += len(chunks)
+            try:
+                n = sub.sock.send(sub.outbuf)
+            except (BlockingIOError, InterruptedError):
+                return False
+            except OSError:
+                self._drop(sub)
+                return True
+            sub.outbuf = sub.outbuf[n:]
+            if sub.outbuf:
+                return False
+
+    def _flush_all(self):
+        for sub in list(self._subscribers.values()):
+            if sub.sock.fileno() < 0:
+                continue
+            blocked = not self._write(sub)
+            if sub.sock.fileno() < 0:
+                continue
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if blocked else 0)
+            try:
+                self._selector.modify(sub.sock, events, sub)
+            except (KeyError, ValueError):
+                pass
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                for key, mask in self._selector.select(1.0):
+                    if key.data == "accept":
+                        self._accept()
+                    elif key.data == "wake":
+                        try:
+                            self._wakeRead.recv(4096)
+                        except OSError:
+                            pass
+                        with self._lock:
+                            self._wakePending = False
+                    elif mask & selectors.EVENT_READ:
+                        self._read(key.data)
+                self._flush_all()
+            self._flush_all()
+        finally:
+            for sub in list(self._subscribers.values()):
+                self._drop(sub)
+            self._selector.close()
+            self._listener.close()
+            self._wakeRead.close()
+            self._wakeWrite.close()
+            if self._unixPath and os.path.exists(self._unixPath):
+                os.unlink(self._unixPath)
+
+
+def server_from_config(userConfig, trial_fields=None):
+    """``EventServer`` for ``Live_Events`` (``None`` when it is not set)."""
+    address = userConfig.get("Live_Events", "").strip()
+    if not address or address.lower() in ("false", "none"):
+        return None
+    return EventServer(
+        address,
+        int(userConfig.get("Live_Events_Queue", 1000)),
+        trial_fields,
+    ).start()
+
+
+def subscribe(address, kinds="*", timeout=None):
+    """Client side: yield the decoded events of ``kinds`` from a running server."""
+    family, sockaddr = parse_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    sock.connect(sockaddr)
+    try:
+        sock.sendall("SUBSCRIBE {}\n".format(kinds).encode("ascii"))
+        handle = sock.makefile("rb")
+        for line in handle:
+            line = line.decode("utf-8", "ignore").strip()
+            if line.startswith("{"):
+                yield json.loads(line)
+    finally:
+        sock.close()
+
+
+if __name__ == "__main__":
+    # python3 EventServer.py unix:/tmp/autotrainer.sock report,trial
+    if len(sys.argv) < 2:
+        sys.exit("usage: EventServer.py <unix:/path | tcp:host:port> [kinds]")
+    try:
+        for event in subscribe(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else "*"):
+            print(json.dumps(event))
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+
+"""Content-addressed cache of compiled Teensy firmware.
+
+``compileUploadTeensy`` used to run a full ``arduino-cli compile`` on every
+start.  The cache key is a SHA-256 over:
+
+- every sketch source (``.ino``/``.h``/``.cpp``/``.c``) of the sketch folder
+  and ``HardwareLibrary``, including the config headers
+- the state machine headers selected in ``StateMachineHeaders.h`` and
+  ``StateMachines/SpecificFunctions.h`` (the other state machines are not
+  compiled, so editing them keeps the key)
+- the toolchain: ``arduino-cli version``, the installed cores and the
+  compile command (board, libraries path)
+
+When the key matches, the cached ``.hex`` is copied into the build folder and
+only the upload runs.  ``stats.json`` in the cache folder keeps the number of
+hits and misses and the timings of the last run.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import time
+
+SOURCE_EXTS = (".ino", ".h", ".cpp", ".c", ".hpp")
+SKIP_DIRS = ("Build", "ResetTeensyCode", "StateMachines", ".git", "__pycache__")
+
+
+def toolchain_version():
+    """``arduino-cli version`` and ``core list`` output ("" when unavailable)."""
+    parts = []
+    for cmd in (["arduino-cli", "version"], ["arduino-cli", "core", "list"]):
+        try:
+            out = subprocess.run(
+                cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=60
+            ).stdout
+            parts.append(out.decode("utf-8", "ignore").strip())
+        except Exception:
+            parts.append("")
+    return "\n".join(parts)
+
+
+def selected_state_machines(sketchDir, headerName="StateMachineHeaders.h"):
+    """State machine headers included by ``StateMachineHeaders.h`` (relative paths)."""
+    try:
+        with open(os.path.join(sketchDir, headerName)) as handle:
+            text = handle.read()
+    except OSError:
+        return []
+    return re.findall(r'#include\s+"(StateMachines/[^"]+)"', text)
+
+
+def sketch_sources(sketchDir):
+    """Sorted relative paths of every source that goes into the firmware."""
+    paths = set()
+    for root, dirs, files in os.walk(sketchDir):
+        rel = os.path.relpath(root, sketchDir)
+        if rel == ".":
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for name in files:
+            if name.endswith(SOURCE_EXTS):
+                paths.add(os.path.normpath(os.path.join(rel, name)))
+    for path in selected_state_machines(sketchDir) + ["StateMachines/SpecificFunctions.h"]:
+        if os.path.exists(os.path.join(sketchDir, path)):
+            paths.add(os.path.normpath(path))
+    return sorted(paths)
+
+
+def build_key(sketchDir, toolchain="", extra=""):
+    """SHA-256 over the sketch sources, toolchain and ``extra`` (the compile command)."""
+    digest = hashlib.sha256()
+    for part in (toolchain, extra):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    for path in sketch_sources(sketchDir):
+        digest.update(path.replace(os.sep, "/").encode("utf-8"))
+        digest.update(b"\0")
+        with open(os.path.join(sketchDir, path), "rb") as handle:
+            digest.update(handle.read())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class FirmwareCache(object):
+    """``.hex`` files stored under ``cacheDir/<key>/``; ``keep`` most recent entries."""
+
+    def __init__(self, cacheDir, keep=5):
+        self.cacheDir = cacheDir
+        self.keep = max(1, int(keep))
+
+    def _entry(self, key, hexName):
+        return os.path.join(self.cacheDir, key, hexName)
+
+    def lookup(self, key, hexName):
+        path = self._entry(key, hexName)
+        if os.path.exists(path):
+            os.utime(os.path.dirname(path))  # most recently used
+            return path
+        return None
+
+    def store(self, key, hexPath):
+        path = self._entry(key, os.path.basename(hexPath))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmpPath = path + ".tmp"
+        shutil.copyfile(hexPath, tmpPath)
+        os.replace(tmpPath, path)
+        self.prune()
+        return path
+
+    def prune(self):
+        entries = []
+        for name in os.listdir(self.cacheDir):
+            full = os.path.join(self.cacheDir, name)
+            if os.path.isdir(full):
+                entries.append((os.path.getmtime(full), full))
+        for _, full in sorted(entries, reverse=True)[self.keep :]:
+            shutil.rmtree(full, ignore_errors=True)
+
+    def record(self, hit, timings):
+        """Add a hit or miss to ``stats.json``; returns the updated stats."""
+        path = os.path.join(self.cacheDir, "stats.json")
+        stats = {"hits": 0, "misses": 0}
+        try:
+            with open(path) as handle:
+                stats.update(json.load(handle))
+        except (OSError, ValueError):
+            pass
+        stats["hits" if hit else "misses"] += 1
+        stats["last"] = dict(
+            timings, hit=hit, time=time.strftime("%Y-%m-%d-%H-%M-%S")
+        )
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            with open(path, "w") as handle:
+                json.dump(stats, handle, indent=1)
+        except OSError:
+            pass
+        return stats
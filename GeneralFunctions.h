@@ -304,6 +304,191 @@ void GetCurrentNonSessionStateMachine()
   nextStateMachine = trainingProtocol[nextTrainingProtocol][currentStage[nextTrainingProtocol]][1];
 }
 
+// -----------------------------------------   Serial record output
+/*
+   Report and trial summary records are printed as ASCII CSV lines by default.
+   After the RPi sends "F1" they are sent as framed binary records instead:
+
+     0x00, COBS(type, seq, fields..., crc16), 0x00
+
+   type is 1 (report) or 2 (trial summary), seq a 16-bit record counter shared
+   by both types, fields are little-endian (reportStruct / trialSummaryStruct
+   order) and crc16 is CRC-16/CCITT-FALSE over type, seq and fields. COBS
+   removes every 0x00 from the frame, so the delimiters cannot occur inside it
+   and the ASCII I/E/D/P lines can still be interleaved. "F0" switches back.
+*/
+
+uint16_t Crc16Ccitt(const uint8_t *data, size_t len)
+{
+  uint16_t crc = 0xFFFF;
+  for (size_t i = 0; i < len; i++)
+  {
+    crc ^= (uint16_t)data[i] << 8;
+    for (uint8_t b = 0; b < 8; b++)
+    {
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : (crc << 1);
+    }
+  }
+  return crc;
+}
+
+size_t PutU32(uint8_t *p, uint32_t v)
+{
+  p[0] = v & 0xFF;
+  p[1] = (v >> 8) & 0xFF;
+  p[2] = (v >> 16) & 0xFF;
+  p[3] = (v >> 24) & 0xFF;
+  return 4;
+}
+
+void SendFrame(uint8_t type, const uint8_t *body, size_t len)
+{
+  uint8_t raw[maxSerialFrameBody + 5];
+  uint8_t enc[maxSerialFrameBody + 7];
+  size_t n = 0;
+
+  raw[n++] = type;
+  raw[n++] = serialRecordSeq & 0xFF;
+  raw[n++] = (serialRecordSeq >> 8) & 0xFF;
+  memcpy(&raw[n], body, len);
+  n += len;
+  uint16_t crc = Crc16Ccitt(raw, n);
+  raw[n++] = crc & 0xFF;
+  raw[n++] = (crc >> 8) & 0xFF;
+  serialRecordSeq++;
+
+  // COBS encoding: every zero is replaced by the distance to the next zero
+  size_t codeIdx = 0;
+  size_t out = 1;
+  uint8_t code = 1;
+  for (size_t i = 0; i < n; i++)
+  {
+    if (raw[i] == 0)
+    {
+      enc[codeIdx] = code;
+      codeIdx = out++;
+      code = 1;
+    }
+    else
+    {
+      enc[out++] = raw[i];
+      code++;
+    }
+  }
+  enc[codeIdx] = code;
+
+  Serial.write((uint8_t)0);
+  Serial.write(enc, out);
+  Serial.write((uint8_t)0);
+}
+
+// Print one report record (ASCII line or binary frame)
+void PrintReport(const reportStruct &r)
+{
+  if (framedSerialProtocol)
+  {
+    uint8_t body[32];
+    size_t n = 0;
+    n += PutU32(&body[n], (uint32_t)r.eventType);
+    n += PutU32(&body[n], (uint32_t)r.value);
+    n += PutU32(&body[n], (uint32_t)r.currentSM);
+    n += PutU32(&body[n], (uint32_t)r.currentTP);
+    n += PutU32(&body[n], (uint32_t)r.smTime);
+    n += PutU32(&body[n], (uint32_t)r.nowTime);
+    n += PutU32(&body[n], (uint32_t)r.dIntake);
+    n += PutU32(&body[n], (uint32_t)r.wIntake);
+    SendFrame(1, body, n);
+    return;
+  }
+
+  Serial.print(r.eventType);
+  Serial.print(',');
+  Serial.print(r.value);
+  Serial.print(',');
+  Serial.print(r.currentSM);
+  Serial.print(',');
+  Serial.print(r.currentTP);
+  Serial.print(',');
+  Serial.print(r.smTime);
+  Serial.print(',');
+  Serial.print(r.nowTime);
+  Serial.print(',');
+  Serial.print(r.dIntake);
+  Serial.print(',');
+  Serial.print(r.wIntake);
+  Serial.println();
+}
+
+// Print one trial summary record (ASCII line or binary frame)
+void PrintTrialSummary(const trialSummaryStruct &t)
+{
+  if (framedSerialProtocol)
+  {
+    uint8_t body[52];
+    size_t n = 0;
+    n += PutU32(&body[n], (uint32_t)t.eventCode);
+    n += PutU32(&body[n], (uint32_t)t.port1Prob);
+    n += PutU32(&body[n], (uint32_t)t.port2Prob);
+    n += PutU32(&body[n], (uint32_t)t.chosenPort);
+    n += PutU32(&body[n], (uint32_t)t.rewarded);
+    n += PutU32(&body[n], (uint32_t)t.trialId);
+    n += PutU32(&body[n], (uint32_t)t.blockId);
+    n += PutU32(&body[n], (uint32_t)t.unstructuredProb);
+    n += PutU32(&body[n], (uint32_t)(t.sessionStartEpochMs & 0xFFFFFFFFULL));
+    n += PutU32(&body[n], (uint32_t)(t.sessionStartEpochMs >> 32));
+    n += PutU32(&body[n], (uint32_t)t.blockStartRelMs);
+    n += PutU32(&body[n], (uint32_t)t.trialStartRelMs);
+    n += PutU32(&body[n], (uint32_t)t.trialEndRelMs);
+    SendFrame(2, body, n);
+    return;
+  }
+
+  Serial.print(t.eventCode);
+  Serial.print(',');
+  Serial.print(t.port1Prob);
+  Serial.print(',');
+  Serial.print(t.port2Prob);
+  Serial.print(',');
+  Serial.print(t.chosenPort);
+  Serial.print(',');
+  Serial.print(t.rewarded);
+  Serial.print(',');
+  Serial.print(t.trialId);
+  Serial.print(',');
+  Serial.print(t.blockId);
+  Serial.print(',');
+  Serial.print(t.unstructuredProb);
+  Serial.print(',');
+  // Full 64-bit session start epoch ms (previously truncated by cast)
+  {
+    uint64_t v = t.sessionStartEpochMs;
+    if (v == 0)
+    {
+      Serial.print('0');
+    }
+    else
+    {
+      char buf[21];
+      buf[20] = '\0';
+      int idx = 20;
+      while (v > 0 && idx > 0)
+      {
+        uint8_t digit = v % 10ULL;
+        v /= 10ULL;
+        buf[--idx] = '0' + digit;
+      }
+      Serial.print(&buf[idx]);
+    }
+  }
+  Serial.print(',');
+  Serial.print(t.blockStartRelMs);
+  Serial.print(',');
+  Serial.print(t.trialStartRelMs);
+  Serial.print(',');
+  Serial.print(t.trialEndRelMs);
+  Serial.println();
+}
+
 // -----------------------------------------   HouseKeeping
 void HouseKeeping(unsigned long delayT = 0)
 {
@@ -345,70 +530,12 @@ void HouseKeeping(unsigned long delayT = 0)
     if (!reportQueue.isEmpty())
     {
       ReportPrintStr = reportQueue.dequeue();
-      Serial.print(ReportPrintStr.eventType);
-      Serial.print(',');
-      Serial.print(ReportPrintStr.value);
-      Serial.print(',');
-      Serial.print(ReportPrintStr.currentSM);
-      Serial.print(',');
-      Serial.print(ReportPrintStr.currentTP);
-      Serial.print(',');
-      Serial.print(ReportPrintStr.smTime);
-      Serial.print(',');
-      Serial.print(ReportPrintStr.nowTime);
-      Serial.print(',');
-      Serial.print(ReportPrintStr.dIntake);
-      Serial.print(',');
-      Serial.print(ReportPrintStr.wIntake);
-      Serial.println();
+      PrintReport(ReportPrintStr);
     }
     if (!trialSummaryQueue.isEmpty() && (millis() - t44) < delayT)
     {
       TrialSummaryPrintStr = trialSummaryQueue.dequeue();
-      Serial.print(TrialSummaryPrintStr.eventCode);
-      Serial.print(',');
-      Serial.print(TrialSummaryPrintStr.port1Prob);
-      Serial.print(',');
-      Serial.print(TrialSummaryPrintStr.port2Prob);
-      Serial.print(',');
-      Serial.print(TrialSummaryPrintStr.chosenPort);
-      Serial.print(',');
-      Serial.print(TrialSummaryPrintStr.rewarded);
-      Serial.print(',');
-      Serial.print(TrialSummaryPrintStr.trialId);
-      Serial.print(',');
-      Serial.print(TrialSummaryPrintStr.blockId);
-      Serial.print(',');
-      Serial.print(TrialSummaryPrintStr.unstructuredProb);
-      Serial.print(',');
-      // Full 64-bit session start epoch ms (previously truncated by cast)
-      {
-        uint64_t v = TrialSummaryPrintStr.sessionStartEpochMs;
-        if (v == 0)
-        {
-          Serial.print('0');
-        }
-        else
-        {
-          char buf[21];
-          buf[20] = '\0';
-          int idx = 20;
-          while (v > 0 && idx > 0)
-          {
-            uint8_t digit = v % 10ULL;
-            v /= 10ULL;
-            buf[--idx] = '0' + digit;
-          }
-          Serial.print(&buf[idx]);
-        }
-      }
-      Serial.print(',');
-      Serial.print(TrialSummaryPrintStr.blockStartRelMs);
-      Serial.print(',');
-      Serial.print(TrialSummaryPrintStr.trialStartRelMs);
-      Serial.print(',');
-      Serial.print(TrialSummaryPrintStr.trialEndRelMs);
-      Serial.println();
+      PrintTrialSummary(TrialSummaryPrintStr);
     }
   }
 
@@ -434,22 +561,7 @@ void delayHK(unsigned long delayT)
     {
       ReportPrintStr = reportQueue.dequeue();
 
-      Serial.print(ReportPrintStr.eventType);
-      Serial.print(',');
-      Serial.print(ReportPrintStr.value);
-      Serial.print(',');
-      Serial.print(ReportPrintStr.currentSM);
-      Serial.print(',');
-      Serial.print(ReportPrintStr.currentTP);
-      Serial.print(',');
-      Serial.print(ReportPrintStr.smTime);
-      Serial.print(',');
-      Serial.print(ReportPrintStr.nowTime);
-      Serial.print(',');
-      Serial.print(ReportPrintStr.dIntake);
-      Serial.print(',');
-      Serial.print(ReportPrintStr.wIntake);
-      Serial.println();
+      PrintReport(ReportPrintStr);
 
       // Call serialEvent()
       serialEvent();
@@ -458,49 +570,7 @@ void delayHK(unsigned long delayT)
     if (!trialSummaryQueue.isEmpty())
     {
       TrialSummaryPrintStr = trialSummaryQueue.dequeue();
-      Serial.print(TrialSummaryPrintStr.eventCode);
-      Serial.print(',');
-      Serial.print(TrialSummaryPrintStr.port1Prob);
-      Serial.print(',');
-      Serial.print(TrialSummaryPrintStr.port2Prob);
-      Serial.print(',');
-      Serial.print(TrialSummaryPrintStr.chosenPort);
-      Serial.print(',');
-      Serial.print(TrialSummaryPrintStr.rewarded);
-      Serial.print(',');
-      Serial.print(TrialSummaryPrintStr.trialId);
-      Serial.print(',');
-      Serial.print(TrialSummaryPrintStr.blockId);
-      Serial.print(',');
-      Serial.print(TrialSummaryPrintStr.unstructuredProb);
-      Serial.print(',');
-      {
-        uint64_t v = TrialSummaryPrintStr.sessionStartEpochMs;
-        if (v == 0)
-        {
-          Serial.print('0');
-        }
-        else
-        {
-          char buf[21];
-          buf[20] = '\0';
-          int idx = 20;
-          while (v > 0 && idx > 0)
-          {
-            uint8_t digit = v % 10ULL;
-            v /= 10ULL;
-            buf[--idx] = '0' + digit;
-          }
-          Serial.print(&buf[idx]);
-        }
-      }
-      Serial.print(',');
-      Serial.print(TrialSummaryPrintStr.blockStartRelMs);
-      Serial.print(',');
-      Serial.print(TrialSummaryPrintStr.trialStartRelMs);
-      Serial.print(',');
-      Serial.print(TrialSummaryPrintStr.trialEndRelMs);
-      Serial.println();
+      PrintTrialSummary(TrialSummaryPrintStr);
       serialEvent();
     }
   }
@@ -793,6 +863,13 @@ void serialEvent()
       timeStampTeensy = now();
     }
 
+    // Switching the record protocol (F1: framed binary, F0: ASCII)
+    if (firstChar == 'F')
+    {
+      framedSerialProtocol = (Serial.parseInt() == 1);
+      Serial.println(framedSerialProtocol ? "I,Framed serial protocol on" : "I,Framed serial protocol off");
+    }
+
     // Changing alarms
     if (firstChar == 'A')
     {
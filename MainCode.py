@@ -1,26 +1,40 @@
 #!/usr/bin/python3
 
-import serial  # Python module to communicate with the Teensy serial
-import hashlib  # For checksum generation
+import StartupProfiler  # Import/init step timings written to log.out
+
+startupProfile = StartupProfiler.StartupProfiler()
+
 import time  # Python time module
 import os  # Python operating system module (mkdir, rm, ...)
 import datetime  # Python date and time module for time purpose
-import collections  # Python advanced data type [for analog buffer]
 import copy  # Python copy circular buffer in collections
+import heapq  # Python heap queue [housekeeping deadlines]
+import hashlib  # Python hash module [wallpaper cache key]
+import shutil  # Python file copy [firmware cache]
 import subprocess  # Python subprocess to execute bash commands
-import ntplib  # Python Network Time Protocol (NTP)
-import smtplib  # Python SMTP for sending email to users
-import base64  # Python base64 data encodings
-import email.mime.text  # Python Multipurpose Internet Mail Extensions (MIME)
-import netifaces  # Python module to find device IP address
-import random  # Python random number module
-import RPi.GPIO as GPIO  # Python RPi GPIO utility
 import re  # Python regular expression module
 import signal  # Python signal module [e.g., exit signal]
-from PIL import Image, ImageDraw, ImageFont  # Python Image module [change background]
-
-import pickle
-import StorageMonitor  # Background disk usage monitor
+import threading  # Python threading module [serial reader threads]
+import socket  # Python socket module [Live_Events addresses]
+
+# Heavy or Pi-only modules are timed; ntplib, PIL and pickle are imported
+# where they are used (syncRPiTime/syncTimeNTP, changeDesktopBackground,
+# getEverything)
+serial = startupProfile.load("serial")  # Python module to communicate with the Teensy serial
+GPIO = startupProfile.load("RPi.GPIO")  # Python RPi GPIO utility
+StorageMonitor = startupProfile.load("StorageMonitor")  # Background disk usage monitor
+AlertDispatcher = startupProfile.load("AlertDispatcher")  # Background e-mail alert queue
+SerialReader = startupProfile.load("SerialReader")  # Select-based Teensy serial reader
+SessionWriters = startupProfile.load("SessionWriters")  # Persistent buffered .dat/.trial.csv writers
+AnalogCapture = startupProfile.load("AnalogCapture")  # Analog pre-event ring and event file writer
+AnalogPyramid = startupProfile.load("AnalogPyramid")  # Analog min/max/mean decimation levels
+TeensyClock = startupProfile.load("TeensyClock")  # Teensy clock offset/drift and receive latency
+EventServer = startupProfile.load("EventServer")  # Live event fan-out to local monitors
+SessionStats = startupProfile.load("SessionStats")  # Running behavioural aggregates and snapshot file
+ClockService = startupProfile.load("ClockService")  # Background NTP sampling and Teensy time sync
+FirmwareCache = startupProfile.load("FirmwareCache")  # Content-addressed Teensy firmware cache
+PortWatcher = startupProfile.load("PortWatcher")  # inotify-driven serial port discovery
+OutputCompressor = startupProfile.load("OutputCompressor")  # Background compression of rotated files
 
 
 TRIAL_SUMMARY_HEADER = (
@@ -29,6 +43,41 @@ TRIAL_SUMMARY_HEADER = (
 )
 
 
+class HousekeepingScheduler:
+    """
+    Min-heap of named housekeeping deadlines on the monotonic clock.
+    Re-scheduling a name replaces its previous deadline, so the acquisition
+    loop only compares the earliest deadline with the clock when nothing is due.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.deadlines = {}
+
+    def schedule(self, name, when):
+        self.deadlines[name] = when
+        heapq.heappush(self.heap, (when, name))
+
+    def cancel(self, name):
+        self.deadlines.pop(name, None)
+
+    def nextDue(self):
+        # Drop entries superseded by a later schedule() or cancel()
+        while self.heap and self.deadlines.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def popDue(self, now):
+        due = []
+        while True:
+            when = self.nextDue()
+            if when is None or when > now:
+                return due
+            name = heapq.heappop(self.heap)[1]
+            del self.deadlines[name]
+            due.append(name)
+
+
 class safeExit:
     """
     Class to exit the program safely.
@@ -61,8 +110,14 @@ def getTimeFormat():
 def writeLogFile(fileName, msgList):
     """
     Function to write lines to user log file.
+    Goes through the buffered session logger when one is open for the file.
     """
 
+    sessionLog = SessionWriters.get_session_logger(fileName)
+    if sessionLog is not None:
+        sessionLog.log(msgList)
+        return
+
     msgFile = open(fileName, "a")
     msgFile.write("--------------- \n")
     msgFile.write(getTimeFormat() + "\n")
@@ -127,6 +182,8 @@ def syncRPiTime(userConfig):
     """
 
     try:
+        import ntplib  # Python Network Time Protocol (NTP)
+
         client = ntplib.NTPClient()
         response = client.request(userConfig["NTPServer"], timeout=5)
         os.system(
@@ -206,18 +263,38 @@ def getUserConfig(fileName, splitterChar):
     return userConfig
 
 
+def runShell(cmd):
+    """
+    Function to run a shell command and return its output as text
+    """
+
+    subClient = subprocess.Popen(
+        cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    subOutput, subError = subClient.communicate()
+    if isinstance(subOutput, bytes):
+        subOutput = subOutput.decode("utf-8", "ignore")
+    return str(subOutput)
+
+
 def compileUploadTeensy(userConfig):
     """
-    Function to compile and upload Teensy code using Python subprocess module
+    Function to compile and upload Teensy code using Python subprocess module.
+    The compiled firmware is cached by a hash of the sketch sources and the
+    toolchain, so an unchanged sketch is only uploaded.
     """
 
+    sketchDir = "/home/pi/AutoTrainerModular"
+    buildDir = os.path.join(sketchDir, "Build")
+    hexPath = os.path.join(buildDir, "AutoTrainerModular.ino.hex")
+
     if userConfig["Reset_Teensy_Build"].lower() == "true":
-        if os.path.exists("/home/pi/AutoTrainerModular/Build/"):
-            subprocess.call(["rm", "-rf", "/home/pi/AutoTrainerModular/Build/"])
+        if os.path.exists(buildDir):
+            subprocess.call(["rm", "-rf", buildDir])
 
-    if not os.path.exists("/home/pi/Build/"):
+    if not os.path.exists(buildDir):
         print("   ... Creating a new build directory.")
-        subprocess.call(["mkdir", "/home/pi/AutoTrainerModular/Build/"])
+        subprocess.call(["mkdir", "-p", buildDir])
 
     print("   ... Killing the previous Teensy process if running.")
     subprocess.call(["pkill", "teensy"])
@@ -231,24 +308,53 @@ def compileUploadTeensy(userConfig):
 
     uploadCmd = "teensy_loader_cli -w /home/pi/AutoTrainerModular/Build/AutoTrainerModular.ino.hex --mcu=TEENSY41 -sv"
 
-    try:
-        print("   ... Compiling and uploading the *.ino file.")
-        subClient = subprocess.Popen(
-            "(echo COMPILING; %s || echo FAILED TO COMPILE; exit 1) || (echo UPLOADING; (%s || %s) || echo FAILED TO UPLOAD)"
-            % (compileCmd, uploadCmd, uploadCmd),
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        subOutput, subError = subClient.communicate()
+    # Look up the firmware of an identical build
+    cache = None
+    cacheKey = None
+    cachedHex = None
+    timings = {}
+    if userConfig.get("Firmware_Cache", "true").lower() == "true":
+        t0 = time.monotonic()
+        try:
+            cache = FirmwareCache.FirmwareCache(
+                userConfig.get(
+                    "Firmware_Cache_Dir", "/home/pi/.cache/AutoTrainerModular/firmware"
+                ),
+                int(userConfig.get("Firmware_Cache_Keep", 5)),
+            )
+            cacheKey = FirmwareCache.build_key(
+                sketchDir, FirmwareCache.toolchain_version(), compileCmd
+            )
+            cachedHex = cache.lookup(cacheKey, os.path.basename(hexPath))
+        except Exception as e:
+            print("   ... Firmware cache not used: %s: %s" % (e.__class__, e))
+            cache = None
+        timings["key_sec"] = round(time.monotonic() - t0, 3)
 
-        # Normalize to text for checks
-        if isinstance(subOutput, bytes):
-            subOutputText = subOutput.decode("utf-8", "ignore")
+    subOutput = ""
+    try:
+        if cachedHex:
+            print("   ... Firmware cache hit (%s), skipping compilation." % cacheKey[:12])
+            shutil.copyfile(cachedHex, hexPath)
         else:
-            subOutputText = str(subOutput)
+            print("   ... Compiling and uploading the *.ino file.")
+            t0 = time.monotonic()
+            subOutput = runShell(
+                "(echo COMPILING; %s || echo FAILED TO COMPILE)" % compileCmd
+            )
+            timings["compile_sec"] = round(time.monotonic() - t0, 3)
+            if "FAILED" in subOutput:
+                raise Exception("Error in compiling Teensy code.")
+            if cache is not None and os.path.exists(hexPath):
+                cache.store(cacheKey, hexPath)
+
+        t0 = time.monotonic()
+        subOutput += runShell(
+            "(echo UPLOADING; (%s || %s) || echo FAILED TO UPLOAD)" % (uploadCmd, uploadCmd)
+        )
+        timings["upload_sec"] = round(time.monotonic() - t0, 3)
 
-        if "FAILED" in subOutputText:
+        if "FAILED" in subOutput:
             raise Exception("Error in uploading Teensy code.")
 
         print("   ... Program uploaded to Teensy board successfully.")
@@ -263,57 +369,56 @@ def compileUploadTeensy(userConfig):
     finally:
         print("   ... Arduino compiler output:")
         print("   ... ========================")
-        try:
-            for line in subOutput.splitlines():
-                if isinstance(line, bytes):
-                    line = line.decode("utf-8", "ignore")
-                print("   ... " + line)
-        except Exception:
-            pass
+        for line in subOutput.splitlines():
+            print("   ... " + line)
         print("   ... ========================")
 
+        # Report cache hits/misses and timings
+        if cache is not None:
+            stats = cache.record(bool(cachedHex), timings)
+            cacheMsg = "Firmware cache {0}: key={1}, hits={2}, misses={3}, {4}".format(
+                "hit" if cachedHex else "miss",
+                cacheKey[:12],
+                stats["hits"],
+                stats["misses"],
+                ", ".join("%s=%s" % kv for kv in sorted(timings.items())),
+            )
+            print("   ... " + cacheMsg)
+            with open("log.out", "a") as _lf:
+                _lf.write("INFO: {} at {}\n".format(cacheMsg, getTimeFormat()))
 
-def getOpenPort(port0, port1):
+
+def getOpenPort(port0, port1, usbMatch=None, deadline=10, scan=True, exclude=()):
     """
-    Function to get a working serial port (Teensy or Hardware Serial)
+    Function to get a working serial port (Teensy or Hardware Serial).
+    Waits for the device node on an inotify watch of /dev (polling without
+    inotify) and, with usbMatch, accepts only a USB device with those ids.
+    scan=False accepts only port0/port1; ports in exclude are never used.
     """
 
-    def portIsOpen(portName):
-        """
-        Function to check if a serial port is available
-        """
-
-        try:
-            ser = serial.Serial(port=portName)
-            return True
-        except:
-            return False
-
-    timeRecordSerial = time.time()
-
-    while True:
-        if portIsOpen(port0):
-            return port0
-        if portIsOpen(port1):
-            return port1
-
-        if time.time() - timeRecordSerial > 10:
-            print("   ... * EXCEPTION HAPPENED.")
-            print("   ... * Serial ports " + port0 + " , " + port1 + " are not open.")
-            print("   ... * Try < dmesg | grep tty* > in Linux shell.")
-            print("   ... * Check serial and USB connections.")
-            exit("   ... * Error: exiting the program.")
-
-        time.sleep(1.0 / 10000.0)
-
-
-def getSerialConnection(port0, port1, bRate):
+    portName = PortWatcher.wait_for_port(
+        [port0, port1], usbMatch, deadline, scan=scan, exclude=exclude
+    )
+    if portName is None:
+        print("   ... * EXCEPTION HAPPENED.")
+        print("   ... * Serial ports " + port0 + " , " + port1 + " are not open.")
+        if usbMatch is not None:
+            print("   ... * No USB serial device matched %r." % usbMatch)
+        print("   ... * Try < dmesg | grep tty* > in Linux shell.")
+        print("   ... * Check serial and USB connections.")
+        exit("   ... * Error: exiting the program.")
+    return portName
+
+
+def getSerialConnection(
+    port0, port1, bRate, usbMatch=None, deadline=10, scan=True, exclude=()
+):
     """
     Function to create and return a serial connection to Teensy
     """
 
     ser = serial.Serial(
-        port=getOpenPort(port0, port1),
+        port=getOpenPort(port0, port1, usbMatch, deadline, scan, exclude),
         baudrate=bRate,
         bytesize=8,
         parity=serial.PARITY_NONE,
@@ -382,6 +487,8 @@ def syncTimeNTP(ser, userConfig, msgFileN=None):
 
     # Get the time from NTPServer
     try:
+        import ntplib  # Python Network Time Protocol (NTP)
+
         client = ntplib.NTPClient()
         response = client.request(userConfig["NTPServer"], timeout=5)
         timeT = "T" + str(response.tx_time + TimeDiffUTC)
@@ -427,80 +534,24 @@ def syncTimeNTP(ser, userConfig, msgFileN=None):
 def sendEmail(errorMessage, userConfig, msgFileN, emailSubject=None):
     """
     Function to send customized emails to users.
+    The email is queued on the background alert dispatcher, so this never blocks.
     """
 
     if userConfig["Enable_Email"].lower() == "true":
-        recipientName = userConfig["Name"]
-        recipientEmail = userConfig["Email"]
-        emailUser = userConfig["WD_Email"]
-
-        raw_pass = userConfig.get("WD_Pass", "")
-        parts = raw_pass.split("|||") if raw_pass else []
-        rounds = int(parts[0]) if parts and parts[0].isdigit() else 1
-        secret = parts[1] if len(parts) > 1 else ""
-        for _ in range(max(1, rounds)):
-            try:
-                secret = base64.b64decode(secret)
-            except Exception:
-                break
-        # smtplib expects str; decode any bytes returned by base64
-        emailPass = (
-            secret.decode("utf-8")
-            if isinstance(secret, (bytes, bytearray))
-            else str(secret)
-        )
-
-        ipAddress = netifaces.ifaddresses("eth0")[netifaces.AF_INET][0]["addr"]
-
-        sent_from = emailUser
-        to = [recipientEmail]
-
         if emailSubject is None:
-            subject = "Issue with experiment in box: " + userConfig["Box_Name"]
-        else:
-            subject = emailSubject + " in box: " + userConfig["Box_Name"]
+            emailSubject = "Issue with experiment"
 
-        body = "".join(
+        message = "".join(
             [
-                "Hello ",
-                recipientName,
-                ",\n\n",
                 "There is an issue with your experiment.\n\n",
                 "The error message:\n\n",
                 errorMessage,
                 "\n\n",
-                "Please check your box as soon as possible.\n\n",
-                "Date and Time: ",
-                getTimeFormat(),
-                "\n\n",
-                "The IP address: ",
-                ipAddress,
-                "\n\n",
-                "-RPi Watchdog",
+                "Please check your box as soon as possible.",
             ]
         )
 
-        try:
-            msg = email.mime.text.MIMEText(body)
-            msg["Subject"] = subject
-            msg["From"] = emailUser
-            msg["To"] = recipientEmail
-
-            smtpAddress = userConfig["WD_SMTP"].lower()
-            smtpPort = int(userConfig["WD_SMTP_Port"])
-            if userConfig["WD_SSL"].lower() == "true":
-                s = smtplib.SMTP_SSL(smtpAddress, smtpPort)
-            else:
-                s = smtplib.SMTP(smtpAddress, smtpPort)
-
-            s.ehlo()
-            s.login(emailUser, emailPass)
-            s.sendmail(emailUser, recipientEmail, msg.as_string())
-            s.close()
-
-            print("   ... An email sent to: " + recipientName)
-
-        except Exception as e:
+        def reportFailure(e):
             msgList = [
                 "Error:",
                 "       Error happened in sending email.",
@@ -509,6 +560,9 @@ def sendEmail(errorMessage, userConfig, msgFileN, emailSubject=None):
             ]
             writeLogFile(msgFileN, msgList)
 
+        if AlertDispatcher.submit_alert(userConfig, emailSubject, message, reportFailure):
+            print("   ... An email queued for: " + userConfig["Name"])
+
 
 def getAnalogDirPath(userConfig):
     """
@@ -527,18 +581,6 @@ def getAnalogDirPath(userConfig):
     return analogDirPath
 
 
-def getAnalogTempFileName(userConfig):
-    """
-    Function to get temporary file name for analog files
-    """
-
-    tempName = "".join(
-        [getAnalogDirPath(userConfig), "/anTemp.", str(int(time.time()))]
-    )
-
-    return tempName
-
-
 def checkDailyWater(dailyWater, userConfig, msgFileN):
     """
     Function to check daily water and to send daily emails to users.
@@ -564,36 +606,11 @@ def checkDailyWater(dailyWater, userConfig, msgFileN):
                     " pulses",
                 ]
             )
-            time.sleep(1 * random.random())
             sendEmail(emailText, userConfig, msgFileN, emailSubject)
 
     return 0
 
 
-def renameQueueFiles(Q1, Q2, msgFileN):
-    """
-    Function to rename file names from two queues
-    """
-
-    if len(Q1) and len(Q2):
-        F1 = Q1.popleft()
-        F2 = Q2.popleft()
-
-        if os.path.exists(F1):
-            os.rename(F1, F2)
-        else:
-            msgList = [
-                "Error:",
-                "       Error in analog file name.",
-                "       Queue did not work.",
-                "       Modify analog saving.",
-                F1,
-                "       anFileName:",
-                F2,
-            ]
-            writeLogFile(msgFileN, msgList)
-
-
 def elapsedTime(D, T, option="S"):
     """
     Function to return elapsed time from a datetime object
@@ -630,6 +647,21 @@ def changeOutputFileN(D, FN, Dic):
     return [D, FN]
 
 
+def nextRotationDelay(D, Dic):
+    """
+    Function to return seconds until changeOutputFileN rotates the file
+    started at D (None if rotation is disabled).
+    """
+
+    freq = Dic.get("Output_Name_Freq", "false").lower()
+    if freq == "false":
+        return None
+
+    H = int(freq.replace("hr", ""))
+    rotateAt = D + datetime.timedelta(hours=H)
+    return max(1.0, (rotateAt - datetime.datetime.now()).total_seconds())
+
+
 def setupGPIO(userConfig):
     """
     Function to setup GPIO.
@@ -712,9 +744,47 @@ def printText(L1, L2, L3, L4, S1, S2, S3, S4, fontSpec, drwSpec):
 
 def changeDesktopBackground(userConfig):
     """
-    Function to change desktop background
+    Function to change desktop background.
+    The image is rendered again only when Name/RPi_IP/Box_Name/Subject_Name
+    change; the hash of these fields is kept next to the image.
     """
 
+    imagePath = "/home/pi/backImage.jpg"
+    keyPath = imagePath + ".key"
+    wallpaperKey = hashlib.sha1(
+        "\0".join(
+            [
+                userConfig["Name"],
+                userConfig["RPi_IP"],
+                userConfig["Box_Name"],
+                userConfig["Subject_Name"],
+            ]
+        ).encode("utf-8")
+    ).hexdigest()
+    try:
+        with open(keyPath) as f:
+            cachedKey = f.read().strip()
+    except OSError:
+        cachedKey = None
+    if cachedKey != wallpaperKey or not os.path.exists(imagePath):
+        renderDesktopBackground(userConfig, imagePath)
+        with open(keyPath, "w") as f:
+            f.write(wallpaperKey + "\n")
+
+    subprocess.call(
+        ["pcmanfm", "--set-wallpaper=" + imagePath],
+        env=dict(os.environ, DISPLAY=":0.0", XAUTHORITY="/home/pi/.Xauthority"),
+    )
+    print("   ... Desktop background changed.")
+
+
+def renderDesktopBackground(userConfig, imagePath):
+    """
+    Function to render the desktop background image
+    """
+
+    from PIL import Image, ImageDraw, ImageFont  # Python Image module
+
     deskW = 1920
     deskH = 1080
     imgTemplate = Image.new("RGB", (deskW, deskH), color=(64, 48, 83))
@@ -747,17 +817,16 @@ def changeDesktopBackground(userConfig):
             )
 
     # Save image to Desktop
-    imgTemplate.save("/home/pi/backImage.jpg")
-    subprocess.call(
-        ["pcmanfm", "--set-wallpaper=/home/pi/backImage.jpg"],
-        env=dict(os.environ, DISPLAY=":0.0", XAUTHORITY="/home/pi/.Xauthority"),
-    )
-    print("   ... Desktop background changed.")
+    imgTemplate.save(imagePath)
 
 
-def printSerialOutput(ser, anSer, userConfig, analogEnabled, expStartTime):
+def printSerialOutput(
+    ser, anSer, userConfig, analogEnabled, expStartTime, reader=None, desktop=True
+):
     """
     Function to read the available serial port.
+    In multi-board mode, reader is this board's handle on the shared
+    MultiPortReader and the desktop background is left alone.
     """
 
     # Final check for serial access
@@ -768,7 +837,9 @@ def printSerialOutput(ser, anSer, userConfig, analogEnabled, expStartTime):
             return
 
     # Change desktop background
-    changeDesktopBackground(userConfig)
+    if desktop:
+        with startupProfile.step("changeDesktopBackground"):
+            changeDesktopBackground(userConfig)
 
     # Read serial port and write to output and analog folder [if enabled]
     try:
@@ -797,17 +868,50 @@ def printSerialOutput(ser, anSer, userConfig, analogEnabled, expStartTime):
         msgFileN = os.path.join(out_dir, base + ".log")
         # Parallel trial summary file (.trial.csv) to hold extended trial summary lines (eventCode >=200)
         trialSummaryFileN = outputFileN.replace(".dat", ".trial.csv")
-        createInitialFile(outputFileN, "a")
         createInitialFile(msgFileN, "a")
-        # Ensure trial summary file exists before size check
-        createInitialFile(trialSummaryFileN, "a")
-        try:
-            needHeader = os.path.getsize(trialSummaryFileN) == 0
-        except OSError:
-            needHeader = True
-        if needHeader:
-            with open(trialSummaryFileN, "a") as tsf_init:
-                tsf_init.write(TRIAL_SUMMARY_HEADER)
+        # Batch log messages on one handle for the whole session
+        sessionLog = SessionWriters.open_session_logger(msgFileN, userConfig)
+        writerPolicy = SessionWriters.FlushPolicy.from_config(userConfig)
+        # Finish the files of a session ended by a crash or power cut
+        # (torn lines truncated, RECOVER marker appended)
+        if userConfig.get(
+            "Output_Recover", str(writerPolicy.sync != "none")
+        ).lower() == "true":
+            try:
+                recovered = SessionWriters.recover_sessions(
+                    out_dir, userConfig["Subject_Name"], writerPolicy, (outputFileN,)
+                )
+            except Exception as e:
+                recovered = []
+                writeLogFile(
+                    msgFileN,
+                    ["Error:", "       Session recovery failed: {0}".format(e)],
+                )
+            for result in recovered:
+                msgList = [
+                    "Info: Recovered session",
+                    "       {0}: tornBytes={1}".format(
+                        os.path.basename(result["dat"]), result["tornBytes"]
+                    ),
+                    "       " + result["marker"],
+                ]
+                print("   ... Recovered " + os.path.basename(result["dat"]))
+                writeLogFile(msgFileN, msgList)
+        # Keep .dat and .trial.csv open for the session (header added if empty)
+        writer = SessionWriters.SessionWriter(
+            outputFileN,
+            trialSummaryFileN,
+            writerPolicy,
+            trialHeader=TRIAL_SUMMARY_HEADER,
+            binarySidecar=userConfig.get("Output_Binary_Sidecar", "true").lower()
+            == "true",
+            hostStamps=userConfig.get("Output_Host_Stamps", "false").lower() == "true",
+        )
+
+        # Compress the files closed at rotation in the background (Output_Compress)
+        compressor = OutputCompressor.compressor_from_config(
+            userConfig, lambda msgList: writeLogFile(msgFileN, msgList)
+        )
 
         # Initialize counters for session integrity
         dataLineCount = 0  # number of legacy 8-field lines written to .dat
@@ -816,246 +920,376 @@ def printSerialOutput(ser, anSer, userConfig, analogEnabled, expStartTime):
         # Log the current date
         currentDate = datetime.datetime.now()
 
-        totalDataRead = ""
+        # Frame the byte stream into lines, carrying partial lines over;
+        # the framed protocol sends report/trial records as checked binary frames
+        framedProtocol = userConfig.get("Serial_Protocol", "ascii").lower() == "framed"
+        if framedProtocol:
+            framer = SerialReader.FrameDecoder(int(userConfig.get("Serial_Max_Line", 4096)))
+            ser.write(b"F1")
+        else:
+            framer = SerialReader.LineFramer(int(userConfig.get("Serial_Max_Line", 4096)))
+
+        # Publish parsed events to live monitors (Live_Events socket)
+        liveEvents = None
+        try:
+            liveEvents = EventServer.server_from_config(
+                userConfig, TRIAL_SUMMARY_HEADER.strip().split(",")
+            )
+        except Exception as e:
+            msgList = [
+                "Error:",
+                "       Live event server not started: {0}".format(e),
+            ]
+            writeLogFile(msgFileN, msgList)
+
+        # Running trial/report aggregates, snapshot to <session>.stats.json
+        statsSnapshotFreq = float(userConfig.get("Stats_Snapshot_Sec", 30))
+        sessionStats = SessionStats.SessionStats(
+            int(userConfig.get("Stats_Recent_Blocks", 10))
+        )
+        statsFileN = SessionStats.stats_path(msgFileN)
+
+        # Estimate the Teensy clock and receive latency from the report lines
+        teensyClock = None
+        if userConfig.get("Serial_Timing_Stats", "true").lower() == "true":
+            teensyClock = TeensyClock.TeensyClock(
+                float(userConfig.get("Serial_Clock_Window_Sec", 60))
+            )
+            timingLogFreq = float(userConfig.get("Serial_Timing_Log_Sec", 300))
 
         if analogEnabled:
-            totalAnalogRead = ""
             if not os.path.exists("".join(["Analog-", userConfig["Subject_Name"]])):
                 os.makedirs("".join(["Analog-", userConfig["Subject_Name"]]))
-            anBufferSize = int(userConfig["Before_Buffer"])
-            anBuffer = collections.deque(maxlen=anBufferSize)
-            anInitialWriteStatus = False
-            anWriteStatus = False
-            anTempFileName = ""
-            anFileName = ""
+            # Pre-event samples live in a fixed ring; windows are written on 99/98
+            try:
+                anCapture = AnalogCapture.AnalogCapture(
+                    int(userConfig["Before_Buffer"]),
+                    slack=int(userConfig.get("Analog_Ring_Slack", 2000)),
+                    max_samples=int(userConfig.get("Analog_Max_Samples", 60000)),
+                    fmt=userConfig.get("Analog_Format", "binary").strip().lower(),
+                    sample_rate=float(userConfig.get("Analog_Sample_Rate", 1000)),
+                    levels=AnalogPyramid.parse_factors(
+                        userConfig.get("Analog_Levels", "10,100,1000")
+                    ),
+                )
+            except ImportError as e:
+                msgList = ["Error:", "       Analog saving disabled: {0}".format(e)]
+                writeLogFile(msgFileN, msgList)
+                analogEnabled = False
             anFileNamePins = ""
-            anFileNameBuffer = collections.deque(maxlen=10)
-            anTempFileNameBuffer = collections.deque(maxlen=10)
 
         # Reset daily Water
         dailyWater = 0
 
         # Serial time out check
-        lastTimeSerialCheck = int(time.time())
+        lastSerialData = time.monotonic()
         serialTimeOutCheck = int(userConfig["Serial_TimeOut"])
 
-        # Teensy time sync
-        lastTimeSync = int(time.time())
+        # Teensy time sync: NTP is queried on a background thread, which
+        # writes the T command only after a valid sample (main() synced already)
         teensyTimeSyncFreq = int(
             float((userConfig["TimeSyncFreq"].lower()).replace("hr", "")) * 3600
         )
+        clockService = ClockService.ClockService(
+            userConfig["NTPServer"],
+            lambda cmd: ser.write(cmd.encode("ascii")),
+            lambda msgList: writeLogFile(msgFileN, msgList),
+            sync_sec=teensyTimeSyncFreq,
+            poll_sec=float(userConfig.get("Clock_Poll_Sec", 300)),
+            max_delay=float(userConfig.get("Clock_Max_Delay", 0.5)),
+            max_jump=float(userConfig.get("Clock_Max_Jump", 1.0)),
+            utc_offset=-time.timezone,
+            synced=True,
+        ).start()
+
+        # Precompute housekeeping deadlines (idle check, rotation);
+        # the daily water check is scheduled when a D report arrives
+        scheduler = HousekeepingScheduler()
+        scheduler.schedule("idle", lastSerialData + serialTimeOutCheck)
+        rotationDelay = nextRotationDelay(currentDate, userConfig)
+        if rotationDelay is not None:
+            scheduler.schedule("rotate", time.monotonic() + rotationDelay)
+        if teensyClock is not None:
+            scheduler.schedule("timing", time.monotonic() + timingLogFreq)
+        if statsSnapshotFreq > 0:
+            scheduler.schedule("stats", time.monotonic() + statsSnapshotFreq)
+
+        # Drain the serial port(s) on reader threads so slow file, e-mail or
+        # NTP work below never stalls the USB drain; otherwise sleep in select()
+        threadedRead = userConfig.get("Serial_Reader_Thread", "true").lower() == "true"
+        anReader = None
+        if reader is not None:
+            # Drained by the shared multi-board reader thread
+            threadedRead = True
+        elif threadedRead:
+            readerWakeup = threading.Event()
+            reader = SerialReader.threaded_reader_from_config(
+                ser, userConfig, readerWakeup, "TeensySerialReader"
+            )
+            if analogEnabled:
+                anReader = SerialReader.threaded_reader_from_config(
+                    anSer, userConfig, readerWakeup, "AnalogSerialReader"
+                )
+        else:
+            reader = SerialReader.reader_from_config(
+                ser, userConfig, [anSer] if analogEnabled else []
+            )
+        lastDropCount = 0
+        lastDropLog = 0.0
+
+        # Startup is over once the first read starts
+        startupProfile.write("log.out")
 
         while True:
 
-            # This helps in optimization of CPU usage
-            # time.sleep(1.0/100000.0)  # should be smaller than the 1kHz
+            # Wake no later than the next housekeeping deadline or output/log flush
+            deadline = scheduler.nextDue()
+            if deadline is None:
+                deadline = time.monotonic() + 3600
+            for flushDue in (writer.flush_due(), sessionLog.flush_due()):
+                if flushDue is not None:
+                    deadline = min(deadline, flushDue)
 
-            # Check available data in serial and read them
+            # Check available data in serial and read them (with receive times)
             try:
-                dataToRead = ser.inWaiting()
-                dataRead = ser.read(dataToRead)
+                chunksRead = reader.read_stamped(deadline)
             except KeyboardInterrupt:
                 raise Exception("Teensy Serial Port User Interrupt Error")
             except Exception:
                 sendEmail("The serial port is not open.", userConfig, msgFileN)
                 raise Exception("Teensy Serial Port Not Available Error")
 
-            if isinstance(dataRead, bytes):
-                dataRead = dataRead.decode("utf-8", "ignore")
-
-            totalDataRead = "".join([totalDataRead, dataRead])
-
-            # True indicates all lines ends in \n
-            completeLine = True
-
-            # Check if all lines end in \n
-            for line in totalDataRead.splitlines(True):
-                if "\n" not in line:
-                    completeLine = False
-                    break
-
-            # Open output file to append text
-            f = open(outputFileN, "a")
-            tsf = open(trialSummaryFileN, "a")  # open trial summary file for this cycle
-
-            if len(totalDataRead) == 0:
-                if (int(time.time()) - lastTimeSerialCheck) > serialTimeOutCheck:
-                    msgList = ["Error:", "Teensy serial port is idle"]
+            # Report bytes the reader thread had to drop (rate-limited)
+            if threadedRead and reader.ring.dropped_chunks != lastDropCount:
+                if time.monotonic() - lastDropLog > 60:
+                    lastDropCount = reader.ring.dropped_chunks
+                    lastDropLog = time.monotonic()
+                    msgList = [
+                        "Error:",
+                        "       Serial reader queue full, data dropped.",
+                        "       Reader queue: {0}".format(reader.stats()),
+                    ]
                     writeLogFile(msgFileN, msgList)
 
-                    # Send an email if serial is not available
-                    sendEmail("Teensy serial port is idle.", userConfig, msgFileN)
-
-                    lastTimeSerialCheck = int(time.time())
-                    # raise Exception('Teensy Serial Port IDLE Error')
-            else:
-                lastTimeSerialCheck = int(time.time())
-
-            # If all lines end in \n, then write to output file or analog file
-            if completeLine and len(totalDataRead) > 1:
-                for eachLine in totalDataRead.splitlines(True):
-                    words = eachLine.split(",")
+            # The idle deadline is checked lazily against the last data time
+            if chunksRead:
+                lastSerialData = time.monotonic()
 
-                    # This tag indicates (I)nformation from Teensy
-                    if words[0] == "I":
-                        msgList = ["Info:", eachLine[2:]]
-                        writeLogFile(msgFileN, msgList)
+            # Handle every complete line; partial lines wait for the next read.
+            # A line is stamped with the receive time of the chunk completing it
+            linesRead = [
+                (rxTime, line)
+                for rxTime, chunk in chunksRead
+                for line in framer.feed(chunk)
+            ]
+            for rxTime, eachLine in linesRead:
+                if not eachLine.strip():
+                    continue
+                words = eachLine.split(",")
+
+                # This tag indicates (I)nformation from Teensy
+                if words[0] == "I":
+                    msgList = ["Info:", eachLine[2:]]
+                    writeLogFile(msgFileN, msgList)
+                    if liveEvents is not None:
+                        liveEvents.publish("info", words, rxTime)
 
-                    # This tag indicates (E)rror from Teensy
-                    elif words[0] == "E":
-                        msgList = ["Error:", eachLine[2:]]
+                # This tag indicates (E)rror from Teensy
+                elif words[0] == "E":
+                    msgList = ["Error:", eachLine[2:]]
+                    writeLogFile(msgFileN, msgList)
+                    if liveEvents is not None:
+                        liveEvents.publish("error", words, rxTime)
+
+                # This tag indicates daily water report from Teensy
+                elif words[0] == "D":
+                    dailyWater = int(words[1])
+                    scheduler.schedule("water", time.monotonic())
+                    if liveEvents is not None:
+                        liveEvents.publish("water", words, rxTime)
+
+                # This tag indicates pin numbers in analog reading
+                elif words[0] == "P":
+                    if analogEnabled:
+                        anFileNamePins = (
+                            "."
+                            + ".".join(
+                                [words[i] for i in range(1, len(words))]
+                            ).rstrip()
+                        )
+                        anCapture.set_pins(words[1:])
+                    if liveEvents is not None:
+                        liveEvents.publish("pins", words, rxTime)
+
+                # Otherwise, it is a regular output, just append to output
+                else:
+                    # Detect trial summary lines (event codes >=200) independent of field count
+                    isNumeric = words[0].isdigit()
+                    if isNumeric and int(words[0]) >= 200:
+                        writer.write_trial(eachLine)
+                        trialSummaryLineCount += 1
+                        sessionStats.add_trial(words)
+                        if liveEvents is not None:
+                            liveEvents.publish("trial", words, rxTime)
+                        continue
+
+                    # Legacy regular output lines must have exactly 8 fields
+                    if len(words) != 8:
+                        msgList = [
+                            "Error:",
+                            "       Error in reading serial (unexpected field count).",
+                            "       Modify serial read or update parser.",
+                            eachLine,
+                        ]
                         writeLogFile(msgFileN, msgList)
-
-                    # This tag indicates daily water report from Teensy
-                    elif words[0] == "D":
-                        dailyWater = int(words[1])
-
-                    # This tag indicates pin numbers in analog reading
-                    elif words[0] == "P":
-                        if analogEnabled:
-                            anFileNamePins = (
-                                "."
-                                + ".".join(
-                                    [words[i] for i in range(1, len(words))]
-                                ).rstrip()
-                            )
-
-                    # Otherwise, it is a regular output, just append to output
                     else:
-                        # Detect trial summary lines (event codes >=200) independent of field count
-                        isNumeric = words[0].isdigit()
-                        if isNumeric and int(words[0]) >= 200:
-                            tsf.write(eachLine)
-                            trialSummaryLineCount += 1
-                            continue
-
-                        # Legacy regular output lines must have exactly 8 fields
-                        if len(words) != 8:
-                            msgList = [
-                                "Error:",
-                                "       Error in reading serial (unexpected field count).",
-                                "       Modify serial read or update parser.",
-                                eachLine,
-                            ]
-                            writeLogFile(msgFileN, msgList)
-                        else:
-                            if analogEnabled:
-                                # This tag indicates start of analog saving
-                                if words[0] == "99":
-                                    if anFileNamePins:
-                                        analogDirPath = getAnalogDirPath(userConfig)
-                                        anFileName = (
-                                            analogDirPath
-                                            + "/an."
-                                            + ".".join(
-                                                [
-                                                    words[i]
-                                                    for i in reversed(range(4, 6))
-                                                ]
-                                            ).rstrip()
-                                        )
-                                        anFileName = "".join(
-                                            [anFileName, anFileNamePins]
-                                        )
-                                    else:
-                                        msgList = [
-                                            "Error:",
-                                            "       Error in analog file name.",
-                                            "       Analog pin file names missing.",
-                                            "       Modify analog saving.",
-                                        ]
-                                        writeLogFile(msgFileN, msgList)
-
-                                # This tag indicates end of analog saving
-                                if words[0] == "98":
-                                    if anFileName:
-                                        anFileNameBuffer.append(anFileName)
-                                    else:
-                                        msgList = [
-                                            "Error:",
-                                            "       Error in analog file name.",
-                                            "       Real analog file name missing.",
-                                            "       Modify analog saving.",
-                                        ]
-                                        writeLogFile(msgFileN, msgList)
-
-                            f.write(eachLine)
-                            dataLineCount += 1
-
-                # Reset accumulated string
-                totalDataRead = ""
+                        if analogEnabled:
+                            # This tag indicates start of analog saving
+                            if words[0] == "99":
+                                if anFileNamePins:
+                                    analogDirPath = getAnalogDirPath(userConfig)
+                                    anFileName = (
+                                        analogDirPath
+                                        + "/an."
+                                        + ".".join(
+                                            [
+                                                words[i]
+                                                for i in reversed(range(4, 6))
+                                            ]
+                                        ).rstrip()
+                                    )
+                                    anFileName = "".join(
+                                        [anFileName, anFileNamePins]
+                                    )
+                                    anCapture.start(anFileName, int(words[4]))
+                                else:
+                                    msgList = [
+                                        "Error:",
+                                        "       Error in analog file name.",
+                                        "       Analog pin file names missing.",
+                                        "       Modify analog saving.",
+                                    ]
+                                    writeLogFile(msgFileN, msgList)
+
+                            # This tag indicates end of analog saving
+                            if words[0] == "98":
+                                if not anCapture.stop(int(words[4])):
+                                    msgList = [
+                                        "Error:",
+                                        "       Error in analog file name.",
+                                        "       Real analog file name missing.",
+                                        "       Modify analog saving.",
+                                    ]
+                                    writeLogFile(msgFileN, msgList)
+
+                        writer.write_data(eachLine, words, rxTime)
+                        dataLineCount += 1
+                        sessionStats.add_report(words)
+                        if liveEvents is not None:
+                            liveEvents.publish("report", words, rxTime)
+                        if teensyClock is not None:
+                            try:
+                                teensyClock.add(rxTime, int(words[4]), int(words[5]))
+                            except ValueError:
+                                pass
 
             if analogEnabled:
                 # Check available data in analog USB serial and read them
                 try:
-                    anDataToRead = anSer.inWaiting()
-                    anDataRead = anSer.read(anDataToRead)
+                    if anReader is not None:
+                        anDataRead = anReader.read()
+                    else:
+                        anDataToRead = anSer.inWaiting()
+                        anDataRead = anSer.read(anDataToRead)
                 except KeyboardInterrupt:
                     raise Exception("Analog USB Port User Interrupt Error")
                 except Exception:
                     sendEmail("The analog USB port is not open.", userConfig, msgFileN)
                     raise Exception("Analog USB Port Not Available Error")
 
-                if isinstance(anDataRead, bytes):
-                    anDataRead = anDataRead.decode("utf-8", "ignore")
-                totalAnalogRead = "".join([totalAnalogRead, anDataRead])
-            # ...existing code...
+                anCapture.feed(anDataRead)
 
-            # close the file until next read [for tail -f output]
-            f.close()
-            tsf.close()
+            # Flush buffered output and log once the time limit passes [for tail -f output]
+            writer.maybe_flush()
+            sessionLog.maybe_flush()
 
-            # Change temporary analog file names
-            if analogEnabled:
-                renameQueueFiles(anTempFileNameBuffer, anFileNameBuffer, msgFileN)
-
-            # Check daily water and report it to user
-            dailyWater = checkDailyWater(dailyWater, userConfig, msgFileN)
-
-            # Check Teensy time synced
-            if (int(time.time()) - lastTimeSync) > teensyTimeSyncFreq:
-                syncTimeNTP(ser, userConfig, msgFileN)
-                lastTimeSync = int(time.time())
-
-            # Check output [result] file name and changed it daily
-            if "Output_Name_Freq" in userConfig:
-                prevDat = outputFileN
-                prevTrial = trialSummaryFileN
-                prevDataCount = dataLineCount
-                prevTrialCount = trialSummaryLineCount
-                [currentDate, outputFileN] = changeOutputFileN(
-                    currentDate, outputFileN, userConfig
-                )
-                if prevDat != outputFileN:  # rotation occurred
-                    # Write rotation marker to old files (not counted in checksum metrics)
-                    rotEpoch = int(time.time())
-                    try:
-                        with open(prevDat, "a") as pf:
-                            pf.write(
-                                "ROTATE,{},{},{}\n".format(
-                                    rotEpoch, prevDataCount, prevTrialCount
-                                )
-                            )
-                        with open(prevTrial, "a") as ptf:
-                            ptf.write(
-                                "ROTATE,{},{},{}\n".format(
-                                    rotEpoch, prevDataCount, prevTrialCount
-                                )
-                            )
-                    except Exception:
-                        pass
-                    # Files remain on disk uncompressed after rotation
-
-                    # Prepare new trial summary file matching rotated .dat
-                    trialSummaryFileN = outputFileN.replace(".dat", ".trial.csv")
-                    createInitialFile(trialSummaryFileN, "a")
+            # Run only the housekeeping whose deadline has passed
+            for task in scheduler.popDue(time.monotonic()):
+
+                # Teensy serial idle check
+                if task == "idle":
+                    if time.monotonic() - lastSerialData >= serialTimeOutCheck:
+                        msgList = ["Error:", "Teensy serial port is idle"]
+                        writeLogFile(msgFileN, msgList)
+
+                        # Send an email if serial is not available
+                        sendEmail("Teensy serial port is idle.", userConfig, msgFileN)
+
+                        lastSerialData = time.monotonic()
+                        # raise Exception('Teensy Serial Port IDLE Error')
+                    scheduler.schedule("idle", lastSerialData + serialTimeOutCheck)
+
+                # Write rolling receive latency and clock estimates
+                elif task == "timing":
+                    msgList = [
+                        "Info:",
+                        "       Serial Timing: "
+                        + TeensyClock.format_summary(teensyClock.summary()),
+                    ]
+                    writeLogFile(msgFileN, msgList)
+                    scheduler.schedule("timing", time.monotonic() + timingLogFreq)
+
+                # Refresh the session aggregate snapshot for remote polling
+                elif task == "stats":
                     try:
-                        needHeaderNew = os.path.getsize(trialSummaryFileN) == 0
-                    except OSError:
-                        needHeaderNew = True
-                    if needHeaderNew:
-                        with open(trialSummaryFileN, "a") as tsf_init:
-                            tsf_init.write(TRIAL_SUMMARY_HEADER)
+                        sessionStats.write_snapshot(statsFileN)
+                    except Exception as e:
+                        msgList = [
+                            "Error:",
+                            "       Failed to write stats snapshot: {0}".format(e),
+                        ]
+                        writeLogFile(msgFileN, msgList)
+                    scheduler.schedule("stats", time.monotonic() + statsSnapshotFreq)
+
+                # Check daily water and report it to user
+                elif task == "water":
+                    dailyWater = checkDailyWater(dailyWater, userConfig, msgFileN)
+
+                # Check output [result] file name and changed it daily
+                elif task == "rotate":
+                    prevDat = outputFileN
+                    prevTrial = trialSummaryFileN
+                    prevDataCount = dataLineCount
+                    prevTrialCount = trialSummaryLineCount
+                    [currentDate, outputFileN] = changeOutputFileN(
+                        currentDate, outputFileN, userConfig
+                    )
+                    if prevDat != outputFileN:  # rotation occurred
+                        # Rotation marker closes the old files (not counted in checksum metrics);
+                        # the digests cover each file's content before the marker
+                        rotEpoch = int(time.time())
+                        prevDatMd5, prevTrialMd5 = writer.digests()
+                        marker = "ROTATE,{},{},{},{},{}\n".format(
+                            rotEpoch, prevDataCount, prevTrialCount, prevDatMd5, prevTrialMd5
+                        )
+                        # Prepare new trial summary file matching rotated .dat
+                        trialSummaryFileN = outputFileN.replace(".dat", ".trial.csv")
+                        try:
+                            oldFiles = writer.rotate(outputFileN, trialSummaryFileN, marker)
+                            if compressor is not None:
+                                compressor.submit([f.path for f in oldFiles])
+                        except Exception as e:
+                            msgList = [
+                                "Error:",
+                                "       Failed to rotate output files: {0}".format(e),
+                            ]
+                            writeLogFile(msgFileN, msgList)
+                            outputFileN = prevDat
+                            trialSummaryFileN = prevTrial
+                    scheduler.schedule(
+                        "rotate",
+                        time.monotonic() + nextRotationDelay(currentDate, userConfig),
+                    )
 
             # Check exit signal
             if exitInst.exitStatus:
@@ -1063,48 +1297,48 @@ def printSerialOutput(ser, anSer, userConfig, analogEnabled, expStartTime):
 
     except KeyboardInterrupt:
         print("   ... Program ended: User interrupted the program.")
-        try:
-            if "f" in locals() and hasattr(f, "close"):
-                f.close()
-            if "tsf" in locals() and hasattr(tsf, "close"):
-                tsf.close()
-        except Exception:
-            pass
 
     except Exception as e:
         print("   ... Program ended: Error occurred.")
         print("   ... Error : %s: %s \n" % (e.__class__, e))
-        try:
-            if "f" in locals() and hasattr(f, "close"):
-                f.close()
-            if "tsf" in locals() and hasattr(tsf, "close"):
-                tsf.close()
-        except Exception:
-            pass
 
     finally:
-        # Session-end flush / integrity marker (with checksums & counts)
-        try:
+        # Stop the clock service before the last writes to the Teensy
+        if "clockService" in locals():
+            clockService.stop(5.0)
+
+        # Return the Teensy to ASCII records for the next session
+        if locals().get("framedProtocol"):
+            try:
+                ser.write(b"F0")
+            except Exception:
+                pass
+
+        # Final aggregate snapshot
+        if "sessionStats" in locals() and statsSnapshotFreq > 0:
+            try:
+                sessionStats.write_snapshot(statsFileN)
+            except Exception:
+                pass
 
-            def file_md5(p):
-                if not os.path.exists(p):
-                    return "NA"
-                h = hashlib.md5()
-                with open(p, "rb") as fh:
-                    for chunk in iter(lambda: fh.read(8192), b""):
-                        h.update(chunk)
-                return h.hexdigest()
-
-            dat_md5 = file_md5(outputFileN)
-            trial_md5 = file_md5(trialSummaryFileN)
+        # Disconnect the live monitors
+        if locals().get("liveEvents") is not None:
+            liveEvents.stop()
+
+        # Stop the reader threads before finishing the session files
+        for _rd in (locals().get("reader"), locals().get("anReader")):
+            if isinstance(_rd, SerialReader.ThreadedReader):
+                _rd.stop()
+
+        # Session-end flush / integrity marker (with checksums & counts);
+        # digests are kept up to date by the writer, so nothing is re-read
+        try:
+            dat_md5, trial_md5 = writer.digests()
             epoch_end = int(time.time())
             marker = "SE,{},{},{},{},{}\n".format(
                 epoch_end, dataLineCount, trialSummaryLineCount, dat_md5, trial_md5
             )
-            # with open(outputFileN, "a") as f_end:
-            #     f_end.write(marker)
-            with open(trialSummaryFileN, "a") as tsf_end:
-                tsf_end.write(marker)
+            writer.write_marker(marker, [writer.trial])
         except Exception as e:
             msgList = [
                 "Error:",
@@ -1112,6 +1346,21 @@ def printSerialOutput(ser, anSer, userConfig, analogEnabled, expStartTime):
             ]
             writeLogFile(msgFileN, msgList)
 
+        # Close an analog window left open by the exit
+        if "anCapture" in locals():
+            anCapture.close()
+
+        # Flush and close the session files (writes the .md5 sidecars)
+        try:
+            if "writer" in locals():
+                writer.close()
+        except Exception:
+            pass
+
+        # Let the rotated files still queued finish compressing
+        if locals().get("compressor") is not None:
+            compressor.stop(float(userConfig.get("Output_Compress_Wait_Sec", 60)))
+
         print("   ... The current time: " + getTimeFormat())
         # Build session-end summary line without f-strings for wider Python compatibility
         _dat_md5_val = locals().get("dat_md5", "NA")
@@ -1122,8 +1371,46 @@ def printSerialOutput(ser, anSer, userConfig, analogEnabled, expStartTime):
                 dataLineCount, trialSummaryLineCount, _dat_md5_val, _trial_md5_val
             ),
         ]
+        if "framer" in locals():
+            msgList.append(
+                "Serial Framing: lines={0}, overlong={1}, decodeErrors={2}, pendingBytes={3}".format(
+                    framer.lines,
+                    framer.overlong,
+                    framer.decode_errors,
+                    framer.pending,
+                )
+            )
+            if isinstance(framer, SerialReader.FrameDecoder):
+                msgList.append(
+                    "Serial Frames: frames={0}, crcErrors={1}, gaps={2}, lost={3}, desync={4}".format(
+                        framer.frames,
+                        framer.crc_errors,
+                        framer.gaps,
+                        framer.lost,
+                        framer.desync,
+                    )
+                )
+        if "anCapture" in locals():
+            msgList.append("Analog Capture: {0}".format(anCapture.stats()))
+        if locals().get("teensyClock") is not None:
+            msgList.append(
+                "Serial Timing: " + TeensyClock.format_summary(teensyClock.summary())
+            )
+        if isinstance(locals().get("reader"), SerialReader.ThreadedReader):
+            msgList.append("Serial Reader Queue: {0}".format(reader.stats()))
+        if locals().get("liveEvents") is not None:
+            msgList.append("Live Events: {0}".format(liveEvents.stats()))
+        if "clockService" in locals():
+            msgList.append("Clock Sync: {0}".format(clockService.stats()))
+        if locals().get("writer") is not None and writer.commit is not None:
+            msgList.append("Output Sync: {0}".format(writer.commit.stats()))
+        if locals().get("compressor") is not None:
+            msgList.append("Output Compression: {0}".format(compressor.stats()))
         writeLogFile(msgFileN, msgList)
 
+        # Force the buffered session log to disk
+        SessionWriters.close_session_logger(msgFileN)
+
 
 def getEverything(ser, duration):
     everything = []
@@ -1139,6 +1426,8 @@ def getEverything(ser, duration):
             break
 
     with open("everything.list", "wb") as file:
+        import pickle
+
         pickle.dump(everything, file)
 
     print("EXITING")
@@ -1190,21 +1479,12 @@ def removeCrontab():
         )
 
 
-def main():
+def startStorageMonitor(userConfig):
     """
-    Main function to compile/upload Teensy code and log the Teensy outputs.
+    Function to start the background storage monitor
+    (checks root filesystem by default)
     """
 
-    # Include state machine header files
-    includeSMHeader("SetStateMachineTP.h", "StateMachineHeaders.h")
-
-    # Read user configuration
-    userConfig = getUserConfig("userInfo.in", "=")
-
-    # Sync RPi system time
-    syncRPiTime(userConfig)
-
-    # Start background storage monitor (checks root filesystem by default)
     try:
         check_path = userConfig.get("Storage_Check_Path", "/")
         threshold_pct = float(userConfig.get("Storage_Fill_Threshold", 85))
@@ -1229,32 +1509,209 @@ def main():
         except Exception:
             pass
 
-    # Experiment start timeT
+
+def getBoardConfigs(userConfig):
+    """
+    Function to read the per-board configurations listed in Boards.
+    Each board file is read like userInfo.in and overrides its keys.
+    """
+
+    boardConfigs = []
+    for fileName in [f.strip() for f in userConfig["Boards"].split(",") if f.strip()]:
+        boardConfig = dict(userConfig)
+        boardConfig.pop("Boards", None)
+        boardConfig.update(getUserConfig(fileName, "="))
+        boardConfig["_Board_File"] = fileName
+        if not (boardConfig.get("Teensy_Port") or boardConfig.get("Teensy_USB_Serial")):
+            exit(
+                "   ... * Error: %s needs Teensy_Port or Teensy_USB_Serial." % fileName
+            )
+        if boardConfig.get("Analog", "false").lower() == "true":
+            print("   ... Analog capture is not supported in multi-board mode (%s)." % fileName)
+            boardConfig["Analog"] = "False"
+        boardConfigs.append(boardConfig)
+
+    names = [(b["Subject_Name"], getOutputDir(b)) for b in boardConfigs]
+    if len(set(names)) != len(names):
+        exit("   ... * Error: boards need distinct Subject_Name or Output_Dir.")
+
+    # Each board runs its own EventServer: a shared unix socket would be
+    # unlinked by the next board and a shared TCP port fails to bind
+    liveAddresses = {}
+    for boardConfig in boardConfigs:
+        address = boardConfig.get("Live_Events", "").strip()
+        if not address or address.lower() in ("false", "none"):
+            continue
+        family, sockaddr = EventServer.parse_address(address)
+        key = sockaddr[1] if family == socket.AF_INET else os.path.realpath(sockaddr)
+        if key in liveAddresses:
+            exit(
+                "   ... * Error: %s and %s share Live_Events %s; give each board its own."
+                % (liveAddresses[key], boardConfig["_Board_File"], address)
+            )
+        liveAddresses[key] = boardConfig["_Board_File"]
+    return boardConfigs
+
+
+def runMultiBoard(userConfig):
+    """
+    Function to acquire from several Teensy boards in one process.
+    One selector thread drains every board's port into its own bounded queue;
+    each board is processed by printSerialOutput on its own thread, with its
+    own subject, output files, rotation, checksums and alerts.
+    """
+
+    boardConfigs = getBoardConfigs(userConfig)
+    print("   ... Multi-board mode: %d boards." % len(boardConfigs))
+    print("   ... Boards must already be programmed; compile/upload is skipped.")
+
+    with startupProfile.step("syncRPiTime"):
+        syncRPiTime(userConfig)
+    startStorageMonitor(userConfig)
+    with startupProfile.step("setupGPIO"):
+        setupGPIO(userConfig)
     expStartTime = time.time()
 
-    # Compile and upload Teensy code
-    compileUploadTeensy(userConfig)
+    # Open every board's port (by explicit port or USB serial number)
+    portDeadline = float(userConfig.get("Serial_Port_Deadline_Sec", 10))
+    sers = []
+    for boardConfig in boardConfigs:
+        with startupProfile.step("getSerialConnection " + boardConfig["Subject_Name"]):
+            # An explicit Teensy_Port is used as is: never fall back to
+            # another Teensy, which would belong to a different board
+            explicitPort = boardConfig.get("Teensy_Port", "").strip()
+            claimed = [s.port for s in sers]
+            if explicitPort:
+                if os.path.realpath(explicitPort) in [os.path.realpath(p) for p in claimed]:
+                    exit(
+                        "   ... * Error: %s is used by two boards (%s)."
+                        % (explicitPort, boardConfig["_Board_File"])
+                    )
+                ports = (explicitPort, explicitPort)
+            else:
+                ports = ("/dev/ttyACM0", "/dev/ttyACM1")
+            ser = getSerialConnection(
+                ports[0],
+                ports[1],
+                1000000,
+                PortWatcher.UsbMatch.from_config(boardConfig),
+                portDeadline,
+                scan=not explicitPort,
+                exclude=claimed,
+            )
+        print("   ... %s on %s" % (boardConfig["_Board_File"], ser.port))
+        syncTimeNTP(ser, boardConfig)
+        sers.append(ser)
+
+    addCrontab(userConfig)
+
+    multiReader = SerialReader.MultiPortReader(
+        float(userConfig.get("Serial_Read_Timeout", 0.5))
+    ).start()
+    boardThreads = []
+    if not exitInst.exitStatus:
+        for ser, boardConfig in zip(sers, boardConfigs):
+            handle = multiReader.add(
+                ser,
+                int(boardConfig.get("Serial_Queue_Bytes", 4194304)),
+                name=boardConfig["Subject_Name"],
+            )
+            boardThread = threading.Thread(
+                target=printSerialOutput,
+                args=(ser, False, boardConfig, False, expStartTime),
+                kwargs={"reader": handle, "desktop": False},
+                name="Board-" + boardConfig["Subject_Name"],
+            )
+            boardThread.daemon = True
+            boardThread.start()
+            boardThreads.append(boardThread)
+
+    # Keep the main thread free for the exit signal handler
+    while any(t.is_alive() for t in boardThreads):
+        for boardThread in boardThreads:
+            boardThread.join(0.5)
+
+    multiReader.stop()
+    removeCrontab()
+    for ser in sers:
+        ser.close()
+    GPIO.cleanup()
+
+
+def main():
+    """
+    Main function to compile/upload Teensy code and log the Teensy outputs.
+    """
+
+    # Read user configuration
+    with startupProfile.step("getUserConfig"):
+        userConfig = getUserConfig("userInfo.in", "=")
+
+    # Several boards listed in Boards: one process serves all of them
+    if userConfig.get("Boards", "").strip():
+        runMultiBoard(userConfig)
+        return
 
     # Check analog serial status [True: Enabled, False: Disabled]
     analogEnabled = False
     if userConfig["Analog"].lower() == "true":
         analogEnabled = True
 
-    # Open Teensy main serial port
-    ser = getSerialConnection("/dev/ttyACM0", "/dev/ttyACM1", 1000000)
+    # Experiment start timeT
+    expStartTime = time.time()
 
-    # Open analog serial port [if enabled]
-    anSer = False
+    # Startup stages run as soon as the stages they depend on are done: the
+    # RPi time sync, storage monitor and analog port run during compilation,
+    # and the crontab and GPIO setup overlap the wait for the Teensy port
+    pipeline = StartupProfiler.StartupPipeline(startupProfile)
+    # Include state machine header files
+    pipeline.add(
+        "includeSMHeader",
+        lambda r: includeSMHeader("SetStateMachineTP.h", "StateMachineHeaders.h"),
+    )
+    # Sync RPi system time
+    pipeline.add("syncRPiTime", lambda r: syncRPiTime(userConfig))
+    pipeline.add("startStorageMonitor", lambda r: startStorageMonitor(userConfig))
+    # Compile and upload Teensy code
+    pipeline.add(
+        "compileUploadTeensy",
+        lambda r: compileUploadTeensy(userConfig),
+        after=["includeSMHeader"],
+    )
+    # Open analog serial port [if enabled]; it does not depend on the upload
+    portDeadline = float(userConfig.get("Serial_Port_Deadline_Sec", 10))
     if analogEnabled:
-        anSer = getSerialConnection("/dev/serial0", "/dev/serial1", 1000000)
-
+        pipeline.add(
+            "getSerialConnection analog",
+            lambda r: getSerialConnection(
+                "/dev/serial0", "/dev/serial1", 1000000, deadline=portDeadline
+            ),
+        )
+    # Open Teensy main serial port once the uploaded board enumerates
+    pipeline.add(
+        "getSerialConnection",
+        lambda r: getSerialConnection(
+            "/dev/ttyACM0",
+            "/dev/ttyACM1",
+            1000000,
+            PortWatcher.UsbMatch.from_config(userConfig),
+            portDeadline,
+        ),
+        after=["compileUploadTeensy"],
+    )
     # Setup GPIO and write HIGH to Teensy program pin
-    setupGPIO(userConfig)
-
+    pipeline.add("setupGPIO", lambda r: setupGPIO(userConfig), after=["compileUploadTeensy"])
     # Sync Teensy time with NTPServer
-    syncTimeNTP(ser, userConfig)
+    pipeline.add(
+        "syncTimeNTP",
+        lambda r: syncTimeNTP(r["getSerialConnection"], userConfig),
+        after=["getSerialConnection"],
+    )
+    pipeline.add("addCrontab", lambda r: addCrontab(userConfig), after=["compileUploadTeensy"])
 
-    addCrontab(userConfig)
+    results = pipeline.run(userConfig.get("Startup_Concurrent", "true").lower() == "true")
+    ser = results["getSerialConnection"]
+    anSer = results.get("getSerialConnection analog", False)
 
     if not exitInst.exitStatus:
         # Print serial output and analog serial output [if enabled]
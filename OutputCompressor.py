@@ -0,0 +1,276 @@
+#!/usr/bin/python3
+
+"""Compress rotated session files in the background.
+
+After ``Output_Name_Freq`` rotation the finished ``.dat`` and ``.trial.csv``
+files used to stay on the SD card uncompressed.  ``OutputCompressor`` takes
+the paths returned by ``SessionWriter.rotate`` and compresses them on a
+low-priority thread, so the acquisition loop never waits for it:
+
+- the file is streamed to ``<file>.gz`` (or ``<file>.zst`` with the optional
+  ``zstandard`` module) through a ``.tmp`` file, fsync'ed and renamed, so a
+  crash never leaves a truncated archive under the final name
+- the MD5 of the uncompressed bytes is checked against the ``<file>.md5``
+  sidecar written at close; on a mismatch the original is kept
+- the ``<file>.md5`` sidecar is replaced by a ``md5sum -c`` compatible
+  ``<file>.gz.md5`` covering the compressed bytes, and the original is removed
+
+The ``ROTATE``/``SE`` markers inside the files are unchanged; their digests
+cover the uncompressed content (``zcat <file>.gz | head -n -1 | md5sum``).
+The ``.idx`` indexes and ``.rec.npy`` sidecars are left uncompressed, and
+``open_session_file`` lets ``SessionIndex`` read a file that has been
+compressed since.
+"""
+
+import gzip
+import hashlib
+import io
+import os
+import threading
+import time
+
+try:
+    import zstandard  # type: ignore
+except Exception:  # optional
+    zstandard = None
+
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+CHUNK = 1 << 20
+
+
+def compressed_path(path, method):
+    return path + SUFFIXES[method]
+
+
+def _open_compressed(path, method, level):
+    if method == "zstd":
+        raw = open(path, "wb")
+        return raw, zstandard.ZstdCompressor(level=level).stream_writer(raw, closefd=False)
+    raw = open(path, "wb")
+    return raw, gzip.GzipFile(
+        filename=os.path.basename(path)[: -len(SUFFIXES["gzip"])],
+        mode="wb",
+        compresslevel=level,
+        fileobj=raw,
+        mtime=0,
+    )
+
+
+def open_session_file(path, offset=0):
+    """Open ``path`` (or its ``.gz``/``.zst`` once compressed) for binary reading at ``offset``.
+
+    ``offset`` is a position in the uncompressed file; compressed files are
+    decompressed up to it.
+    """
+    if os.path.exists(path) or not (
+        os.path.exists(path + SUFFIXES["gzip"]) or os.path.exists(path + SUFFIXES["zstd"])
+    ):
+        handle = open(path, "rb")  # FileNotFoundError names the original file
+    elif os.path.exists(path + SUFFIXES["gzip"]):
+        handle = gzip.open(path + SUFFIXES["gzip"], "rb")
+    elif zstandard is None:
+        raise OSError("{} needs the zstandard module".format(path + SUFFIXES["zstd"]))
+    else:
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            open(path + SUFFIXES["zstd"], "rb"), closefd=True
+        )
+        while offset > 0:
+            skipped = len(reader.read(min(offset, CHUNK)))
+            if not skipped:
+                break
+            offset -= skipped
+        return io.BufferedReader(reader)
+    handle.seek(offset)
+    return handle
+
+
+def _sidecar_digest(path):
+    try:
+        with open(path + ".md5") as handle:
+            return handle.read().split()[0]
+    except (OSError, IndexError):
+        return None
+
+
+def compress_file(path, method="gzip", level=6):
+    """Compress ``path`` in place; returns a dict with sizes, digests and time."""
+    start = time.monotonic()
+    outPath = compressed_path(path, method)
+    tmpPath = outPath + ".tmp"
+    sourceHash = hashlib.md5()
+    bytesIn = 0
+    raw, stream = _open_compressed(tmpPath, method, level)
+    try:
+        with open(path, "rb") as source:
+            for chunk in iter(lambda: source.read(CHUNK), b""):
+                sourceHash.update(chunk)
+                bytesIn += len(chunk)
+                stream.write(chunk)
+        stream.close()  # writes the trailer; the raw file stays open
+        raw.flush()
+        os.fsync(raw.fileno())
+        raw.close()
+    except BaseException:
+        raw.close()
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        raise
+
+    expected = _sidecar_digest(path)
+    if expected is not None and expected != sourceHash.hexdigest():
+        os.remove(tmpPath)
+        raise ValueError(
+            "{} does not match its .md5 sidecar ({} != {}); kept uncompressed".format(
+                path, sourceHash.hexdigest(), expected
+            )
+        )
+
+    outHash = hashlib.md5()
+    with open(tmpPath, "rb") as handle:
+        for chunk in iter(lambda: handle.read(CHUNK), b""):
+            outHash.update(chunk)
+    os.replace(tmpPath, outPath)
+
+    sidecar = outPath + ".md5"
+    with open(sidecar + ".tmp", "w") as handle:
+        handle.write("{}  {}\n".format(outHash.hexdigest(), os.path.basename(outPath)))
+    os.replace(sidecar + ".tmp", sidecar)
+    if os.path.exists(path + ".md5"):
+        os.remove(path + ".md5")
+    os.remove(path)
+    return {
+        "path": path,
+        "out": outPath,
+        "bytesIn": bytesIn,
+        "bytesOut": os.path.getsize(outPath),
+        "md5": sourceHash.hexdigest(),
+        "outMd5": outHash.hexdigest(),
+        "seconds": time.monotonic() - start,
+    }
+
+
+class OutputCompressor(object):
+    """Compress submitted files one by one on a background thread.
+
+    ``log`` takes a ``writeLogFile`` message list.  ``zstd`` falls back to
+    ``gzip`` when the ``zstandard`` module is not installed.
+    """
+
+    def __init__(self, method="gzip", level=None, log=None):
+        method = method.strip().lower()
+        if method not in SUFFIXES:
+            raise ValueError("Unknown compression method: {}".format(method))
+        self.fallback = method == "zstd" and zstandard is None
+        self.method = "gzip" if self.fallback else method
+        if level is None or str(level).strip() == "":
+            level = 3 if self.method == "zstd" else 6
+        self.level = int(level)
+        self.log = log
+        self.files = 0
+        self.failures = 0
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.seconds = 0.0
+        self._queue = []
+        self._cond = threading.Condition()
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name="OutputCompressor")
+        self._thread.daemon = True
+
+    def start(self):
+        if self.fallback:
+            self._log(["Error:", "       zstandard is not installed; compressing with gzip"])
+        self._thread.start()
+        return self
+
+    def submit(self, paths):
+        with self._cond:
+            self._queue.extend(p for p in paths if p)
+            self._cond.notify()
+
+    @property
+    def pending(self):
+        with self._cond:
+            return len(self._queue)
+
+    def stop(self, timeout=None):
+        """Finish the queued files (up to ``timeout`` seconds) and stop."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _log(self, msgList):
+        if self.log is not None:
+            try:
+                self.log(msgList)
+            except Exception:
+                pass
+
+    def _run(self):
+        # Stay out of the way of the acquisition threads
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except (AttributeError, OSError):
+            pass
+        while True:
+            with self._cond:
+                while not self._queue and not self._closing:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                path = self._queue.pop(0)
+            try:
+                result = compress_file(path, self.method, self.level)
+            except Exception as e:
+                self.failures += 1
+                self._log(
+                    [
+                        "Error:",
+                        "       Failed to compress {0}".format(path),
+                        "       Error : %s: %s" % (e.__class__, e),
+                    ]
+                )
+                continue
+            self.files += 1
+            self.bytesIn += result["bytesIn"]
+            self.bytesOut += result["bytesOut"]
+            self.seconds += result["seconds"]
+            self._log(
+                [
+                    "Info: Output compressed",
+                    "       {0} -> {1} ({2} -> {3} bytes, {4:.1f} s)".format(
+                        os.path.basename(path),
+                        os.path.basename(result["out"]),
+                        result["bytesIn"],
+                        result["bytesOut"],
+                        result["seconds"],
+                    ),
+                    "       md5={0}, {1}_md5={2}".format(
+                        result["md5"], self.method, result["outMd5"]
+                    ),
+                ]
+            )
+
+    def stats(self):
+        return {
+            "method": self.method,
+            "files": self.files,
+            "failures": self.failures,
+            "pending": self.pending,
+            "bytesIn": self.bytesIn,
+            "bytesOut": self.bytesOut,
+            "ratio": round(self.bytesOut / float(self.bytesIn), 4) if self.bytesIn else None,
+            "seconds": round(self.seconds, 3),
+        }
+
+
+def compressor_from_config(userConfig, log=None):
+    """Start an ``OutputCompressor`` per ``Output_Compress``, or return ``None``."""
+    method = userConfig.get("Output_Compress", "none").strip().lower()
+    if method in ("", "none", "false"):
+        return None
+    return OutputCompressor(
+        method, userConfig.get("Output_Compress_Level", None), log
+    ).start()
@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+
+"""Wait for the Teensy serial port to appear, without polling ``serial.Serial``.
+
+``getOpenPort`` used to try ``serial.Serial(port)`` every 100 us for up to
+10 s, leaking every object it opened.  ``wait_for_port`` instead sleeps on an
+inotify watch of ``/dev``: it wakes when a device node is created or its
+permissions change (udev sets them just after creation) and checks the
+candidate ports again.  Without inotify it falls back to checking every
+``poll_sec``.
+
+A candidate is accepted when:
+
+- it is a USB device whose vendor/product id (and serial number, if given)
+  match, read from sysfs; non-USB ports (e.g. the ``/dev/serial0`` UART) are
+  accepted by name
+- it can be opened read/write; the check uses ``os.open`` and closes the
+  descriptor immediately
+
+Besides the configured names, any ``/dev/ttyACM*`` node with the matching
+USB ids is accepted (unless ``scan=False``), so the Teensy is found even if
+it enumerates under another number.  Ports in ``exclude`` (e.g. claimed by
+another board) are never returned.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import glob
+import os
+import select
+import time
+
+# Teensy USB serial
+TEENSY_VID = "16c0"
+TEENSY_PID = "0483"
+
+_IN_ATTRIB = 0x00000004
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+
+
+class UsbMatch(object):
+    """USB ids a port must have (``None`` fields match anything)."""
+
+    def __init__(self, vid=None, pid=None, serial=None):
+        self.vid = vid.lower() if vid else None
+        self.pid = pid.lower() if pid else None
+        self.serial = serial or None
+
+    @classmethod
+    def from_config(cls, userConfig):
+        return cls(
+            userConfig.get("Teensy_USB_VID", TEENSY_VID).strip(),
+            userConfig.get("Teensy_USB_PID", TEENSY_PID).strip(),
+            userConfig.get("Teensy_USB_Serial", "").strip(),
+        )
+
+    def __repr__(self):
+        return "UsbMatch(vid={}, pid={}, serial={})".format(self.vid, self.pid, self.serial)
+
+
+def usb_info(port):
+    """``(vid, pid, serial)`` of a USB tty from sysfs, or ``None`` for non-USB ports."""
+    name = os.path.basename(os.path.realpath(port))
+    device = os.path.realpath(os.path.join("/sys/class/tty", name, "device"))
+    # The tty device is a USB interface; the ids live on its parent device
+    for folder in (device, os.path.dirname(device)):
+        try:
+            with open(os.path.join(folder, "idVendor")) as handle:
+                vid = handle.read().strip().lower()
+            with open(os.path.join(folder, "idProduct")) as handle:
+                pid = handle.read().strip().lower()
+        except OSError:
+            continue
+        try:
+            with open(os.path.join(folder, "serial")) as handle:
+                serial = handle.read().strip()
+        except OSError:
+            serial = None
+        return vid, pid, serial
+    return None
+
+
+def matches(port, match):
+    if match is None:
+        return True
+    info = usb_info(port)
+    if info is None:
+        return True  # not a USB device: accept it by name
+    vid, pid, serial = info
+    return (
+        (match.vid is None or match.vid == vid)
+        and (match.pid is None or match.pid == pid)
+        and (match.serial is None or match.serial == serial)
+    )
+
+
+def port_ready(port):
+    """The device node exists and can be opened read/write (closed right away)."""
+    try:
+        fd = os.open(port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    except OSError:
+        return False
+    os.close(fd)
+    return True
+
+
+def find_port(ports, match=None, scan=True, exclude=()):
+    """First ready candidate: the named ``ports``, then (``scan``) any matching ``/dev/ttyACM*``."""
+    candidates = list(ports)
+    if scan and match is not None and (match.vid or match.pid or match.serial):
+        candidates += [p for p in sorted(glob.glob("/dev/ttyACM*")) if p not in candidates]
+    excluded = set(os.path.realpath(p) for p in exclude)
+    for port in candidates:
+        if os.path.realpath(port) in excluded:
+            continue
+        if os.path.exists(port) and matches(port, match) and port_ready(port):
+            return port
+    return None
+
+
+class DevWatch(object):
+    """Non-blocking inotify watch of node creation/attribute changes in ``/dev``."""
+
+    def __init__(self, path="/dev"):
+        self.fd = None
+        libName = ctypes.util.find_library("c")
+        if not libName:
+            raise OSError(errno.ENOSYS, "libc not found")
+        libc = ctypes.CDLL(libName, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(fd, path.encode(), _IN_CREATE | _IN_ATTRIB | _IN_MOVED_TO) < 0:
+            err = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(err, "inotify_add_watch failed")
+        self.fd = fd
+
+    def wait(self, timeout):
+        """Sleep until ``/dev`` changes or ``timeout`` passes; drains the events."""
+        readable, _, _ = select.select([self.fd], [], [], max(0.0, timeout))
+        if readable:
+            try:
+                while os.read(self.fd, 4096):
+                    pass
+            except OSError:
+                pass
+        return bool(readable)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def wait_for_port(
+    ports, match=None, deadline=10.0, poll_sec=0.05, recheck_sec=0.25, scan=True, exclude=()
+):
+    """Return the first ready port within ``deadline`` seconds, else ``None``.
+
+    ``recheck_sec`` bounds each inotify sleep, for permission changes that
+    arrive without an event.
+    """
+    end = time.monotonic() + deadline
+    try:
+        watch = DevWatch()
+    except (OSError, AttributeError):
+        watch = None
+    try:
+        while True:
+            port = find_port(ports, match, scan, exclude)
+            if port is not None:
+                return port
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return None
+            if watch is not None:
+                watch.wait(min(remaining, recheck_sec))
+            else:
+                time.sleep(min(remaining, poll_sec))
+    finally:
+        if watch is not None:
+            watch.close()
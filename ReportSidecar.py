@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+
+"""Fixed-width binary copy of the 8-field Teensy report lines.
+
+Every legacy report line written to a ``.dat`` file is also appended, already
+parsed, to a ``.rec.npy`` sidecar next to it.  The sidecar is a regular NumPy
+``.npy`` file holding a 1-D structured array, so months of data can be opened
+instantly with ``load_records`` (or ``numpy.load(path, mmap_mode="r")``)
+instead of re-parsing CSV text.
+
+The writer only needs ``struct``: the ``.npy`` header is written by hand with
+enough padding that the record count can be rewritten in place on every
+flush.  If the process dies between flushes the header undercounts; the
+loader therefore derives the count from the file size.
+"""
+
+import ast
+import os
+import struct
+
+try:
+    import numpy  # type: ignore
+except Exception:  # pragma: no cover - only needed to read sidecars
+    numpy = None
+
+
+# Field layout mirrors reportStruct in HardwareLibrary/HardwareClass.h
+REPORT_FIELDS = [
+    ("eventType", "<i4"),
+    ("value", "<i4"),
+    ("currentSM", "<i4"),
+    ("currentTP", "<i4"),
+    ("smTime", "<u4"),
+    ("nowTime", "<u4"),
+    ("dIntake", "<i4"),
+    ("wIntake", "<i4"),
+]
+
+# Optional host receive stamp appended to each record (time.monotonic() in ns)
+HOST_STAMP_FIELDS = [("hostMonoNs", "<u8")]
+
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+HEADER_SIZE = 512  # magic + length + padded dict, a multiple of 64
+
+_STRUCT_CODES = {
+    "<i2": "h",
+    "<u2": "H",
+    "<i4": "i",
+    "<u4": "I",
+    "<i8": "q",
+    "<u8": "Q",
+    "<f4": "f",
+    "<f8": "d",
+}
+
+
+def sidecar_path(datPath):
+    """``Subject-....dat`` -> ``Subject-....rec.npy``."""
+    root, ext = os.path.splitext(datPath)
+    return root + ".rec.npy"
+
+
+def _npy_header(fields, count):
+    header = "{{'descr': {!r}, 'fortran_order': False, 'shape': ({},), }}".format(
+        fields, count
+    )
+    room = HEADER_SIZE - len(NPY_MAGIC) - 2
+    if len(header) + 1 > room:
+        raise ValueError("Sidecar header does not fit in {} bytes".format(HEADER_SIZE))
+    header = header.ljust(room - 1) + "\n"
+    return NPY_MAGIC + struct.pack("<H", room) + header.encode("latin-1")
+
+
+def read_header(path):
+    """Return ``(fields, headerSize)`` of an existing sidecar."""
+    with open(path, "rb") as handle:
+        head = handle.read(HEADER_SIZE)
+    if not head.startswith(NPY_MAGIC):
+        raise ValueError("{} is not a .npy sidecar".format(path))
+    (length,) = struct.unpack("<H", head[8:10])
+    info = ast.literal_eval(head[10 : 10 + length].decode("latin-1"))
+    return [tuple(f) for f in info["descr"]], 10 + length
+
+
+class ReportSidecar(object):
+    """Append-only ``.rec.npy`` writer for parsed report records."""
+
+    def __init__(self, path, fields=None, flush_records=100):
+        self.path = path
+        self.fields = list(fields or REPORT_FIELDS)
+        self.flush_records = max(1, int(flush_records))
+        self._struct = struct.Struct(
+            "<" + "".join(_STRUCT_CODES[code] for _, code in self.fields)
+        )
+        self.record_size = self._struct.size
+        self.bad_records = 0
+        self._pending = bytearray()
+        self._pendingCount = 0
+
+        if os.path.exists(path) and os.path.getsize(path) >= HEADER_SIZE:
+            existing, headerSize = read_header(path)
+            if existing != self.fields or headerSize != HEADER_SIZE:
+                raise ValueError("Sidecar {} has a different layout".format(path))
+            self.count = (os.path.getsize(path) - HEADER_SIZE) // self.record_size
+        else:
+            self.count = 0
+            with open(path, "wb") as handle:
+                handle.write(_npy_header(self.fields, 0))
+        self._handle = open(path, "r+b")
+        # Drop a torn trailing record left by a crash
+        self._handle.truncate(HEADER_SIZE + self.count * self.record_size)
+
+    @property
+    def closed(self):
+        return self._handle is None
+
+    def append(self, words, extra=()):
+        """Pack one report line's fields (plus ``extra`` values) as a record."""
+        try:
+            values = [int(w) for w in words[:8]]
+            values.extend(extra)
+            self._pending += self._struct.pack(*values)
+        except (ValueError, struct.error):
+            self.bad_records += 1
+            return False
+        self._pendingCount += 1
+        if self._pendingCount >= self.flush_records:
+            self.flush()
+        return True
+
+    def append_rows(self, rows):
+        """Pack already converted rows (one value per field) as records."""
+        for values in rows:
+            self._pending += self._struct.pack(*values)
+        self._pendingCount += len(rows)
+        if self._pendingCount >= self.flush_records:
+            self.flush()
+
+    def flush(self):
+        if self._handle is None or not self._pendingCount:
+            return
+        handle = self._handle
+        handle.seek(0, os.SEEK_END)
+        handle.write(self._pending)
+        self.count += self._pendingCount
+        self._pending = bytearray()
+        self._pendingCount = 0
+        handle.seek(0)
+        handle.write(_npy_header(self.fields, self.count))
+        handle.flush()
+
+    def close(self):
+        if self._handle is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._handle.close()
+            self._handle = None
+
+
+def load_records(path, mode="r"):
+    """Memory-map a sidecar as a NumPy structured array (requires NumPy)."""
+    if numpy is None:
+        raise ImportError("numpy is required to read report sidecars")
+    fields, headerSize = read_header(path)
+    dtype = numpy.dtype(fields)
+    count = (os.path.getsize(path) - headerSize) // dtype.itemsize
+    if count == 0:
+        return numpy.zeros(0, dtype=dtype)
+    return numpy.memmap(path, dtype=dtype, mode=mode, offset=headerSize, shape=(count,))
@@ -0,0 +1,638 @@
+#!/usr/bin/python3
+
+"""Low-overhead reading of the Teensy serial stream.
+
+``MainCode.printSerialOutput`` used to spin on ``ser.inWaiting()`` with a zero
+timeout, which keeps one Raspberry Pi core busy even when the Teensy is idle.
+``SerialReader`` instead sleeps in ``select()`` on the port file descriptor and
+wakes as soon as bytes arrive, when the caller's housekeeping deadline is due,
+or when the configured read timeout expires.  The legacy spin mode is kept as
+``mode="poll"`` for comparison and for ports without a file descriptor.
+
+``ThreadedReader`` moves the draining onto its own thread so that slow disk,
+log, e-mail or NTP work in the acquisition loop never stops the USB drain; the
+two sides exchange bytes through a bounded ``ByteRing``.  Each chunk keeps
+the ``time.monotonic()`` at which it was read, so ``read_stamped`` can tell
+the caller when every line arrived.
+
+``LineFramer`` splits the ASCII protocol into lines; ``FrameDecoder`` does the
+same for the optional framed binary protocol (COBS records with a sequence
+number and CRC), converting each record back into its ASCII line.
+"""
+
+import collections
+import select
+import selectors
+import struct
+import threading
+import time
+
+
+READ_MODES = ("select", "poll")
+
+
+def bytes_waiting(ser):
+    """Return the number of bytes buffered on ``ser`` (old and new pyserial)."""
+    try:
+        return ser.in_waiting
+    except AttributeError:
+        return ser.inWaiting()
+
+
+def port_fileno(ser):
+    """Return a selectable file descriptor for ``ser`` or ``None``."""
+    try:
+        fd = ser.fileno()
+    except Exception:
+        return None
+    return fd if isinstance(fd, int) and fd >= 0 else None
+
+
+def wait_readable(ports, timeout):
+    """Block until one of ``ports`` has data or ``timeout`` seconds elapse.
+
+    Returns the list of ports that are readable.  Ports without a file
+    descriptor are checked with ``bytes_waiting`` after a short sleep so that
+    the call never degenerates into a busy loop.
+    """
+    timeout = max(0.0, timeout)
+    fds = {}
+    others = []
+    for ser in ports:
+        fd = port_fileno(ser)
+        if fd is None:
+            others.append(ser)
+        else:
+            fds[fd] = ser
+
+    if others:
+        # No descriptor to sleep on: poll at 1 ms granularity instead of spinning
+        end = time.monotonic() + timeout
+        while True:
+            ready = [ser for ser in ports if bytes_waiting(ser) > 0]
+            if ready or time.monotonic() >= end:
+                return ready
+            time.sleep(min(0.001, max(0.0, end - time.monotonic())))
+
+    readable, _, _ = select.select(list(fds), [], [], timeout)
+    return [fds[fd] for fd in readable]
+
+
+class SerialReader(object):
+    """Drain a pyserial port in batches without burning CPU while idle.
+
+    ``read_timeout`` bounds how long a single ``read`` call may sleep so that
+    the acquisition loop still gets to check exit signals regularly;
+    ``min_batch`` is the number of bytes to gather before returning early
+    (``1`` returns on the first byte, i.e. no added latency).  ``wake_ports``
+    are extra ports (e.g. the analog serial) whose data should also end the
+    wait.
+    """
+
+    def __init__(self, ser, mode="select", read_timeout=0.5, min_batch=1, wake_ports=()):
+        if mode not in READ_MODES:
+            raise ValueError("Unknown serial read mode: {}".format(mode))
+        self.ser = ser
+        self.mode = mode
+        self.read_timeout = max(0.0, float(read_timeout))
+        self.min_batch = max(1, int(min_batch))
+        self.wake_ports = list(wake_ports)
+        self.wakeups = 0
+        self.idle_wakeups = 0
+
+    def read(self, deadline=None):
+        """Return the bytes available now, waiting for more if there are none.
+
+        ``deadline`` is an absolute ``time.monotonic()`` value at which the
+        caller has housekeeping to do; the wait never extends past it.
+        """
+        if self.mode == "poll":
+            return self.ser.read(bytes_waiting(self.ser))
+
+        now = time.monotonic()
+        end = now + self.read_timeout
+        if deadline is not None:
+            end = min(end, deadline)
+
+        data = bytearray()
+        waiting = bytes_waiting(self.ser)
+        if waiting:
+            data += self.ser.read(waiting)
+
+        ports = [self.ser] + self.wake_ports
+        while len(data) < self.min_batch:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            ready = wait_readable(ports, remaining)
+            self.wakeups += 1
+            if not ready:
+                break
+            waiting = bytes_waiting(self.ser)
+            if waiting:
+                data += self.ser.read(waiting)
+            elif self.wake_ports and self.ser not in ready:
+                # Another port woke us; hand control back so it gets drained
+                break
+
+        if not data:
+            self.idle_wakeups += 1
+        return bytes(data)
+
+    def read_stamped(self, deadline=None):
+        """Like ``read`` but returns ``[(time.monotonic(), bytes)]`` (empty if idle)."""
+        data = self.read(deadline)
+        return [(time.monotonic(), data)] if data else []
+
+
+class ByteRing(object):
+    """Bounded FIFO of byte chunks shared by a reader thread and its consumer.
+
+    When the consumer falls more than ``capacity`` bytes behind, new chunks
+    are dropped and counted rather than growing memory without bound.
+    ``wakeup`` is set on every put so one consumer can wait on several rings.
+    """
+
+    def __init__(self, capacity, wakeup=None):
+        self.capacity = max(1, int(capacity))
+        self.wakeup = wakeup if wakeup is not None else threading.Event()
+        self._chunks = collections.deque()
+        self._lock = threading.Lock()
+        self.depth = 0
+        self.max_depth = 0
+        self.bytes_in = 0
+        self.dropped_bytes = 0
+        self.dropped_chunks = 0
+
+    def put(self, data, stamp=None):
+        """Queue ``data`` read at ``stamp``; returns ``False`` if it was dropped."""
+        if stamp is None:
+            stamp = time.monotonic()
+        with self._lock:
+            if self.depth + len(data) > self.capacity:
+                self.dropped_bytes += len(data)
+                self.dropped_chunks += 1
+                return False
+            self._chunks.append((stamp, data))
+            self.depth += len(data)
+            self.bytes_in += len(data)
+            if self.depth > self.max_depth:
+                self.max_depth = self.depth
+        self.wakeup.set()
+        return True
+
+    def take(self):
+        """Remove and return everything queued as one ``bytes`` object."""
+        return b"".join(data for _, data in self.take_stamped())
+
+    def take_stamped(self):
+        """Remove and return the queued ``(stamp, bytes)`` chunks."""
+        with self._lock:
+            if not self._chunks:
+                return []
+            chunks = list(self._chunks)
+            self._chunks.clear()
+            self.depth = 0
+        return chunks
+
+    def stats(self):
+        with self._lock:
+            return {
+                "depth": self.depth,
+                "maxDepth": self.max_depth,
+                "bytesIn": self.bytes_in,
+                "droppedBytes": self.dropped_bytes,
+                "droppedChunks": self.dropped_chunks,
+            }
+
+
+class ThreadedReader(object):
+    """Run a ``SerialReader`` on a daemon thread that only drains the port.
+
+    ``read`` has the same contract as ``SerialReader.read`` for the consumer:
+    it returns queued bytes, waiting until ``deadline`` (capped by the read
+    timeout) if there are none; ``deadline=None`` never waits.  An
+    exception raised by the port on the reader thread is re-raised by the next
+    ``read`` so the acquisition loop handles it exactly as before.
+    """
+
+    def __init__(self, reader, capacity=4194304, wakeup=None, name="SerialReader"):
+        self.reader = reader
+        self.ring = ByteRing(capacity, wakeup)
+        self.error = None
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+
+    @property
+    def wakeup(self):
+        return self.ring.wakeup
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout if timeout is not None else self.reader.read_timeout + 1.0)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                data = self.reader.read()
+            except Exception as e:
+                self.error = e
+                self.ring.wakeup.set()
+                return
+            if data:
+                self.ring.put(data, time.monotonic())
+
+    def read(self, deadline=None):
+        return b"".join(data for _, data in self.read_stamped(deadline))
+
+    def read_stamped(self, deadline=None):
+        """Return the queued ``(stamp, bytes)`` chunks, waiting as ``read`` does."""
+        wakeup = self.ring.wakeup
+        wakeup.clear()
+        chunks = self.ring.take_stamped()
+        if chunks:
+            return chunks
+        if self.error is not None:
+            raise self.error
+        if deadline is None:
+            return []
+        # Never sleep past the read timeout so the caller can check exit signals
+        remaining = min(deadline - time.monotonic(), self.reader.read_timeout)
+        if remaining > 0 and wakeup.wait(remaining):
+            # May have been woken by another ring sharing the event
+            chunks = self.ring.take_stamped()
+        if not chunks and self.error is not None:
+            raise self.error
+        return chunks
+
+    def stats(self):
+        stats = self.ring.stats()
+        stats["alive"] = self._thread.is_alive()
+        return stats
+
+
+class PortHandle(ThreadedReader):
+    """One port of a ``MultiPortReader``, read by the consumer like a ``ThreadedReader``."""
+
+    def __init__(self, owner, ser, capacity=4194304, wakeup=None, name=None):
+        self.owner = owner
+        self.ser = ser
+        self.name = name or getattr(ser, "port", "port")
+        self.reader = owner  # provides read_timeout
+        self.ring = ByteRing(capacity, wakeup)
+        self.error = None
+
+    def start(self):
+        return self
+
+    def stop(self, timeout=None):
+        """Stop reading this port; the other ports keep running."""
+        self.owner.remove(self)
+
+    def stats(self):
+        stats = self.ring.stats()
+        stats["alive"] = self.owner.alive and self.error is None
+        return stats
+
+
+class MultiPortReader(object):
+    """Drain several serial ports from one selector thread.
+
+    Each port added with ``add`` gets its own bounded ``ByteRing`` and is
+    consumed through the returned ``PortHandle``.  A consumer that falls
+    behind only fills (and then drops from) its own ring, and a port that
+    fails is unregistered with the error kept on its handle, so one wedged
+    board never stalls the others.
+    """
+
+    def __init__(self, read_timeout=0.5, name="MultiPortReader"):
+        self.read_timeout = max(0.0, float(read_timeout))
+        self.wakeups = 0
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._handles = []
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+
+    @property
+    def alive(self):
+        return self._thread.is_alive()
+
+    def add(self, ser, capacity=4194304, wakeup=None, name=None):
+        fd = port_fileno(ser)
+        if fd is None:
+            raise ValueError("Port {} has no file descriptor".format(getattr(ser, "port", ser)))
+        handle = PortHandle(self, ser, capacity, wakeup, name)
+        with self._lock:
+            self._selector.register(fd, selectors.EVENT_READ, handle)
+            self._handles.append(handle)
+        return handle
+
+    def remove(self, handle):
+        with self._lock:
+            if handle in self._handles:
+                self._handles.remove(handle)
+                try:
+                    self._selector.unregister(port_fileno(handle.ser))
+                except (KeyError, ValueError):
+                    pass
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout if timeout is not None else self.read_timeout + 1.0)
+        self._selector.close()
+
+    def _drain(self, handle):
+        try:
+            data = handle.ser.read(bytes_waiting(handle.ser) or 1)
+        except Exception as e:
+            # Keep the error for this board's consumer; the others continue
+            handle.error = e
+            self.remove(handle)
+            handle.ring.wakeup.set()
+            return
+        if data:
+            handle.ring.put(data, time.monotonic())
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            with self._lock:
+                empty = not self._handles
+            if empty:
+                self._stop_event.wait(self.read_timeout)
+                continue
+            try:
+                events = self._selector.select(self.read_timeout)
+            except (OSError, ValueError):
+                # A port was closed under the selector; its handle is removed
+                # by the consumer, so just retry
+                self._stop_event.wait(0.01)
+                continue
+            self.wakeups += 1
+            for key, _ in events:
+                self._drain(key.data)
+
+    def stats(self):
+        with self._lock:
+            handles = list(self._handles)
+        return dict((h.name, h.stats()) for h in handles)
+
+
+def reader_from_config(ser, userConfig, wake_ports=()):
+    """Build a ``SerialReader`` from the optional ``Serial_Read_*`` keys."""
+    mode = userConfig.get("Serial_Read_Mode", "select").strip().lower() or "select"
+    read_timeout = float(userConfig.get("Serial_Read_Timeout", 0.5))
+    min_batch = int(userConfig.get("Serial_Min_Batch", 1))
+    return SerialReader(
+        ser,
+        mode=mode,
+        read_timeout=read_timeout,
+        min_batch=min_batch,
+        wake_ports=wake_ports,
+    )
+
+
+def threaded_reader_from_config(ser, userConfig, wakeup=None, name="SerialReader"):
+    """Start a ``ThreadedReader`` sized by the optional ``Serial_Queue_Bytes`` key."""
+    capacity = int(userConfig.get("Serial_Queue_Bytes", 4194304))
+    reader = reader_from_config(ser, userConfig)
+    return ThreadedReader(reader, capacity, wakeup, name).start()
+
+
+class LineFramer(object):
+    """Split the raw serial byte stream into complete text lines.
+
+    Bytes are appended to a ``bytearray``; every complete line is returned as
+    soon as its ``\\n`` arrives and only the trailing fragment is carried into
+    the next ``feed``, so each byte is scanned once.  A line longer than
+    ``max_line`` bytes is dropped up to the next newline and counted in
+    ``overlong``; lines that are not valid UTF-8 are decoded leniently and
+    counted in ``decode_errors``.
+    """
+
+    def __init__(self, max_line=4096, encoding="utf-8"):
+        self.max_line = max(1, int(max_line))
+        self.encoding = encoding
+        self.lines = 0
+        self.overlong = 0
+        self.decode_errors = 0
+        self._buf = bytearray()
+        self._discarding = False
+
+    @property
+    def malformed(self):
+        return self.overlong + self.decode_errors
+
+    @property
+    def pending(self):
+        """Number of bytes held for an incomplete trailing line."""
+        return len(self._buf)
+
+    def _decode(self, raw):
+        try:
+            return raw.decode(self.encoding)
+        except UnicodeDecodeError:
+            self.decode_errors += 1
+            return raw.decode(self.encoding, "ignore")
+
+    def feed(self, data):
+        """Add ``data`` and return the list of lines it completed."""
+        lines = []
+        if not data:
+            return lines
+
+        buf = self._buf
+        searchFrom = len(buf)  # the carried fragment holds no newline
+        buf += data
+        start = 0
+        while True:
+            end = buf.find(b"\n", searchFrom)
+            if end < 0:
+                break
+            if self._discarding:
+                # Newline that terminates a line already counted as overlong
+                self._discarding = False
+            elif end + 1 - start > self.max_line:
+                self.overlong += 1
+            else:
+                lines.append(self._decode(bytes(buf[start : end + 1])))
+            start = searchFrom = end + 1
+        del buf[:start]
+
+        if len(buf) > self.max_line:
+            if not self._discarding:
+                self.overlong += 1
+                self._discarding = True
+            del buf[:]
+
+        self.lines += len(lines)
+        return lines
+
+    def reset(self):
+        """Drop the incomplete trailing line."""
+        del self._buf[:]
+        self._discarding = False
+
+
+def crc16_ccitt(data, crc=0xFFFF):
+    """CRC-16/CCITT-FALSE, as computed by ``Crc16Ccitt`` on the Teensy."""
+    for byte in bytearray(data):
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+            crc &= 0xFFFF
+    return crc
+
+
+def cobs_decode(data):
+    """Decode one COBS-encoded frame (without delimiters); ``None`` if invalid."""
+    out = bytearray()
+    pos = 0
+    n = len(data)
+    while pos < n:
+        code = data[pos]
+        if code == 0 or pos + code > n + 1:
+            return None
+        out += data[pos + 1 : pos + code]
+        pos += code
+        if code < 0xFF and pos < n:
+            out.append(0)
+    return bytes(out)
+
+
+# Framed record type -> little-endian body layout
+FRAME_RECORDS = {
+    1: struct.Struct("<iiiiIIii"),  # reportStruct
+    2: struct.Struct("<iiiiiiiiQIII"),  # trialSummaryStruct
+}
+
+
+class FrameDecoder(object):
+    """Turn a mixed ASCII / framed binary Teensy stream back into text lines.
+
+    With ``Serial_Protocol = framed`` the Teensy sends report and trial summary
+    records as ``0x00, COBS(type, seq, fields, crc16), 0x00`` while the
+    ``I``/``E``/``D``/``P`` tags stay ASCII lines.  Text between frames goes
+    through a ``LineFramer``; every valid frame is converted back into the same
+    CSV line the ASCII protocol would have printed, so everything downstream
+    is unchanged.  Besides the ``LineFramer`` counters it keeps:
+
+    - ``frames``: records decoded
+    - ``crc_errors``: frames dropped for a bad COBS encoding, length or CRC
+    - ``gaps`` / ``lost``: sequence gaps and the number of records they skipped
+      (sequence 0 after a Teensy restart is not a gap)
+    - ``desync``: partial text lines cut by a frame delimiter
+    """
+
+    def __init__(self, max_line=4096, encoding="utf-8", max_frame=256):
+        self.text = LineFramer(max_line, encoding)
+        self.max_frame = max(8, int(max_frame))
+        self.frames = 0
+        self.crc_errors = 0
+        self.gaps = 0
+        self.lost = 0
+        self.desync = 0
+        self._frame = bytearray()
+        self._inFrame = False
+        self._discarding = False
+        self._nextSeq = None
+
+    @property
+    def lines(self):
+        return self.text.lines + self.frames
+
+    @property
+    def overlong(self):
+        return self.text.overlong
+
+    @property
+    def decode_errors(self):
+        return self.text.decode_errors
+
+    @property
+    def malformed(self):
+        return self.text.malformed + self.crc_errors + self.desync
+
+    @property
+    def pending(self):
+        return self.text.pending + len(self._frame)
+
+    def _record(self, raw):
+        """Return the CSV line of a frame, or ``None`` if it is invalid."""
+        payload = cobs_decode(raw)
+        if payload is None or len(payload) < 5:
+            return None
+        if crc16_ccitt(payload[:-2]) != payload[-2] | (payload[-1] << 8):
+            return None
+        layout = FRAME_RECORDS.get(payload[0])
+        if layout is None or len(payload) != layout.size + 5:
+            return None
+
+        seq = payload[1] | (payload[2] << 8)
+        if self._nextSeq is not None and seq != self._nextSeq and seq != 0:
+            self.gaps += 1
+            self.lost += (seq - self._nextSeq) & 0xFFFF
+        self._nextSeq = (seq + 1) & 0xFFFF
+        fields = layout.unpack_from(payload, 3)
+        return ",".join([str(v) for v in fields]) + "\r\n"
+
+    def _end_frame(self, lines):
+        raw = bytes(self._frame)
+        del self._frame[:]
+        if self._discarding:
+            self._discarding = False
+            self.crc_errors += 1
+            return
+        if not raw:
+            # Back-to-back delimiters: the second opens the next frame
+            return
+        line = self._record(raw)
+        if line is not None:
+            self.frames += 1
+            lines.append(line)
+            self._inFrame = False
+        elif b"\n" in raw and raw.isascii():
+            # Text mistaken for a frame after a lost delimiter; the closing 0x00
+            # really opened the next frame
+            lines.extend(self.text.feed(raw))
+        else:
+            self.crc_errors += 1
+            self._inFrame = False
+
+    def feed(self, data):
+        """Add ``data`` and return the list of lines (text and decoded frames) it completed."""
+        lines = []
+        pos = 0
+        n = len(data)
+        while pos < n:
+            zero = data.find(b"\x00", pos)
+            end = n if zero < 0 else zero
+            if self._inFrame:
+                if not self._discarding:
+                    self._frame += data[pos:end]
+                    if len(self._frame) > self.max_frame:
+                        self._discarding = True
+                        del self._frame[:]
+                if zero >= 0:
+                    self._end_frame(lines)
+            else:
+                lines.extend(self.text.feed(data[pos:end]))
+                if zero >= 0:
+                    if self.text.pending:
+                        self.desync += 1
+                        self.text.reset()
+                    self._inFrame = True
+            pos = end + 1
+        return lines
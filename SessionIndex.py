@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+
+"""Byte-offset indexes for session ``.dat`` and ``.trial.csv`` files.
+
+While ``SessionWriters`` appends to an output file it also appends one index
+row per interesting line to ``<file>.idx``:
+
+- ``SM``     first report line after a state machine / training protocol change
+- ``CK``     a checkpoint every ``Output_Index_Every`` report lines (time seeks)
+- ``TRIAL``  every trial summary line (trialId, blockId)
+- ``MARK``   ``ROTATE`` / ``SE`` markers
+
+Each row records the byte offset and 1-based line number of the indexed line,
+so a reader can ``seek`` straight to it.  When the output file is closed at
+rotation or session end the index is finalized with an ``END`` row holding the
+file's total bytes and lines.  Offsets refer to the uncompressed file, so
+they stay valid after ``OutputCompressor`` has replaced it with ``<file>.gz``.
+"""
+
+import collections
+
+import OutputCompressor
+
+
+INDEX_HEADER = "kind,eventType,trialId,blockId,currentSM,nowTime,offset,line\n"
+
+IndexEntry = collections.namedtuple(
+    "IndexEntry",
+    ["kind", "eventType", "trialId", "blockId", "currentSM", "nowTime", "offset", "line"],
+)
+
+
+def index_path(path):
+    return path + ".idx"
+
+
+def format_key(kind, eventType="", trialId="", blockId="", currentSM="", nowTime=""):
+    """Index row without the offset/line columns (added by the writer)."""
+    return ",".join(
+        str(v).strip() for v in (kind, eventType, trialId, blockId, currentSM, nowTime)
+    )
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def read_index(path):
+    """Return ``(entries, end)``; ``end`` is the ``END`` entry or ``None`` if not finalized."""
+    entries = []
+    end = None
+    with open(path) as handle:
+        for raw in handle:
+            row = raw.rstrip("\n").split(",")
+            if len(row) != 8 or row[0] == "kind":
+                continue
+            entry = IndexEntry(row[0], *[_int_or_none(v) for v in row[1:]])
+            if entry.kind == "END":
+                end = entry
+            else:
+                entries.append(entry)
+    return entries, end
+
+
+def read_line_at(path, offset):
+    """Return the text line starting at byte ``offset`` of ``path`` (or its ``.gz``)."""
+    with OutputCompressor.open_session_file(path, offset) as handle:
+        return handle.readline().decode("utf-8", "ignore")
+
+
+def iter_lines_from(path, offset, maxLines=None):
+    """Yield lines of ``path`` (or its ``.gz``) starting at byte ``offset``."""
+    with OutputCompressor.open_session_file(path, offset) as handle:
+        for n, raw in enumerate(handle):
+            if maxLines is not None and n >= maxLines:
+                return
+            yield raw.decode("utf-8", "ignore")
+
+
+def find_trial(trialPath, trialId):
+    """Return the ``.trial.csv`` line of ``trialId`` (``None`` if not indexed)."""
+    entries, _ = read_index(index_path(trialPath))
+    for entry in entries:
+        if entry.kind == "TRIAL" and entry.trialId == int(trialId):
+            return read_line_at(trialPath, entry.offset)
+    return None
+
+
+def find_block(trialPath, blockId):
+    """Return the index entry of the first trial in ``blockId`` (or ``None``)."""
+    entries, _ = read_index(index_path(trialPath))
+    for entry in entries:
+        if entry.kind == "TRIAL" and entry.blockId == int(blockId):
+            return entry
+    return None
+
+
+def state_changes(datPath, currentSM=None):
+    """Index entries where the ``.dat`` enters a state machine (optionally only ``currentSM``)."""
+    entries, _ = read_index(index_path(datPath))
+    return [
+        e
+        for e in entries
+        if e.kind == "SM" and (currentSM is None or e.currentSM == int(currentSM))
+    ]
+
+
+def seek_time(datPath, nowTime):
+    """Byte offset of the last indexed ``.dat`` line at or before Teensy ``nowTime``."""
+    entries, _ = read_index(index_path(datPath))
+    best = 0
+    for entry in entries:
+        if entry.nowTime is None:
+            continue
+        if entry.nowTime > int(nowTime):
+            break
+        best = entry.offset
+    return best
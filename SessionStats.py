@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+
+"""Running behavioural aggregates for the current session.
+
+``SessionStats`` is updated with every trial summary line (event code >= 200)
+and every 8-field report line, in constant time per line.  It keeps:
+
+- trials, lick and missed trials, rewarded trials and the reward rate
+- choices per port and the fraction of choices of the higher-probability port
+- per block: trials, rewards, choices per port and the port probabilities
+- report lines per event type, the current state machine / training protocol
+  and the latest daily and weekly intake
+
+``write_snapshot`` replaces a small JSON file next to the session files
+(``<session>.stats.json``), so the state of a running session can be polled
+remotely without pulling and parsing ``.dat`` / ``.trial.csv``.
+"""
+
+import json
+import os
+import time
+
+
+def _int(words, i, default=None):
+    try:
+        return int(words[i])
+    except (IndexError, ValueError):
+        return default
+
+
+def _rate(numerator, denominator):
+    return round(numerator / float(denominator), 4) if denominator else None
+
+
+class BlockStats(object):
+    __slots__ = ("blockId", "port1Prob", "port2Prob", "trials", "missed", "rewarded", "choices")
+
+    def __init__(self, blockId, port1Prob, port2Prob):
+        self.blockId = blockId
+        self.port1Prob = port1Prob
+        self.port2Prob = port2Prob
+        self.trials = 0
+        self.missed = 0
+        self.rewarded = 0
+        self.choices = {}
+
+    def as_dict(self):
+        licks = self.trials - self.missed
+        return {
+            "blockId": self.blockId,
+            "port1Prob": self.port1Prob,
+            "port2Prob": self.port2Prob,
+            "trials": self.trials,
+            "missed": self.missed,
+            "rewarded": self.rewarded,
+            "rewardRate": _rate(self.rewarded, licks),
+            "choices": dict((str(k), v) for k, v in sorted(self.choices.items())),
+        }
+
+
+class SessionStats(object):
+    """Incremental session aggregates; ``recent_blocks`` limits the snapshot size."""
+
+    def __init__(self, recent_blocks=10):
+        self.recent_blocks = max(1, int(recent_blocks))
+        self.started = time.time()
+        self.trials = 0
+        self.missed = 0
+        self.rewarded = 0
+        self.choices = {}
+        self.highProbChoices = 0
+        self.probChoices = 0  # lick trials with unequal port probabilities
+        self.blocks = []
+        self.lastTrialId = None
+        self.lastTrialTime = None
+        self.reports = 0
+        self.eventCounts = {}
+        self.currentSM = None
+        self.currentTP = None
+        self.dIntake = None
+        self.wIntake = None
+        self.lastReportTime = None
+
+    def add_trial(self, words):
+        """Update from a split trial summary line."""
+        port1Prob = _int(words, 1)
+        port2Prob = _int(words, 2)
+        chosenPort = _int(words, 3, 0)
+        rewarded = _int(words, 4, 0)
+        blockId = _int(words, 6)
+        missed = _int(words, 0) == 201 or rewarded < 0 or chosenPort == 0
+
+        if not self.blocks or self.blocks[-1].blockId != blockId:
+            self.blocks.append(BlockStats(blockId, port1Prob, port2Prob))
+            del self.blocks[: -self.recent_blocks]
+        block = self.blocks[-1]
+
+        self.trials += 1
+        block.trials += 1
+        if missed:
+            self.missed += 1
+            block.missed += 1
+        else:
+            self.choices[chosenPort] = self.choices.get(chosenPort, 0) + 1
+            block.choices[chosenPort] = block.choices.get(chosenPort, 0) + 1
+            if rewarded > 0:
+                self.rewarded += 1
+                block.rewarded += 1
+            if port1Prob is not None and port2Prob is not None and port1Prob != port2Prob:
+                self.probChoices += 1
+                if chosenPort == (1 if port1Prob > port2Prob else 2):
+                    self.highProbChoices += 1
+        self.lastTrialId = _int(words, 5)
+        self.lastTrialTime = round(time.time(), 3)
+
+    def add_report(self, words):
+        """Update from a split 8-field report line."""
+        eventType = _int(words, 0)
+        self.reports += 1
+        self.eventCounts[eventType] = self.eventCounts.get(eventType, 0) + 1
+        self.currentSM = _int(words, 2)
+        self.currentTP = _int(words, 3)
+        self.dIntake = _int(words, 6)
+        self.wIntake = _int(words, 7)
+        self.lastReportTime = round(time.time(), 3)
+
+    def snapshot(self):
+        licks = self.trials - self.missed
+        elapsed = max(1e-9, time.time() - self.started)
+        return {
+            "updated": round(time.time(), 3),
+            "started": round(self.started, 3),
+            "trials": self.trials,
+            "lickTrials": licks,
+            "missed": self.missed,
+            "rewarded": self.rewarded,
+            "rewardRate": _rate(self.rewarded, licks),
+            "trialsPerMin": round(self.trials * 60.0 / elapsed, 3),
+            "choices": dict((str(k), v) for k, v in sorted(self.choices.items())),
+            "choiceFraction": dict(
+                (str(k), _rate(v, licks)) for k, v in sorted(self.choices.items())
+            ),
+            "highProbFraction": _rate(self.highProbChoices, self.probChoices),
+            "lastTrialId": self.lastTrialId,
+            "lastTrialTime": self.lastTrialTime,
+            "currentBlock": self.blocks[-1].as_dict() if self.blocks else None,
+            "recentBlocks": [b.as_dict() for b in self.blocks[:-1]],
+            "reports": self.reports,
+            "eventCounts": dict((str(k), v) for k, v in self.eventCounts.items()),
+            "currentSM": self.currentSM,
+            "currentTP": self.currentTP,
+            "dIntake": self.dIntake,
+            "wIntake": self.wIntake,
+            "lastReportTime": self.lastReportTime,
+        }
+
+    def write_snapshot(self, path):
+        """Atomically replace ``path`` with the current snapshot."""
+        tmpPath = path + ".tmp"
+        with open(tmpPath, "w") as handle:
+            json.dump(self.snapshot(), handle, separators=(",", ":"))
+            handle.write("\n")
+        os.replace(tmpPath, path)
+
+
+def stats_path(msgFileN):
+    """``<session>.log`` -> ``<session>.stats.json``."""
+    root, _ = os.path.splitext(msgFileN)
+    return root + ".stats.json"
@@ -0,0 +1,818 @@
+#!/usr/bin/python3
+
+"""Persistent, buffered writers for the session ``.dat`` and ``.trial.csv`` files.
+
+``MainCode.printSerialOutput`` used to open and close both output files on
+every loop iteration.  ``SessionWriter`` keeps one handle per file for the
+whole session and flushes according to a ``FlushPolicy`` (line count, byte
+count or elapsed time), so ``tail -f`` still sees data promptly while the SD
+card only sees one write per batch.  On ``Output_Name_Freq`` rotation the
+writer finishes the old files (rotation marker, flush, close) and opens the
+new pair in one step.
+
+Each ``SessionFile`` also keeps a running MD5 of the bytes it writes, so the
+``ROTATE``/``SE`` markers carry per-file digests without re-reading the files,
+and an ``md5sum -c`` compatible ``<file>.md5`` sidecar is written when the
+file is closed for the transfer tools to verify against.
+
+With ``binarySidecar`` enabled the parsed 8-field report lines are also
+appended to a ``.rec.npy`` file (see ``ReportSidecar``) that is flushed,
+rotated and closed together with its ``.dat``; ``hostStamps`` adds the host
+monotonic receive time of every line to those records.
+
+With ``index`` enabled every file also gets a ``<file>.idx`` byte-offset
+index (see ``SessionIndex`` for the format and the reader API), finalized
+when the file is closed at ``ROTATE``/``SE``.
+
+With ``sync`` set to ``group`` the session files double as a write-ahead
+journal: a ``GroupCommit`` thread ``fdatasync``s the flushed bytes of every
+open file in batches, every ``sync_sec`` or once ``sync_bytes`` are
+waiting, so a power cut loses at most about ``max_seconds + sync_sec`` of
+data without an fsync per line.  ``recover_session`` finishes a pair left
+behind by a crash: it truncates torn last lines and appends a ``RECOVER``
+marker.
+
+``SessionLogger`` does the same for the ``.log`` file: ``MainCode.writeLogFile``
+hands messages to the open logger, which batches them, flushes on a timer and
+optionally mirrors every entry to a machine-readable ``.log.jsonl`` twin.
+"""
+
+import datetime
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import ReportSidecar
+import SessionIndex
+
+
+class FlushPolicy(object):
+    """Flush thresholds; a value of ``0`` disables that trigger.
+
+    ``checksums`` enables the running MD5 and the ``.md5`` sidecar;
+    ``index`` enables the ``.idx`` byte-offset index with a checkpoint every
+    ``index_every`` report lines.  ``sync`` is ``none`` (page cache only),
+    ``group`` (batched fsync, see ``GroupCommit``) or ``always`` (fsync on
+    every flush, with every line flushed).
+    """
+
+    def __init__(
+        self,
+        max_lines=100,
+        max_bytes=65536,
+        max_seconds=1.0,
+        checksums=True,
+        index=True,
+        index_every=1000,
+        sync="none",
+        sync_sec=0.5,
+        sync_bytes=262144,
+    ):
+        self.max_lines = max(0, int(max_lines))
+        self.max_bytes = max(0, int(max_bytes))
+        self.max_seconds = max(0.0, float(max_seconds))
+        self.checksums = bool(checksums)
+        self.index = bool(index)
+        self.index_every = max(1, int(index_every))
+        self.sync = str(sync).strip().lower() or "none"
+        if self.sync not in ("none", "group", "always"):
+            raise ValueError("Unknown sync mode: {}".format(sync))
+        if self.sync == "always":
+            self.max_lines = 1
+        self.sync_sec = max(0.01, float(sync_sec))
+        self.sync_bytes = max(0, int(sync_bytes))
+
+    def for_index(self):
+        """Policy for ``.idx`` files: flushed with their data file, never indexed."""
+        return FlushPolicy(0, self.max_bytes, self.max_seconds, checksums=False, index=False)
+
+    @classmethod
+    def from_config(cls, userConfig):
+        """Read the optional ``Output_Flush_*`` keys from ``userInfo.in``."""
+        return cls(
+            max_lines=userConfig.get("Output_Flush_Lines", 100),
+            max_bytes=userConfig.get("Output_Flush_Bytes", 65536),
+            max_seconds=userConfig.get("Output_Flush_Sec", 1.0),
+            checksums=userConfig.get("Output_Checksums", "true").lower() == "true",
+            index=userConfig.get("Output_Index", "true").lower() == "true",
+            index_every=userConfig.get("Output_Index_Every", 1000),
+            sync=userConfig.get("Output_Sync", "none"),
+            sync_sec=userConfig.get("Output_Sync_Sec", 0.5),
+            sync_bytes=userConfig.get("Output_Sync_Bytes", 262144),
+        )
+
+
+def _sync_dir(path):
+    """fsync a directory so a newly created file survives a power cut."""
+    try:
+        fd = os.open(path or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class SessionFile(object):
+    """One append-only output file kept open for the session."""
+
+    def __init__(self, path, policy, header=None):
+        self.path = path
+        self.policy = policy
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        # Let the writer own batching; the OS buffer is sized to the byte limit.
+        # Fixed encoding/newline so the digest matches the bytes on disk.
+        bufferSize = max(8192, policy.max_bytes)
+        # New directory entries (this file, its index) need a directory fsync
+        created = not os.path.exists(path) or (
+            policy.index and not os.path.exists(SessionIndex.index_path(path))
+        )
+        self._handle = open(
+            path, "a", buffering=bufferSize, encoding="utf-8", newline=""
+        )
+        self.lines = 0
+        self.offset = os.path.getsize(path)  # bytes in the file
+        self.flushed = self.offset  # bytes handed to the OS
+        self.synced = self.offset  # bytes known to be on disk
+        self._firstFlushed = None  # write time of the oldest unsynced flushed line
+        self._syncLock = threading.Lock()
+        self.lineNo = 0  # physical lines in the file
+        self._pendingLines = 0
+        self._pendingBytes = 0
+        self._firstPending = None
+        self._hash = hashlib.md5() if policy.checksums else None
+        if self.offset > 0 and (policy.checksums or policy.index):
+            # Appending to an existing file: seed the digest/line count once
+            with open(path, "rb") as existing:
+                for chunk in iter(lambda: existing.read(65536), b""):
+                    if self._hash is not None:
+                        self._hash.update(chunk)
+                    self.lineNo += chunk.count(b"\n")
+        self.index = None
+        if policy.index:
+            self.index = SessionFile(
+                SessionIndex.index_path(path),
+                policy.for_index(),
+                header=SessionIndex.INDEX_HEADER,
+            )
+        if created and policy.sync != "none":
+            # After the index is created, so one fsync covers both entries
+            _sync_dir(parent)
+        if header and self.offset == 0:
+            self.write(header, count=False)
+            self.flush()
+
+    @property
+    def closed(self):
+        return self._handle is None
+
+    def write(self, text, count=True, indexKey=None):
+        """Append ``text``; ``count=False`` keeps markers out of ``lines``.
+
+        ``indexKey`` (see ``SessionIndex.format_key``) adds an index row that
+        points at the start of ``text``.
+        """
+        if indexKey is not None and self.index is not None:
+            self.index.write(
+                "{},{},{}\n".format(indexKey, self.offset, self.lineNo + 1), count=False
+            )
+        raw = text.encode("utf-8")
+        self._handle.write(text)
+        if self._hash is not None:
+            self._hash.update(raw)
+        if count:
+            self.lines += 1
+        self.offset += len(raw)
+        self.lineNo += text.count("\n")
+        self._pendingLines += 1
+        self._pendingBytes += len(raw)
+        if self._firstPending is None:
+            self._firstPending = time.monotonic()
+        policy = self.policy
+        if (policy.max_lines and self._pendingLines >= policy.max_lines) or (
+            policy.max_bytes and self._pendingBytes >= policy.max_bytes
+        ):
+            self.flush()
+
+    def flush_due(self):
+        """Monotonic time at which pending data must be flushed, or ``None``.
+
+        ``max_seconds == 0`` disables the time trigger, like the other limits.
+        """
+        if self._firstPending is None or not self.policy.max_seconds:
+            return None
+        return self._firstPending + self.policy.max_seconds
+
+    def maybe_flush(self, now=None):
+        due = self.flush_due()
+        if due is None:
+            return False
+        if now is None:
+            now = time.monotonic()
+        if now >= due:
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        if self._handle is None:
+            return
+        self._handle.flush()
+        self.flushed = self.offset
+        if self._firstFlushed is None:
+            self._firstFlushed = self._firstPending
+        self._pendingLines = 0
+        self._pendingBytes = 0
+        self._firstPending = None
+        if self.policy.sync == "always":
+            self.sync()
+        if self.index is not None:
+            self.index.flush()
+
+    @property
+    def unsynced(self):
+        """Flushed bytes not yet fsync'ed."""
+        return self.flushed - self.synced
+
+    def sync(self):
+        """``fdatasync`` what has been flushed; returns ``(bytes, lag)`` or ``None``.
+
+        ``lag`` is the age in seconds of the oldest line made durable.  Called
+        from the ``GroupCommit`` thread, so it only touches the OS handle.
+        """
+        with self._syncLock:
+            if self._handle is None:
+                return None
+            # Take the stamp before the target: a flush in between only
+            # makes the next lag look older, never younger
+            first = self._firstFlushed
+            self._firstFlushed = None
+            target = self.flushed
+            if target <= self.synced:
+                return None
+            os.fdatasync(self._handle.fileno())
+            synced = target - self.synced
+            self.synced = target
+        return synced, (time.monotonic() - first if first is not None else 0.0)
+
+    def hexdigest(self):
+        """MD5 of everything written so far, or ``"NA"`` with checksums off."""
+        return self._hash.hexdigest() if self._hash is not None else "NA"
+
+    def _write_sidecar(self):
+        sidecar = self.path + ".md5"
+        tmp = sidecar + ".tmp"
+        with open(tmp, "w") as handle:
+            handle.write("{}  {}\n".format(self.hexdigest(), os.path.basename(self.path)))
+        os.replace(tmp, sidecar)
+
+    def close(self):
+        if self._handle is None:
+            return
+        try:
+            self.flush()
+            if self.policy.sync != "none":
+                self.sync()
+        finally:
+            with self._syncLock:
+                self._handle.close()
+                self._handle = None
+        if self._hash is not None:
+            self._write_sidecar()
+        if self.index is not None:
+            # Finalize the index with the file's total size
+            self.index.write(
+                "{},{},{}\n".format(SessionIndex.format_key("END"), self.offset, self.lineNo),
+                count=False,
+            )
+            self.index.close()
+
+
+class GroupCommit(object):
+    """Background ``fdatasync`` of a writer's open files in batches.
+
+    ``files`` returns the files to sync (it is called every round, so a
+    rotation is picked up).  A round runs every ``sync_sec`` or as soon as
+    ``wake`` is called.
+    """
+
+    def __init__(self, files, sync_sec=0.5):
+        self.files = files
+        self.sync_sec = sync_sec
+        self.syncs = 0
+        self.bytes = 0
+        self.errors = 0
+        self.maxSyncMs = 0.0
+        self.maxLagMs = 0.0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="GroupCommit")
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def commit(self):
+        """Sync every file once; returns the number of bytes made durable."""
+        total = 0
+        for f in self.files():
+            start = time.monotonic()
+            try:
+                result = f.sync()
+            except (OSError, ValueError):
+                self.errors += 1
+                continue
+            if result is None:
+                continue
+            synced, lag = result
+            self.syncs += 1
+            total += synced
+            self.maxSyncMs = max(self.maxSyncMs, (time.monotonic() - start) * 1e3)
+            self.maxLagMs = max(self.maxLagMs, lag * 1e3)
+        self.bytes += total
+        return total
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.sync_sec)
+            self._wake.clear()
+            self.commit()
+
+    def stats(self):
+        return {
+            "syncs": self.syncs,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "maxSyncMs": round(self.maxSyncMs, 2),
+            "maxLagMs": round(self.maxLagMs, 2),
+        }
+
+
+class SessionWriter(object):
+    """The ``.dat`` / ``.trial.csv`` pair written by ``printSerialOutput``."""
+
+    def __init__(
+        self,
+        datPath,
+        trialPath,
+        policy,
+        trialHeader=None,
+        binarySidecar=False,
+        hostStamps=False,
+    ):
+        self.policy = policy
+        self.trialHeader = trialHeader
+        self.binarySidecar = binarySidecar
+        self.hostStamps = hostStamps
+        self.dat = SessionFile(datPath, policy)
+        self.trial = SessionFile(trialPath, policy, header=trialHeader)
+        self.records = self._open_records(datPath)
+        self._lastState = None
+        self.commit = None
+        if policy.sync == "group":
+            self.commit = GroupCommit(lambda: self.files, policy.sync_sec).start()
+
+    def _open_records(self, datPath):
+        if not self.binarySidecar:
+            return None
+        fields = ReportSidecar.REPORT_FIELDS
+        if self.hostStamps:
+            fields = fields + ReportSidecar.HOST_STAMP_FIELDS
+        return ReportSidecar.ReportSidecar(
+            ReportSidecar.sidecar_path(datPath),
+            fields,
+            flush_records=self.policy.max_lines or 100,
+        )
+
+    @property
+    def files(self):
+        return (self.dat, self.trial)
+
+    def write_data(self, line, words=None, rxTime=None):
+        """Append a report line; ``words`` (its parsed fields) feed the sidecar and index.
+
+        ``rxTime`` is the ``time.monotonic()`` at which the line was received.
+        """
+        indexKey = None
+        if self.policy.index and words is not None and len(words) >= 8:
+            state = (words[2], words[3])
+            if state != self._lastState:
+                self._lastState = state
+                indexKey = SessionIndex.format_key(
+                    "SM", words[0], currentSM=words[2], nowTime=words[5]
+                )
+            elif (self.dat.lines + 1) % self.policy.index_every == 0:
+                indexKey = SessionIndex.format_key(
+                    "CK", words[0], currentSM=words[2], nowTime=words[5]
+                )
+        self.dat.write(line, indexKey=indexKey)
+        if self.commit is not None and self.policy.sync_bytes:
+            if self.dat.unsynced >= self.policy.sync_bytes:
+                self.commit.wake()
+        if self.records is not None and words is not None:
+            if self.hostStamps:
+                self.records.append(words, (int((rxTime or 0.0) * 1e9),))
+            else:
+                self.records.append(words)
+
+    def write_trial(self, line):
+        indexKey = None
+        if self.policy.index:
+            words = line.split(",")
+            if len(words) >= 7:
+                indexKey = SessionIndex.format_key("TRIAL", words[0], words[5], words[6])
+        self.trial.write(line, indexKey=indexKey)
+
+    def write_marker(self, marker, files=None):
+        """Append a ``ROTATE``/``SE`` style marker (not counted) to ``files``."""
+        indexKey = SessionIndex.format_key("MARK", marker.split(",", 1)[0])
+        for f in files if files is not None else self.files:
+            f.write(marker, count=False, indexKey=indexKey)
+
+    def flush_due(self):
+        dues = [d for d in (f.flush_due() for f in self.files) if d is not None]
+        return min(dues) if dues else None
+
+    def maybe_flush(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        if self.dat.maybe_flush(now) and self.records is not None:
+            self.records.flush()
+        self.trial.maybe_flush(now)
+
+    def flush(self):
+        for f in self.files:
+            f.flush()
+        if self.records is not None:
+            self.records.flush()
+
+    def digests(self):
+        """Running ``(dat_md5, trial_md5)`` of the current pair."""
+        return (self.dat.hexdigest(), self.trial.hexdigest())
+
+    def rotate(self, datPath, trialPath, marker=None):
+        """Finish the current files with ``marker`` and switch to new paths.
+
+        The new files are opened before the old ones are closed so that a
+        failure to create them leaves the session writing to the old pair.
+        Closing the old files writes their ``.md5`` sidecars.
+        """
+        newDat = SessionFile(datPath, self.policy)
+        try:
+            newTrial = SessionFile(trialPath, self.policy, header=self.trialHeader)
+            newRecords = self._open_records(datPath)
+        except Exception:
+            newDat.close()
+            if "newTrial" in locals():
+                newTrial.close()
+            raise
+
+        oldFiles = self.files
+        oldRecords = self.records
+        self.dat, self.trial, self.records = newDat, newTrial, newRecords
+        self._lastState = None
+        for f in oldFiles:
+            try:
+                if marker:
+                    self.write_marker(marker, [f])
+            finally:
+                f.close()
+        if oldRecords is not None:
+            oldRecords.close()
+        return oldFiles
+
+    def close(self):
+        for f in self.files:
+            f.close()
+        if self.records is not None:
+            self.records.close()
+        if self.commit is not None:
+            self.commit.stop()
+
+
+MARKERS = ("ROTATE,", "SE,", "RECOVER,")
+
+
+def _truncate_torn(path):
+    """Cut a last line that has no ``\n`` (a torn write); returns the bytes removed."""
+    size = os.path.getsize(path)
+    with open(path, "rb+") as handle:
+        end = size
+        while end > 0:
+            start = max(0, end - 65536)
+            handle.seek(start)
+            chunk = handle.read(end - start)
+            if end == size and chunk.endswith(b"\n"):
+                return 0
+            pos = chunk.rfind(b"\n")
+            if pos >= 0:
+                end = start + pos + 1
+                break
+            end = start
+        handle.truncate(end)
+        handle.flush()
+        os.fsync(handle.fileno())
+    return size - end
+
+
+def _last_line(path):
+    with open(path, "rb") as handle:
+        handle.seek(max(0, os.path.getsize(path) - 4096))
+        lines = handle.read().decode("utf-8", "ignore").splitlines()
+    return lines[-1] if lines else ""
+
+
+def _clip_index(path, size):
+    """Drop torn rows and rows pointing past ``size`` from an unfinished ``.idx``."""
+    _truncate_torn(path)
+    with open(path) as handle:
+        rows = handle.readlines()
+    kept = []
+    for row in rows:
+        fields = row.rstrip("\n").split(",")
+        if fields[0] == "kind" or (len(fields) == 8 and fields[6].isdigit() and int(fields[6]) < size):
+            kept.append(row)
+    if len(kept) != len(rows):
+        tmpPath = path + ".tmp"
+        with open(tmpPath, "w") as handle:
+            handle.writelines(kept)
+        os.replace(tmpPath, path)
+
+
+def _count_lines(path, minFields, minCode=None):
+    """Count data lines (not markers or headers) with at least ``minFields`` fields."""
+    count = 0
+    with open(path, "rb") as handle:
+        for raw in handle:
+            words = raw.decode("utf-8", "ignore").split(",")
+            if len(words) < minFields:
+                continue
+            try:
+                code = int(words[0])
+            except ValueError:
+                continue
+            if minCode is None or code >= minCode:
+                count += 1
+    return count
+
+
+def session_finished(trialPath):
+    """A session pair is finished when its ``.trial.csv`` ends with a marker."""
+    return _last_line(trialPath).startswith(MARKERS)
+
+
+def recover_session(datPath, policy=None):
+    """Finish a ``.dat``/``.trial.csv`` pair left open by a crash.
+
+    Torn last lines are truncated, index rows past the new end are dropped
+    and ``RECOVER,<epoch>,<dataLines>,<trialLines>,<dat_md5>,<trial_md5>``
+    (the same fields as ``ROTATE``) is appended to both files; closing them
+    writes the ``.md5`` sidecars and finalizes the indexes.  Returns a
+    summary dict, or ``None`` if the pair is finished (or has no trial file).
+    """
+    trialPath = datPath.replace(".dat", ".trial.csv")
+    if not os.path.exists(trialPath) or session_finished(trialPath):
+        return None
+    policy = policy or FlushPolicy()
+    paths = [p for p in (datPath, trialPath) if os.path.exists(p)]
+    torn = {}
+    for path in paths:
+        torn[path] = _truncate_torn(path)
+        idxPath = SessionIndex.index_path(path)
+        if os.path.exists(idxPath):
+            _clip_index(idxPath, os.path.getsize(path))
+    dataLines = _count_lines(datPath, 8) if datPath in paths else 0
+    trialLines = _count_lines(trialPath, 7, minCode=200)
+
+    recoverPolicy = FlushPolicy(
+        checksums=True,
+        index=policy.index and os.path.exists(SessionIndex.index_path(trialPath)),
+        sync="always",
+    )
+    files = [SessionFile(path, recoverPolicy) for path in paths]
+    digests = [f.hexdigest() for f in files]
+    if len(files) == 1:
+        digests.insert(0, "NA")
+    marker = "RECOVER,{},{},{},{},{}\n".format(
+        int(time.time()), dataLines, trialLines, digests[0], digests[1]
+    )
+    indexKey = SessionIndex.format_key("MARK", "RECOVER")
+    for f in files:
+        try:
+            f.write(marker, count=False, indexKey=indexKey)
+        finally:
+            f.close()
+    return {
+        "dat": datPath,
+        "trial": trialPath,
+        "dataLines": dataLines,
+        "trialLines": trialLines,
+        "tornBytes": dict((os.path.basename(p), n) for p, n in torn.items()),
+        "marker": marker.strip(),
+    }
+
+
+# ``MainCode.getTimeFormat`` stamp in the session file names
+SESSION_TIME_PATTERN = r"\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2}"
+
+
+def _open_paths():
+    """Real paths of every file held open by any process (``/proc/*/fd``)."""
+    paths = set()
+    for fdDir in glob.glob("/proc/[0-9]*/fd"):
+        try:
+            fds = os.listdir(fdDir)
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                paths.add(os.readlink(os.path.join(fdDir, fd)))
+            except OSError:
+                pass
+    return paths
+
+
+def recover_sessions(outDir, subjectName, policy=None, exclude=(), min_age=10.0):
+    """``recover_session`` every unfinished session of ``subjectName`` in ``outDir``.
+
+    Only ``<subjectName>-<YYYY-MM-DD-HH-MM-SS>.dat`` matches, so a subject
+    whose name merely starts with ``subjectName`` (e.g. ``Rat-A`` for
+    ``Rat``) is never touched.  Pairs modified within the last ``min_age``
+    seconds or held open by any process (another board, another MainCode)
+    are skipped as live.
+    """
+    results = []
+    nameRe = re.compile(re.escape(subjectName) + "-" + SESSION_TIME_PATTERN + r"\.dat$")
+    pattern = os.path.join(glob.escape(outDir), glob.escape(subjectName) + "-*.dat")
+    candidates = [
+        p for p in sorted(glob.glob(pattern))
+        if nameRe.match(os.path.basename(p)) and p not in exclude
+    ]
+    openPaths = _open_paths() if candidates else set()
+    now = time.time()
+    for datPath in candidates:
+        pair = [datPath, datPath.replace(".dat", ".trial.csv")]
+        pair = [p for p in pair if os.path.exists(p)]
+        if any(now - os.path.getmtime(p) < min_age for p in pair):
+            continue
+        if any(os.path.realpath(p) in openPaths for p in pair):
+            continue
+        result = recover_session(datPath, policy)
+        if result is not None:
+            results.append(result)
+    return results
+
+
+class SessionLogger(object):
+    """Buffered writer for the session ``.log`` file (and optional JSONL twin).
+
+    Entries keep the legacy layout (separator, timestamp, one item per line).
+    ``log`` is thread-safe because alert callbacks may log from other threads.
+    """
+
+    SEPARATOR = "--------------- \n"
+
+    def __init__(self, path, flush_sec=1.0, jsonl_path=None, max_pending=500):
+        self.path = path
+        self.jsonl_path = jsonl_path
+        self.flush_sec = max(0.0, float(flush_sec))
+        self.max_pending = max(1, int(max_pending))
+        self.entries = 0
+        self._lock = threading.Lock()
+        self._pending = []
+        self._jsonPending = []
+        self._firstPending = None
+        self._handle = open(path, "a")
+        self._jsonHandle = open(jsonl_path, "a") if jsonl_path else None
+
+    @classmethod
+    def from_config(cls, path, userConfig):
+        """Read the optional ``Log_Flush_Sec`` and ``Log_JSONL`` keys."""
+        jsonlPath = None
+        if userConfig.get("Log_JSONL", "false").lower() == "true":
+            jsonlPath = path + ".jsonl"
+        return cls(
+            path,
+            flush_sec=userConfig.get("Log_Flush_Sec", 1.0),
+            jsonl_path=jsonlPath,
+        )
+
+    @property
+    def closed(self):
+        return self._handle is None
+
+    def log(self, msgList):
+        now = datetime.datetime.now()
+        parts = [self.SEPARATOR, now.strftime("%Y-%m-%d-%H-%M-%S"), "\n"]
+        for item in msgList:
+            parts.append(item if "\n" in item else item + "\n")
+        text = "".join(parts)
+
+        record = None
+        if self._jsonHandle is not None:
+            level = msgList[0].strip().rstrip(":") if msgList else ""
+            record = json.dumps(
+                {
+                    "ts": round(time.time(), 3),
+                    "time": now.isoformat(timespec="milliseconds"),
+                    "level": level,
+                    "lines": [item.strip() for item in msgList[1:]],
+                }
+            )
+
+        with self._lock:
+            if self._handle is None:
+                # Logger already closed: fall back to a direct append
+                with open(self.path, "a") as handle:
+                    handle.write(text)
+                return
+            self._pending.append(text)
+            if record is not None:
+                self._jsonPending.append(record + "\n")
+            self.entries += 1
+            if self._firstPending is None:
+                self._firstPending = time.monotonic()
+            if len(self._pending) >= self.max_pending:
+                self._flush_locked()
+
+    def flush_due(self):
+        """Monotonic time at which buffered entries must be flushed, or ``None``."""
+        first = self._firstPending
+        return None if first is None else first + self.flush_sec
+
+    def maybe_flush(self, now=None):
+        due = self.flush_due()
+        if due is None:
+            return False
+        if (now if now is not None else time.monotonic()) >= due:
+            self.flush()
+            return True
+        return False
+
+    def _flush_locked(self):
+        if self._handle is None:
+            return
+        if self._pending:
+            self._handle.write("".join(self._pending))
+            self._handle.flush()
+            self._pending = []
+        if self._jsonPending:
+            self._jsonHandle.write("".join(self._jsonPending))
+            self._jsonHandle.flush()
+            self._jsonPending = []
+        self._firstPending = None
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        with self._lock:
+            try:
+                self._flush_locked()
+            finally:
+                for handle in (self._handle, self._jsonHandle):
+                    if handle is not None:
+                        handle.close()
+                self._handle = None
+                self._jsonHandle = None
+
+
+_sessionLoggers = {}
+
+
+def open_session_logger(path, userConfig):
+    """Open a ``SessionLogger`` for ``path`` and make it the target of ``writeLogFile``."""
+    logger = SessionLogger.from_config(path, userConfig)
+    _sessionLoggers[os.path.abspath(path)] = logger
+    return logger
+
+
+def get_session_logger(path):
+    return _sessionLoggers.get(os.path.abspath(path))
+
+
+def close_session_logger(path):
+    """Flush, close and unregister the logger for ``path`` (if any)."""
+    logger = _sessionLoggers.pop(os.path.abspath(path), None)
+    if logger is not None:
+        logger.close()
@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+
+"""Time the imports and init steps of ``MainCode`` up to the first serial read.
+
+``StartupProfiler.load`` imports a module and records how long it took;
+``step`` times a block of startup work.  ``write`` appends the collected
+timings to ``log.out``:
+
+    INFO: Startup import serial 41.2 ms
+    INFO: Startup syncRPiTime 812.5 ms (at +3.1 ms)
+    ...
+    INFO: Startup total 95231.0 ms at 2024-01-01-10-00-00
+
+``StartupPipeline`` runs the init steps of ``main()`` concurrently: each stage
+starts on its own thread as soon as the stages it depends on have finished,
+and its time and start offset go to the profiler.
+"""
+
+import contextlib
+import importlib
+import threading
+import time
+
+
+class StartupProfiler(object):
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.steps = []  # (name, seconds, start offset or None)
+        self.written = False
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, start=None):
+        """Record a step; ``start`` is its offset from the profiler start (s)."""
+        with self._lock:
+            self.steps.append((name, seconds, start))
+
+    def load(self, name):
+        """``importlib.import_module(name)``, timed as ``import <name>``."""
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        self.add("import " + name, time.perf_counter() - start)
+        return module
+
+    @contextlib.contextmanager
+    def step(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def lines(self):
+        with self._lock:
+            steps = list(self.steps)
+        out = []
+        for name, seconds, start in steps:
+            line = "Startup {} {:.1f} ms".format(name, seconds * 1e3)
+            if start is not None:
+                line += " (at +{:.1f} ms)".format(start * 1e3)
+            out.append(line)
+        out.append(
+            "Startup total {:.1f} ms at {}".format(
+                (time.perf_counter() - self.t0) * 1e3,
+                time.strftime("%Y-%m-%d-%H-%M-%S"),
+            )
+        )
+        return out
+
+    def write(self, path="log.out"):
+        """Append the timings to ``path`` once (later calls do nothing)."""
+        if self.written:
+            return
+        self.written = True
+        try:
+            with open(path, "a") as handle:
+                for line in self.lines():
+                    handle.write("INFO: " + line + "\n")
+        except OSError:
+            pass
+
+
+class StartupPipeline(object):
+    """Run named startup stages concurrently in dependency order.
+
+    Every stage is called with the dict of results of the stages that have
+    finished so far.  When a stage raises (including ``SystemExit`` from
+    ``exit()``), no further stages start, the running ones are waited for and
+    the exception is raised again in the calling thread.
+    """
+
+    def __init__(self, profiler=None):
+        self.profiler = profiler or StartupProfiler()
+        self.stages = {}  # name -> (func, dependencies)
+        self.results = {}
+
+    def add(self, name, func, after=()):
+        self.stages[name] = (func, tuple(after))
+        return self
+
+    def _run_stage(self, name, func, cond, state):
+        start = time.perf_counter()
+        try:
+            result = func(self.results)
+            error = None
+        except BaseException as e:  # exit() in a stage ends the whole pipeline
+            result = None
+            error = e
+        self.profiler.add(name, time.perf_counter() - start, start - self.profiler.t0)
+        with cond:
+            state["running"].discard(name)
+            if error is None:
+                self.results[name] = result
+                state["done"].add(name)
+            elif state["error"] is None:
+                state["error"] = error
+            cond.notify_all()
+
+    def run(self, concurrent=True):
+        """Run every stage; ``concurrent=False`` runs them one by one in the order added."""
+        for name, (_, after) in self.stages.items():
+            for dep in after:
+                if dep not in self.stages:
+                    raise ValueError("Stage {} depends on unknown stage {}".format(name, dep))
+
+        cond = threading.Condition()
+        state = {"done": set(), "running": set(), "error": None}
+        pending = dict(self.stages)
+        if not concurrent:
+            for name, (func, after) in list(pending.items()):
+                if state["error"] is not None or not all(d in state["done"] for d in after):
+                    break
+                del pending[name]
+                state["running"].add(name)
+                self._run_stage(name, func, cond, state)
+        with cond:
+            while concurrent:
+                if state["error"] is None:
+                    for name, (func, after) in list(pending.items()):
+                        if all(dep in state["done"] for dep in after):
+                            del pending[name]
+                            state["running"].add(name)
+                            worker = threading.Thread(
+                                target=self._run_stage,
+                                args=(name, func, cond, state),
+                                name="Startup-" + name,
+                            )
+                            worker.daemon = True
+                            worker.start()
+                if not state["running"]:
+                    break
+                # Short waits keep the main thread responsive to signals
+                cond.wait(0.5)
+
+        if state["error"] is not None:
+            raise state["error"]
+        if pending:
+            raise ValueError("Circular stage dependencies: " + ", ".join(sorted(pending)))
+        return self.results
@@ -4,27 +4,17 @@
 
 The module exposes ``start_storage_monitor`` which spins up a background thread
 that checks the configured filesystem at a fixed interval.  When disk usage
-crosses the configured threshold the monitor sends an email using the same
-credentials the rest of the project already relies on.
+crosses the configured threshold the monitor queues an email on the shared
+``AlertDispatcher`` using the same credentials the rest of the project already
+relies on.
 """
 
-import base64
 import os
 import shutil
-import smtplib
 import threading
 import time
-from datetime import datetime
-from email.mime.text import MIMEText
 
-try:
-    import netifaces  # type: ignore
-except Exception:  # pragma: no cover - optional dependency on the Pi
-    netifaces = None
-
-
-def _now_str():
-    return datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+import AlertDispatcher
 
 
 def _strip_quotes(value):
@@ -49,94 +39,22 @@ def get_user_config(file_name="userInfo.in", splitter_char="="):
     return cfg
 
 
-def _decode_password(encoded):
-    rounds = 1
-    secret = ""
-    parts = encoded.split("|||") if encoded else []
-    if parts:
-        if parts[0].isdigit():
-            rounds = int(parts[0])
-        secret = parts[1] if len(parts) > 1 else ""
-    for _ in range(max(1, rounds)):
-        try:
-            secret = base64.b64decode(secret)
-        except Exception:
-            break
-    if isinstance(secret, (bytes, bytearray)):
-        try:
-            secret = secret.decode("utf-8")
-        except Exception:
-            secret = secret.decode("latin-1", "ignore")
-    else:
-        secret = str(secret)
-    return secret
-
-
-def _resolve_ip():
-    if netifaces is None:
-        return "unknown"
-    try:
-        return netifaces.ifaddresses("eth0")[netifaces.AF_INET][0]["addr"]
-    except Exception:
-        return "unknown"
-
+def send_email(message, user_config, subject="Storage usage high", on_error=None):
+    """Queue a notification email on the shared ``AlertDispatcher`` thread.
 
-def send_email(message, user_config, subject="Storage usage high"):
-    """Send a notification email.  Returns ``True`` if the mail left the host."""
+    Returns ``True`` once the alert is queued, which does not mean it was
+    sent: the caller never waits on SMTP, and a delivery that fails later
+    calls ``on_error(exception)`` from the dispatcher thread.
+    """
     try:
         if user_config.get("Enable_Email", "false").lower() != "true":
             return False
 
-        recipient_email = user_config.get("Email", "")
-        email_user = user_config.get("WD_Email", "")
-        if not recipient_email or not email_user:
+        if not user_config.get("Email", "") or not user_config.get("WD_Email", ""):
             return False
 
-        body = (
-            "Hello {name},\n\n"
-            "This is an automated notification from the RPi watchdog.\n\n"
-            "{body}\n\n"
-            "Date and Time: {ts}\n"
-            "IP address: {ip}\n\n"
-            "-RPi Watchdog"
-        ).format(
-            name=user_config.get("Name", "User"),
-            body=message,
-            ts=_now_str(),
-            ip=_resolve_ip(),
-        )
-
-        msg = MIMEText(body)
-        msg["Subject"] = subject
-        msg["From"] = email_user
-        msg["To"] = recipient_email
-
-        smtp_address = user_config.get("WD_SMTP", "")
-        smtp_port = int(user_config.get("WD_SMTP_Port", 465))
-        use_ssl = user_config.get("WD_SSL", "true").lower() == "true"
-        password = _decode_password(user_config.get("WD_Pass", ""))
-
-        server = None
-        try:
-            if use_ssl:
-                server = smtplib.SMTP_SSL(smtp_address, smtp_port)
-            else:
-                server = smtplib.SMTP(smtp_address, smtp_port)
-
-            server.ehlo()
-            if email_user:
-                try:
-                    server.login(email_user, password)
-                except Exception:
-                    return False
-            server.sendmail(email_user, [recipient_email], msg.as_string())
-        finally:
-            if server is not None:
-                try:
-                    server.quit()
-                except Exception:
-                    pass
-        return True
+        body = "This is an automated notification from the RPi watchdog.\n\n" + message
+        return AlertDispatcher.submit_alert(user_config, subject, body, on_error)
     except Exception:
         return False
 
@@ -187,6 +105,11 @@ class StorageMonitor(threading.Thread):
             return True
         return (now - self._last_notified) >= self.cooldown_sec
 
+    def _delivery_failed(self, error):
+        # Undo the cooldown so the next check sends the alert again
+        self._last_notified = 0.0
+        self._was_above = False
+
     def _build_message(self, pct):
         return (
             "Storage usage is {pct:.1f}% on filesystem for '{path}'.\n"
@@ -206,9 +129,19 @@ class StorageMonitor(threading.Thread):
                 now = time.time()
                 above = pct >= self.threshold_pct
                 if self._should_notify(now, above):
-                    if self._send_email(self._build_message(pct), self.user_config):
-                        self._last_notified = now
-                self._was_above = above
+                    # Record the notification before queueing it, so a delivery
+                    # failure reported right away is not overwritten
+                    previous = self._last_notified
+                    self._last_notified = now
+                    self._was_above = True
+                    if not self._send_email(
+                        self._build_message(pct),
+                        self.user_config,
+                        on_error=self._delivery_failed,
+                    ):
+                        self._last_notified = previous
+                else:
+                    self._was_above = above
             except Exception:
                 # The monitor must never bring down the host application.
                 pass
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+
+"""Online Teensy clock and receive latency estimates.
+
+Every report line carries two Teensy clocks: ``smTime`` (ms since the state
+machine started) and ``nowTime`` (Teensy epoch seconds).  ``TeensyClock`` pairs
+them with the host monotonic time at which the line was received and keeps:
+
+- the host-minus-Teensy clock offset against ``nowTime``: the minimum of
+  ``hostEpoch - nowTime`` over each window.  Lines that happen right after a
+  Teensy second boundary bound the offset from below, so the minimum converges
+  to it despite the 1 s resolution.
+- the Teensy drift in ppm (positive when the Teensy clock runs fast): a
+  least-squares line through the per-window minima of
+  ``hostMonotonicMs - smTime`` within one state machine run
+- the receive latency of each line: how far ``hostMonotonicMs - smTime`` lies
+  above that fitted line, i.e. the USB and host backlog delay on top of the
+  fastest observed path.  The absolute one-way delay is not observable.
+
+Latencies go into a log-bucketed ``LatencyHistogram``; ``summary`` reports the
+rolling p50/p99 for the session log and starts a new interval.
+"""
+
+import bisect
+import math
+import time
+
+
+class LatencyHistogram(object):
+    """Fixed log-spaced buckets (ms) between ``low`` and ``high``."""
+
+    def __init__(self, low=0.05, high=60000.0, ratio=1.1):
+        self.edges = []
+        edge = low
+        while edge < high:
+            self.edges.append(edge)
+            edge *= ratio
+        self.counts = [0] * (len(self.edges) + 1)
+        self.total = 0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.edges, value)] += 1
+        self.total += 1
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, pct):
+        """Upper edge of the bucket holding the ``pct`` percentile (NaN if empty)."""
+        if not self.total:
+            return float("nan")
+        rank = math.ceil(pct / 100.0 * self.total)
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.edges[i] if i < len(self.edges) else self.max
+        return self.max
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.total = 0
+        self.max = 0.0
+
+
+class TeensyClock(object):
+    """Track Teensy clock offset/drift and per-line receive latency.
+
+    ``window_sec`` is the length of the windows whose minima feed the
+    estimates and ``history`` the number of windows kept for the drift fit.
+    """
+
+    def __init__(self, window_sec=60.0, history=30):
+        self.window_sec = max(1.0, float(window_sec))
+        self.history = max(2, int(history))
+        self.histogram = LatencyHistogram()
+        self.lines = 0
+        self.offset = None  # host epoch - Teensy epoch [s]
+        self.drift_ppm = None
+        self._monoToEpoch = time.time() - time.monotonic()
+        self._lastSmTime = None
+        self._points = []  # (hostMs, minimum of hostMs - smTime) per window
+        self._fit = None  # (t0, b0, slope)
+        self._runMin = None  # minimum of hostMs - smTime in this run
+        self._windowEnd = None
+        self._windowMin = None
+        self._windowOffset = None
+
+    def _new_run(self):
+        self._points = []
+        self._fit = None
+        self._runMin = None
+        self._windowMin = None
+
+    def _close_window(self):
+        if self._windowOffset is not None:
+            self.offset = self._windowOffset
+        if self._windowMin is not None:
+            self._points.append(self._windowMin)
+            del self._points[: -self.history]
+            self._refit()
+        self._windowMin = None
+        self._windowOffset = None
+        # Follow NTP adjustments of the host wall clock
+        self._monoToEpoch = time.time() - time.monotonic()
+
+    def _refit(self):
+        points = self._points
+        if len(points) < 2:
+            if points:
+                self._fit = (points[0][0], points[0][1], self._fit[2] if self._fit else 0.0)
+            return
+        n = float(len(points))
+        mt = sum(p[0] for p in points) / n
+        mb = sum(p[1] for p in points) / n
+        sxx = sum((p[0] - mt) ** 2 for p in points)
+        if sxx <= 0:
+            return
+        slope = sum((p[0] - mt) * (p[1] - mb) for p in points) / sxx
+        # Shift the line down onto the lowest window minimum
+        b0 = min(p[1] - slope * (p[0] - mt) for p in points)
+        self._fit = (mt, b0, slope)
+        # smTime gaining on the host clock makes hostMs - smTime fall
+        self.drift_ppm = -slope * 1e6
+
+    def add(self, rxTime, smTime, nowTime):
+        """Record a report line received at monotonic ``rxTime``; returns its latency (ms)."""
+        hostMs = rxTime * 1000.0
+        if self._lastSmTime is not None and smTime < self._lastSmTime:
+            # A new state machine run restarts smTime
+            self._new_run()
+        self._lastSmTime = smTime
+
+        if self._windowEnd is None:
+            self._windowEnd = rxTime + self.window_sec
+        elif rxTime >= self._windowEnd:
+            self._close_window()
+            self._windowEnd = rxTime + self.window_sec
+
+        base = hostMs - smTime
+        if self._windowMin is None or base < self._windowMin[1]:
+            self._windowMin = (hostMs, base)
+        if self._runMin is None or base < self._runMin:
+            self._runMin = base
+        offset = rxTime + self._monoToEpoch - nowTime
+        if self._windowOffset is None or offset < self._windowOffset:
+            self._windowOffset = offset
+
+        if self._fit is not None:
+            t0, b0, slope = self._fit
+            latency = base - (b0 + slope * (hostMs - t0))
+        else:
+            latency = base - self._runMin
+        latency = max(0.0, latency)
+        self.histogram.add(latency)
+        self.lines += 1
+        return latency
+
+    def summary(self, reset=True):
+        """Rolling timing statistics since the previous ``summary``."""
+        hist = self.histogram
+        stats = {
+            "lines": hist.total,
+            "p50_ms": hist.percentile(50),
+            "p99_ms": hist.percentile(99),
+            "max_ms": hist.max,
+            "offset_s": self.offset if self.offset is not None else self._windowOffset,
+            "drift_ppm": self.drift_ppm,
+        }
+        if reset:
+            hist.reset()
+        return stats
+
+
+def format_summary(stats):
+    def fmt(value, spec):
+        return "NA" if value is None or value != value else format(value, spec)
+
+    return (
+        "lines={0}, latency p50={1} ms, p99={2} ms, max={3} ms, "
+        "clock offset={4} s, drift={5} ppm".format(
+            stats["lines"],
+            fmt(stats["p50_ms"], ".2f"),
+            fmt(stats["p99_ms"], ".2f"),
+            fmt(stats["max_ms"], ".2f"),
+            fmt(stats["offset_s"], "+.3f"),
+            fmt(stats["drift_ppm"], "+.1f"),
+        )
+    )
@@ -3,6 +3,7 @@
 from __future__ import print_function
 
 import datetime
+import hashlib
 import logging
 import os
 import subprocess
@@ -12,6 +13,11 @@ import time
 ATM_BACKUP_ROOT = "/home/pi/ATM_backups"
 ATM_BACKUP_ROOT_LEGACY = "/home/pi/ATM_Backups"
 
+# Sidecars written next to a data file by MainCode, moved together with it:
+# suffixes appended to the file name, and suffixes replacing its extension
+COMPANION_SUFFIXES = [".md5", ".idx"]
+COMPANION_ROOT_SUFFIXES = {"dat": [".rec.npy"], "log": [".stats.json"]}
+
 
 def getUserConfig(fileName, splitterChar):
     userConfig = {}
@@ -135,6 +141,63 @@ def findAllFiles(exts, paths):
     return allFiles
 
 
+def findCompanions(file):
+    """
+    Existing sidecars of a data file (e.g. <file>.md5) that travel with it.
+    """
+    names = [file]
+    root, ext = os.path.splitext(file)
+    if ext in (".gz", ".zst"):
+        # Compressed after rotation: <file>.gz keeps <file>.idx and
+        # <session>.dat.gz keeps <session>.rec.npy
+        names.append(root)
+        root, ext = os.path.splitext(root)
+    companions = [name + suffix for name in names for suffix in COMPANION_SUFFIXES]
+    companions += [
+        root + suffix for suffix in COMPANION_ROOT_SUFFIXES.get(ext[1:].lower(), [])
+    ]
+    return [c for c in companions if os.path.isfile(c)]
+
+
+def fileMd5(path):
+    digest = hashlib.md5()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def checkMd5(file, copy=None):
+    """
+    Check file (or its copy) against the <file>.md5 sidecar.
+    Returns None without a sidecar, else True/False.
+    """
+    try:
+        with open(file + ".md5") as md5File:
+            expected = md5File.read().split()[0]
+    except (OSError, IndexError):
+        return None
+    try:
+        return fileMd5(copy or file) == expected
+    except OSError:
+        return False
+
+
+def transferCompanions(file, dest, transferred, tag):
+    """
+    rsync the sidecars of a moved file to the same destination.
+    """
+    for companion in findCompanions(file):
+        cmd = "sudo rsync %s %s" % (companion, dest)
+        try:
+            logPrint("%s: moving companion:\n%s" % (tag, cmd))
+            proc = subprocess.run(cmd, shell=True)
+            if proc.returncode == 0:
+                transferred.append(cmd)
+        except Exception as e:
+            logPrint("%s: FAILED to copy companion:\n%s\n%s" % (tag, cmd, e))
+
+
 def findLatest(files, exts):
     latest = {}
     logPrint("findLatest: finding latest files")
@@ -222,6 +285,10 @@ def transfer(files, dest, latest, fps=None, skipLatest=False):
 
             ext = "mp4"
 
+        if checkMd5(file) is False:
+            logPrint("transfer: checksum mismatch, not moved:\n%s" % file)
+            continue
+
         extDest = os.path.join(dest, ext)
 
         # cmd = "sudo rsync %s %s" % (file, os.path.join(file, extDest))
@@ -231,6 +298,7 @@ def transfer(files, dest, latest, fps=None, skipLatest=False):
             logPrint("transfer: moving:\n%s" % cmd)
             subprocess.run(cmd, shell=True)
             transferred.append(cmd)
+            transferCompanions(file, extDest, transferred, "transfer")
 
         except Exception as e:
             logPrint("transfer: FAILED to copy:\n%s\n%s" % (cmd, e))
@@ -259,6 +327,10 @@ def specificTransfer(files, dest, latest, fps=None, skipLatest=False):
 
             ext = "mp4"
 
+        if checkMd5(file) is False:
+            logPrint("specificTransfer: checksum mismatch, not moved:\n%s" % file)
+            continue
+
         if ext == "events" or ext == "frames" or ext == "mp4":
             extDest = (
                 os.path.join(dest, "Video", os.path.basename(os.path.dirname(file)))
@@ -283,6 +355,7 @@ def specificTransfer(files, dest, latest, fps=None, skipLatest=False):
             logPrint("specificTransfer: moving:\n%s" % cmd)
             subprocess.run(cmd, shell=True)
             transferred.append(cmd)
+            transferCompanions(file, extDest, transferred, "specificTransfer")
 
         except Exception as e:
             logPrint("transfer: FAILED to copy:\n%s\n%s" % (cmd, e))
@@ -318,13 +391,15 @@ def makeDirs(exts, mountPoint, specificTransfer):
     return dailyDirPath
 
 
-def deleteMoved(transferred, latest, keepLatest=True):
+def deleteMoved(transferred, latest, keepLatest=True, owners=None):
     logPrint("deleteMoved: deleting moved files")
+    owners = owners or {}
 
     for transferCmd in transferred:
         file = transferCmd.split()[2]
 
-        if keepLatest and file in latest.values():
+        # Sidecars stay as long as their data file stays
+        if keepLatest and owners.get(file, file) in latest.values():
             logPrint("deleteMoved: is the latest file, skipping:\n%s" % file)
             continue
 
@@ -339,12 +414,29 @@ def deleteMoved(transferred, latest, keepLatest=True):
 
 
 def verify(cmds):
+    """
+    Check that every moved file arrived; copies of files with a .md5
+    sidecar are checked against it. Returns the sources that failed.
+    """
+    failed = []
     for cmd in cmds:
         source = cmd.split(" ")[2]
         file = os.path.basename(source)
         dest = cmd.split(" ")[3]
-        files = os.listdir(dest)
+        try:
+            files = os.listdir(dest)
+        except OSError:
+            files = []
         logPrint("verify: found %s in %s: %s" % (file, dest, file in files))
+        if file not in files:
+            failed.append(source)
+            continue
+        matched = checkMd5(source, os.path.join(dest, file))
+        if matched is not None:
+            logPrint("verify: checksum of %s: %s" % (file, "OK" if matched else "MISMATCH"))
+            if not matched:
+                failed.append(source)
+    return failed
 
 
 def _safe_subject_name(raw):
@@ -501,6 +593,10 @@ def transferRawMode(
                 logPrint("transferRawMode: skip h264 (convert fail) %s: %s" % (file, e))
                 continue
 
+        if checkMd5(file) is False:
+            logPrint("transferRawMode: checksum mismatch, not moved: %s" % file)
+            continue
+
         # Decide destination
         if ext in ("mp4", "events", "frames"):
             dest_dir = videos_dir
@@ -531,6 +627,7 @@ def transferRawMode(
                 )
                 continue
             moved.append(cmd)
+            transferCompanions(file, dest_dir + "/", moved, "transferRawMode")
         except Exception as e:
             logPrint("transferRawMode: rsync exception %s: %s" % (file, e))
     return moved
@@ -589,6 +686,11 @@ def main():
     )
 
     allFiles = findAllFiles(exts, lookInPaths)
+    # Sidecars are moved with their data file, not on their own
+    owners = dict(
+        (companion, file) for file in allFiles for companion in findCompanions(file)
+    )
+    allFiles = [file for file in allFiles if file not in owners]
 
     if len(allFiles) == 0:
         logPrint("main: no files found for transfer")
@@ -621,11 +723,17 @@ def main():
         )
 
     time.sleep(10)
-    verify(transferred)
+    failed = verify(transferred)
+    if failed:
+        # Keep the local copies (and their sidecars) of failed transfers
+        failed += [c for f in list(failed) for c in findCompanions(f)]
+        failed += [owners.get(f) for f in list(failed) if f in owners]
+        logPrint("main: not deleting failed transfers:\n%s" % failed)
+        transferred = [cmd for cmd in transferred if cmd.split()[2] not in failed]
 
     if userInfo["Delete_Moved"].lower() == "true":
         keepLatest = userInfo["Keep_Latest"].lower() == "true"
-        deleteMoved(transferred, latest, keepLatest)
+        deleteMoved(transferred, latest, keepLatest, owners)
 
     sync_code_backups(userInfo, mountpoint)
 
@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+
+"""``AnalogPyramid.query`` picks a level by ``width`` over the data it has."""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy  # noqa: E402
+
+import AnalogCapture  # noqa: E402
+import AnalogPyramid  # noqa: E402
+
+SAMPLES = 20000  # 20 s at 1 kHz
+
+
+def write_window(outDir, fmt, levels=(10, 100, 1000)):
+    rows = numpy.zeros((SAMPLES, 3), dtype=numpy.int64)
+    rows[:, 0] = numpy.arange(SAMPLES) + 5000
+    rows[:, 1] = numpy.arange(SAMPLES) % 1024
+    rows[:, 2] = 512
+    window = AnalogCapture.AnalogWindow(
+        os.path.join(outDir, "an.1.5000.2-3"), 5000, fmt, pins=[2, 3], levels=levels
+    )
+    window.write(rows)
+    window.close()
+    return window.path, rows
+
+
+class QueryTest(unittest.TestCase):
+    def setUp(self):
+        self.outDir = tempfile.mkdtemp(prefix="pyramid-")
+
+    def tearDown(self):
+        shutil.rmtree(self.outDir, ignore_errors=True)
+
+    def test_open_range_selects_by_width(self):
+        path, _ = write_window(self.outDir, "binary")
+        for t0, t1 in ((None, None), (None, 25000), (5000, None)):
+            self.assertEqual(AnalogPyramid.query(path, t0, t1, width=1000)[0], 10)
+            self.assertEqual(AnalogPyramid.query(path, t0, t1, width=10)[0], 1000)
+            self.assertEqual(AnalogPyramid.query(path, t0, t1, width=5000)[0], 1)
+        # Only the last second is left after t0 = 24000
+        self.assertEqual(AnalogPyramid.query(path, 24000, None, width=50)[0], 10)
+
+    def test_text_file_without_levels(self):
+        path, rows = write_window(self.outDir, "text", levels=())
+        factor, times, mins, maxs, means = AnalogPyramid.query(path, 6000, 6009)
+        self.assertEqual(factor, 1)
+        self.assertEqual(times.tolist(), rows[1000:1010, 0].tolist())
+        self.assertEqual(mins.tolist(), rows[1000:1010, 1:].tolist())
+        self.assertEqual(AnalogPyramid.query(path)[1].tolist(), rows[:, 0].tolist())
+
+    def test_text_file_with_levels(self):
+        path, _ = write_window(self.outDir, "text")
+        self.assertEqual(AnalogPyramid.query(path, width=1000)[0], 10)
+        self.assertEqual(AnalogPyramid.query(path, width=10)[0], 1000)
+
+
+if __name__ == "__main__":
+    unittest.main()
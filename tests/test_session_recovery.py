@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+
+"""``SessionWriters.recover_sessions`` must only touch its own, finished-writing sessions."""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import SessionWriters  # noqa: E402
+
+HEADER = "eventCode,port1Prob,port2Prob,chosenPort,rewarded,trialId,blockId\n"
+
+
+def write_crashed_session(outDir, subject, stamp, age=60.0):
+    """A pair without an ``SE`` marker and with a torn last line, ``age`` seconds old."""
+    datPath = os.path.join(outDir, "{}-{}.dat".format(subject, stamp))
+    trialPath = datPath.replace(".dat", ".trial.csv")
+    with open(datPath, "w") as handle:
+        handle.write("11,1,6,1,0,1700000000,0,0\n11,2,6,1,0,17")
+    with open(trialPath, "w") as handle:
+        handle.write(HEADER + "200,80,20,1,1,1,0\n")
+    old = time.time() - age
+    for path in (datPath, trialPath):
+        os.utime(path, (old, old))
+    return datPath, trialPath
+
+
+def read(path):
+    with open(path) as handle:
+        return handle.read()
+
+
+class RecoverSessionsTest(unittest.TestCase):
+    def setUp(self):
+        self.outDir = tempfile.mkdtemp(prefix="recover-")
+
+    def tearDown(self):
+        shutil.rmtree(self.outDir, ignore_errors=True)
+
+    def test_subjects_sharing_a_prefix(self):
+        ratDat, ratTrial = write_crashed_session(self.outDir, "Rat", "2024-01-01-10-00-00")
+        otherDat, otherTrial = write_crashed_session(self.outDir, "Rat-A", "2024-01-01-10-00-00")
+        otherBefore = (read(otherDat), read(otherTrial))
+
+        results = SessionWriters.recover_sessions(self.outDir, "Rat")
+
+        self.assertEqual([r["dat"] for r in results], [ratDat])
+        self.assertTrue(read(ratTrial).startswith(HEADER))
+        self.assertTrue(read(ratTrial).splitlines()[-1].startswith("RECOVER,"))
+        self.assertEqual(read(ratDat).splitlines()[-2], "11,1,6,1,0,1700000000,0,0")
+        # The other subject's files are left exactly as they were
+        self.assertEqual((read(otherDat), read(otherTrial)), otherBefore)
+        self.assertFalse(os.path.exists(otherDat + ".md5"))
+
+        # Rat-A recovers its own session
+        results = SessionWriters.recover_sessions(self.outDir, "Rat-A")
+        self.assertEqual([r["dat"] for r in results], [otherDat])
+
+    def test_recent_and_open_sessions_are_skipped(self):
+        recentDat, _ = write_crashed_session(self.outDir, "Rat", "2024-01-01-10-00-00", age=0.0)
+        openDat, openTrial = write_crashed_session(self.outDir, "Rat", "2024-01-02-10-00-00")
+        with open(openDat, "a"):
+            results = SessionWriters.recover_sessions(self.outDir, "Rat")
+        self.assertEqual(results, [])
+        self.assertFalse(read(openTrial).splitlines()[-1].startswith("RECOVER,"))
+
+        results = SessionWriters.recover_sessions(self.outDir, "Rat", min_age=0.0)
+        self.assertEqual(sorted(r["dat"] for r in results), sorted([recentDat, openDat]))
+
+    def test_other_file_names_are_ignored(self):
+        write_crashed_session(self.outDir, "Rat", "backup")
+        self.assertEqual(SessionWriters.recover_sessions(self.outDir, "Rat"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()